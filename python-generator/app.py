@@ -1,15 +1,46 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
-from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, AsyncIterator, Callable, Tuple
 import os
-from supabase import create_client, Client
-import google.generativeai as genai
-import pdfplumber
+import asyncio
+import math
 import tempfile
+import time
 import json
 import logging
+from contextlib import asynccontextmanager
+
+from clickstream import (
+    ClickstreamBuffer, ClickstreamBufferFull, SQLiteSpool, create_clickstream_sink, normalize_events,
+)
+from coalescing import SingleFlight
+from document_artifacts import ARTIFACTS_VERSION, build_artifacts, summary_context
+from gemini_client import (
+    GeminiClient, GeminiRateLimiter, GeminiRateLimitError, GeminiUnavailableError, error_status,
+    retry_after_seconds,
+)
+from ingestion_jobs import IngestionQueue, SQLiteJobStore
+from item_repair import (
+    ITEM_ARRAYS, fill_placeholders, item_quality, item_text, merge_items, parse_item_count, repair_slots,
+    requested_items,
+)
+from json_stream import IncrementalJSONParser
+from metrics import SIZE_BUCKETS, MetricFamily, MetricsRegistry, SpanRecorder, TimingMiddleware
+from pdf_extraction import (
+    ExtractionLimitError, PDFExtractionEngine, PageRanges, PageTextWriter, PageTier,
+    ProgressCallback, format_page_range, page_in_ranges, page_index, page_tier_summary,
+    parse_page_range, select_pages, slice_pages,
+)
+from prompt_compaction import ContextCache, compact_text, count_tokens
+from quiz_postprocess import normalize_question, postprocess_quiz
+from result_cache import create_result_cache, generation_fingerprint, parse_flag
+from retrieval import RetrievalIndexCache, retrieve_context
+from text_cache import ExtractedTextCache, sha256_bytes
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
 
 # ============================================================================
 # CONFIGURATION
@@ -26,19 +57,288 @@ SUPABASE_KEY = os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 if not SUPABASE_URL or not SUPABASE_KEY:
     logger.warning("Supabase URL/Key not found. PDF processing will fail.")
     # You might want to raise an Exception here if Supabase is critical
-    supabase = None
-else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Initialize Gemini
+# The async client (and the supabase package itself) is created on first use,
+# inside the running event loop of the worker that needs it
+supabase: Optional["AsyncClient"] = None
+_supabase_lock = asyncio.Lock()
+
+async def get_supabase() -> Optional["AsyncClient"]:
+    """Return the shared async Supabase client, creating it on first use"""
+    global supabase
+    if supabase is None and SUPABASE_URL and SUPABASE_KEY:
+        async with _supabase_lock:
+            if supabase is None:
+                from supabase import acreate_client
+
+                supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    return supabase
+
+# Server-side writes (clickstream inserts) use the service role key when it is
+# set, like the Next.js API routes; otherwise the shared anon client
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+supabase_admin: Optional["AsyncClient"] = None
+
+async def get_supabase_admin() -> Optional["AsyncClient"]:
+    """Return the service-role Supabase client, creating it on first use"""
+    global supabase_admin
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        return await get_supabase()
+    if supabase_admin is None and SUPABASE_URL:
+        async with _supabase_lock:
+            if supabase_admin is None:
+                from supabase import acreate_client
+
+                supabase_admin = await acreate_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    return supabase_admin
+
+# Initialize Gemini (the SDK is configured by gemini_client on first use)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     logger.warning("GEMINI_API_KEY not found. Generation will fail.")
     # Raise Exception if Gemini is critical
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
 
-app = FastAPI(title="ProLearnAI Python Generator", version="1.0.1")
+GEMINI_MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
+
+# Worker processes on this instance (set by gunicorn.conf.py, and read by
+# uvicorn --workers too). Each has its own rate limiter and extraction pool,
+# so per-instance budgets are split between them.
+SERVER_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+# Quota for this instance (0 disables a limit), shared evenly by the workers,
+# and retry policy for 429/5xx
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 60))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", 1_000_000))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 4))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", 1))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", 30))
+GEMINI_EXPECTED_OUTPUT_TOKENS = int(os.getenv("GEMINI_EXPECTED_OUTPUT_TOKENS", 2048))
+
+gemini_client = GeminiClient(
+    GeminiRateLimiter(GEMINI_RPM / SERVER_WORKERS, GEMINI_TPM / SERVER_WORKERS),
+    max_retries=GEMINI_MAX_RETRIES,
+    backoff_base=GEMINI_BACKOFF_BASE_SECONDS,
+    backoff_max=GEMINI_BACKOFF_MAX_SECONDS,
+    expected_output_tokens=GEMINI_EXPECTED_OUTPUT_TOKENS,
+    api_key=GEMINI_API_KEY,
+)
+# metadata.generated_from of placeholder results; these are never cached
+FALLBACK_SOURCE = "gemini-direct (fallback)"
+
+# Extracted text cache (memory LRU + size-bounded disk tier)
+PDF_TEXT_CACHE_DIR = os.getenv(
+    "PDF_TEXT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "prolearn-text-cache")
+)
+PDF_TEXT_CACHE_MEMORY_ITEMS = int(os.getenv("PDF_TEXT_CACHE_MEMORY_ITEMS", 32))
+PDF_TEXT_CACHE_DISK_MB = int(os.getenv("PDF_TEXT_CACHE_DISK_MB", 256))
+
+text_cache = ExtractedTextCache(
+    PDF_TEXT_CACHE_DIR,
+    memory_items=PDF_TEXT_CACHE_MEMORY_ITEMS,
+    disk_max_bytes=PDF_TEXT_CACHE_DISK_MB * 1024 * 1024,
+)
+
+# Page extraction (process pool for large documents, serial otherwise). The
+# pool size is per worker process; by default the workers split min(4, CPUs).
+PDF_EXTRACT_WORKERS = int(os.getenv(
+    "PDF_EXTRACT_WORKERS", max(1, min(4, os.cpu_count() or 1) // SERVER_WORKERS)
+))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 24))
+# PDFs larger than this are spilled to a memory-mapped temp file instead of
+# being parsed straight from the downloaded buffer
+PDF_SPILL_THRESHOLD_MB = float(os.getenv("PDF_SPILL_THRESHOLD_MB", 32))
+# Per-request limits (413 beyond them). Pages are released as soon as their
+# text is extracted, so a request holds its PDF bytes plus the extracted
+# text, which stays in memory up to PDF_TEXT_SPOOL_MB and spills to disk after.
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 1000))
+PDF_MAX_MEMORY_MB = float(os.getenv("PDF_MAX_MEMORY_MB", 256))
+PDF_TEXT_SPOOL_MB = float(os.getenv("PDF_TEXT_SPOOL_MB", 8))
+# Read simple pages from the PDF's text layer and run full layout analysis
+# only on pages with columns, tables or no usable text (see pdf_extraction)
+PDF_FAST_TIER = os.getenv("PDF_FAST_TIER", "true").lower() in ("1", "true", "yes")
+
+extraction_engine = PDFExtractionEngine(
+    workers=PDF_EXTRACT_WORKERS,
+    min_parallel_pages=PDF_PARALLEL_MIN_PAGES,
+    max_pages=PDF_MAX_PAGES,
+    fast_tier=PDF_FAST_TIER,
+)
+
+# Retrieval: PDFs whose text exceeds the budget are chunked, indexed (BM25) and
+# only the chunks most relevant to the query are sent to the model
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 30000))
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", 1200))
+RETRIEVAL_MAX_CHUNKS = int(os.getenv("RETRIEVAL_MAX_CHUNKS", 80))
+
+retrieval_index_cache = RetrievalIndexCache(int(os.getenv("RETRIEVAL_INDEX_CACHE_ITEMS", 16)))
+
+# Document artifacts: ingestion also stores a heading outline and a
+# hierarchical summary of every ARTIFACT_PAGE_GROUP_SIZE pages (see
+# document_artifacts). Summaries of PDFs over RETRIEVAL_TOKEN_BUDGET are then
+# generated from these instead of from retrieved chunks.
+DOC_ARTIFACTS = os.getenv("DOC_ARTIFACTS", "true").lower() in ("1", "true", "yes")
+ARTIFACT_PAGE_GROUP_SIZE = int(os.getenv("ARTIFACT_PAGE_GROUP_SIZE", 8))
+ARTIFACT_SUMMARY_CHARS = int(os.getenv("ARTIFACT_SUMMARY_CHARS", 800))
+
+# Token budget for the source text in a prompt, per generation type, after
+# retrieval and compaction (headers/footers, whitespace, duplicate blocks)
+PROMPT_TOKEN_BUDGETS = {
+    "quiz": int(os.getenv("PROMPT_TOKEN_BUDGET_QUIZ", 32000)),
+    "assignment": int(os.getenv("PROMPT_TOKEN_BUDGET_ASSIGNMENT", 32000)),
+    "summary": int(os.getenv("PROMPT_TOKEN_BUDGET_SUMMARY", 64000)),
+}
+PROMPT_TOKEN_BUDGET_DEFAULT = int(os.getenv("PROMPT_TOKEN_BUDGET_DEFAULT", 32000))
+
+# Prepared (retrieved and compacted) prompt contexts per source, query and
+# type, reused by retries, repair prompts and repeated requests
+context_cache = ContextCache(int(os.getenv("PROMPT_CONTEXT_CACHE_ITEMS", 32)))
+
+# Repair mode: invalid or missing quiz questions/assignment tasks are
+# regenerated with a follow-up prompt for just those items (a result with
+# nothing usable is regenerated whole). At most REPAIR_MAX_ATTEMPTS follow-up
+# calls per generation; items still bad after that get placeholders. 0 turns
+# repair off.
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", 2))
+
+# Generation result cache: "memory" (per process), "sqlite" (shared by the
+# workers on an instance) or "none". Pass settings.fresh=true to bypass it.
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", 24 * 3600))
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", 1024))
+RESULT_CACHE_PATH = os.getenv(
+    "RESULT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "prolearn-results.sqlite3")
+)
+
+result_cache = create_result_cache(
+    RESULT_CACHE_BACKEND, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ITEMS, RESULT_CACHE_PATH
+)
+
+# Single-flight coalescing: concurrent identical downloads/extractions and
+# identical generations share one execution
+pdf_flight = SingleFlight("pdf")
+generation_flight = SingleFlight("generation")
+
+# /generate/batch limits
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 10))
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_DEADLINE_SECONDS", 120))
+
+# Per-stage concurrency limits. Downloads and Gemini calls are awaited, so
+# these bound in-flight I/O rather than threads; extraction is CPU-bound and
+# runs in an executor, so its limit should stay near the core count.
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 32))
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", max(2, PDF_EXTRACT_WORKERS)))
+GENERATE_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", 256))
+
+download_limiter = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+extract_limiter = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+generate_limiter = asyncio.Semaphore(GENERATE_CONCURRENCY)
+
+# Background PDF ingestion (/process-pdf jobs), queued in a local SQLite file
+JOB_QUEUE_PATH = os.getenv(
+    "JOB_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "prolearn-jobs.sqlite3")
+)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Wait before retrying a failed job, doubled for every further attempt
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", 10))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 120))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 24 * 3600))
+# On shutdown (including a worker recycled by gunicorn.conf.py), running jobs
+# get this long to finish before they are handed back to the queue
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", 20))
+# Minimum interval between page-progress writes for a job
+JOB_PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Clickstream ingestion (POST /track/batch): events are buffered per worker and
+# bulk inserted into public.clickstream once CLICKSTREAM_BATCH_SIZE are waiting
+# or every CLICKSTREAM_FLUSH_SECONDS. Past CLICKSTREAM_MAX_BUFFERED events,
+# requests get 429. While the database is unreachable, batches are spooled to
+# a local SQLite file and replayed later. CLICKSTREAM_SINK=local writes JSON
+# lines to CLICKSTREAM_LOCAL_PATH instead of Supabase; none disables the
+# endpoint.
+CLICKSTREAM_SINK = os.getenv("CLICKSTREAM_SINK", "supabase")
+CLICKSTREAM_BATCH_SIZE = int(os.getenv("CLICKSTREAM_BATCH_SIZE", 500))
+CLICKSTREAM_FLUSH_SECONDS = float(os.getenv("CLICKSTREAM_FLUSH_SECONDS", 2))
+CLICKSTREAM_MAX_BUFFERED = int(os.getenv("CLICKSTREAM_MAX_BUFFERED", 20000))
+CLICKSTREAM_MAX_EVENTS_PER_REQUEST = int(os.getenv("CLICKSTREAM_MAX_EVENTS_PER_REQUEST", 1000))
+CLICKSTREAM_SPOOL_PATH = os.getenv(
+    "CLICKSTREAM_SPOOL_PATH", os.path.join(tempfile.gettempdir(), "prolearn-clickstream-spool.sqlite3")
+)
+CLICKSTREAM_LOCAL_PATH = os.getenv(
+    "CLICKSTREAM_LOCAL_PATH", os.path.join(tempfile.gettempdir(), "prolearn-clickstream.jsonl")
+)
+
+clickstream_sink = create_clickstream_sink(CLICKSTREAM_SINK, get_supabase_admin, CLICKSTREAM_LOCAL_PATH)
+clickstream_buffer = ClickstreamBuffer(
+    clickstream_sink,
+    SQLiteSpool(CLICKSTREAM_SPOOL_PATH),
+    batch_size=CLICKSTREAM_BATCH_SIZE,
+    flush_seconds=CLICKSTREAM_FLUSH_SECONDS,
+    max_buffered=CLICKSTREAM_MAX_BUFFERED,
+) if clickstream_sink else None
+
+# Prometheus metrics (GET /metrics) and per-stage timing spans. Set
+# TIMING_HEADER=true to add X-Timing to every response; otherwise clients
+# opt in per request with an 'X-Timing: 1' header.
+TIMING_HEADER = os.getenv("TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+metrics_registry = MetricsRegistry()
+stage_seconds = metrics_registry.histogram(
+    "prolearn_stage_duration_seconds", "Time spent in each pipeline stage", ("stage", "type")
+)
+request_seconds = metrics_registry.histogram(
+    "prolearn_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+generation_seconds = metrics_registry.histogram(
+    "prolearn_generation_duration_seconds", "End-to-end latency of one generated item", ("type", "outcome")
+)
+generations_total = metrics_registry.counter(
+    "prolearn_generations_total",
+    "Generated items by outcome (ok, recovered, repaired, partial, fallback, cache_hit, error)",
+    ("type", "outcome")
+)
+repaired_items_total = metrics_registry.counter(
+    "prolearn_repaired_items_total",
+    "Quiz questions/assignment tasks filled in by repair mode (regenerated, placeholder)",
+    ("type", "outcome")
+)
+prompt_tokens = metrics_registry.histogram(
+    "prolearn_prompt_tokens", "Estimated prompt size in tokens", ("type",), SIZE_BUCKETS
+)
+response_chars = metrics_registry.histogram(
+    "prolearn_response_chars", "Model response size in characters", ("type",), SIZE_BUCKETS
+)
+pdf_pages_total = metrics_registry.counter(
+    "prolearn_pdf_pages_extracted_total", "Extracted PDF pages by extraction tier (fast, layout)",
+    ("tier",)
+)
+span = SpanRecorder(stage_seconds).span
+
+def preload_heavy_modules() -> None:
+    """
+    Import the SDKs that are otherwise loaded on first use (Gemini, Supabase,
+    pdfplumber). A preloading server calls this in its master process, so
+    forked workers share the modules copy-on-write and boot instantly.
+    Creates no clients, connections, threads or pools.
+    """
+    started = time.perf_counter()
+    import google.generativeai  # noqa: F401
+    import pdfplumber  # noqa: F401
+    import supabase  # noqa: F401
+    logger.info(f"Preloaded heavy modules in {time.perf_counter() - started:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ingestion_queue.start()
+    if clickstream_buffer:
+        clickstream_buffer.start()
+    yield
+    await ingestion_queue.stop(JOB_SHUTDOWN_GRACE_SECONDS)
+    if clickstream_buffer:
+        await clickstream_buffer.stop()
+    extraction_engine.shutdown()
+
+app = FastAPI(title="ProLearnAI Python Generator", version="1.0.1", lifespan=lifespan)
 
 # Add CORS middleware to allow requests from Next.js frontend
 app.add_middleware(
@@ -47,7 +347,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Timing"],
 )
+app.add_middleware(TimingMiddleware, histogram=request_seconds, always=TIMING_HEADER)
 
 # ============================================================================
 # DATA MODELS
@@ -66,44 +368,96 @@ class PDFProcessRequest(BaseModel):
     pdf_id: str
     bucket_name: Optional[str] = "uploadFiles"
 
+class GenerationSpec(BaseModel):
+    type: str  # "quiz" | "assignment" | "summary"
+    text: Optional[str] = None  # Query for this item; defaults to the batch text
+    bloom_level: Optional[str] = None
+    settings: Optional[Dict[str, Any]] = None  # Merged over the batch settings
+
+class BatchGenerateRequest(BaseModel):
+    text: str
+    items: List[GenerationSpec]
+    material_meta: Optional[Dict[str, Any]] = None
+    pdf_id: Optional[str] = None
+    bucket_name: Optional[str] = "materials"
+    settings: Optional[Dict[str, Any]] = None  # Shared settings; page_range applies to the whole batch
+    deadline_seconds: Optional[float] = None  # Defaults to BATCH_DEADLINE_SECONDS
+
+class ClickstreamBatchRequest(BaseModel):
+    events: List[Any]  # Objects shaped like /api/track bodies (event_name, component, ...)
+
 # ============================================================================
 # PDF PROCESSING
 # ============================================================================
 
 class PDFProcessor:
-    def download_pdf_from_supabase(self, pdf_id: str, bucket_name: str = "uploadFiles") -> bytes:
+    async def download_pdf_from_supabase(self, pdf_id: str, bucket_name: str = "uploadFiles") -> bytes:
         """Download PDF from Supabase storage"""
-        if not supabase:
+        client = await get_supabase()
+        if not client:
             raise HTTPException(status_code=500, detail="Supabase client not initialized.")
         try:
             logger.info(f"Downloading PDF: {pdf_id} from bucket: {bucket_name}")
-            response = supabase.storage.from_(bucket_name).download(pdf_id)
+            with span("download"):
+                async with download_limiter:
+                    response = await client.storage.from_(bucket_name).download(pdf_id)
             logger.info("PDF downloaded successfully.")
             return response
         except Exception as e:
             logger.error(f"Supabase download error: {e}")
             raise HTTPException(status_code=404, detail=f"PDF not found or Supabase error: {str(e)}")
     
-    def extract_text_from_pdf(self, pdf_bytes: bytes) -> str:
-        """Extract full text from PDF using pdfplumber"""
+    def extract_text_from_pdf(self, pdf_bytes: bytes, page_ranges: Optional[PageRanges] = None,
+                              progress: Optional[ProgressCallback] = None) -> Tuple[str, List[PageTier]]:
+        """
+        Extract text from PDF, one '--- Page N ---' block per page, plus the
+        (page, tier, reason) extraction tier of every page.
+        Only pages within page_ranges (see parse_page_range) are parsed.
+        Raises 413 when the document exceeds PDF_MAX_PAGES or PDF_MAX_MEMORY_MB.
+        """
+        memory_limit = int(PDF_MAX_MEMORY_MB * 1024 * 1024)
+        if len(pdf_bytes) > memory_limit:
+            raise HTTPException(
+                status_code=413,
+                detail=f"PDF is {len(pdf_bytes)} bytes; the limit is {PDF_MAX_MEMORY_MB:g} MB"
+            )
+
         tmp_path = None
         try:
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-                tmp_file.write(pdf_bytes)
-                tmp_path = tmp_file.name
+            source = pdf_bytes
+            if len(pdf_bytes) > PDF_SPILL_THRESHOLD_MB * 1024 * 1024:
+                # Spill large uploads to disk; workers map the file instead of
+                # each receiving a copy of the buffer
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
+                    tmp_file.write(pdf_bytes)
+                    tmp_path = tmp_file.name
+                source = tmp_path
+                logger.info(f"Spilled {len(pdf_bytes)} byte PDF to {tmp_path}")
             
-            logger.info(f"Extracting text from temporary PDF: {tmp_path}")
-            # Extract text from all pages
-            full_text = ""
-            with pdfplumber.open(tmp_path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
+            logger.info(f"Extracting text from {len(pdf_bytes)} byte PDF (pages: {format_page_range(page_ranges)})")
+            # Stream the selected pages (in parallel for large documents) into
+            # a spillable buffer; the text shares the memory limit with the PDF
+            with span("extract"), PageTextWriter(
+                spool_chars=int(PDF_TEXT_SPOOL_MB * 1024 * 1024),
+                max_chars=memory_limit - len(pdf_bytes),
+            ) as writer:
+                page_tiers: List[PageTier] = []
+                for page_number, page_text, tier, reason in extraction_engine.iter_pages(
+                        source, page_ranges, progress):
+                    page_tiers.append((page_number, tier, reason))
+                    pdf_pages_total.inc(tier=tier)
                     if page_text:
-                        full_text += f"\n\n--- Page {i+1} ---\n\n" + page_text
+                        writer.write_page(page_number, page_text)
+                full_text = writer.getvalue()
             
-            logger.info(f"Text extraction complete. Total length: {len(full_text)}")
-            return full_text.strip()
+            layout_pages = sum(1 for _, tier, _ in page_tiers if tier != "fast")
+            logger.info(f"Text extraction complete. Total length: {len(full_text)} "
+                        f"({layout_pages} of {len(page_tiers)} pages needed layout analysis)")
+            return full_text, page_tiers
+
+        except ExtractionLimitError as e:
+            logger.warning(f"PDF rejected: {e}")
+            raise HTTPException(status_code=413, detail=str(e))
         
         except Exception as e:
             logger.error(f"PDF processing failed: {e}")
@@ -115,13 +469,181 @@ class PDFProcessor:
                 os.unlink(tmp_path)
                 logger.info(f"Cleaned up temporary file: {tmp_path}")
 
+    async def extract_text_async(self, pdf_bytes: bytes, page_ranges: Optional[PageRanges] = None,
+                                 progress: Optional[ProgressCallback] = None) -> Tuple[str, List[PageTier]]:
+        """Run extract_text_from_pdf in an executor, bounded by EXTRACT_CONCURRENCY"""
+        async with extract_limiter:
+            return await asyncio.to_thread(self.extract_text_from_pdf, pdf_bytes, page_ranges, progress)
+
+    async def get_pdf_text(self, pdf_id: str, bucket_name: str = "uploadFiles",
+                     refresh: bool = False, page_ranges: Optional[PageRanges] = None,
+                     report: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        """
+        Return extracted text for a stored PDF, going through the text cache.
+
+        A warm bucket/pdf_id alias skips both download and parsing. With
+        refresh=True the PDF is always downloaded so the alias tracks the
+        current bytes, but parsing is still skipped if the content is known.
+        With page_ranges, pages are sliced from the cached full text when it
+        exists; otherwise only the requested pages are parsed.
+
+        report(stage=..., pages_done=..., pages_total=...) receives progress
+        updates (ingestion jobs); a call that joins another in-flight fetch
+        of the same file gets none.
+
+        "extraction" summarizes the tier each page was extracted with (see
+        page_tier_summary); None for text cached before tiers were recorded.
+        """
+        if not refresh:
+            digest = text_cache.digest_for(bucket_name, pdf_id)
+            text = self._cached_text(digest, page_ranges) if digest else None
+            if text is not None:
+                logger.info(f"Text cache hit for {bucket_name}/{pdf_id}")
+                return {"text": text, "sha256": digest, "cached": True,
+                        "extraction": self._cached_extraction(digest, page_ranges)}
+
+        # Concurrent requests for the same file share one download + extraction
+        return await pdf_flight.do(
+            f"{bucket_name}/{pdf_id}|{format_page_range(page_ranges)}",
+            lambda: self._fetch_pdf_text(pdf_id, bucket_name, page_ranges, report)
+        )
+
+    async def _fetch_pdf_text(self, pdf_id: str, bucket_name: str, page_ranges: Optional[PageRanges],
+                              report: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+        report = report or (lambda **fields: None)
+        report(stage="downloading")
+        pdf_bytes = await self.download_pdf_from_supabase(pdf_id, bucket_name)
+        digest = await asyncio.to_thread(sha256_bytes, pdf_bytes)
+        text = self._cached_text(digest, page_ranges)
+        cached = text is not None
+        if cached:
+            extraction = self._cached_extraction(digest, page_ranges)
+        else:
+            report(stage="extracting")
+            progress = lambda done, total: report(pages_done=done, pages_total=total)
+            text, page_tiers = await self.extract_text_async(pdf_bytes, page_ranges, progress)
+            report(stage="saving")
+            cache_key = self._cache_key(digest, page_ranges)
+            text_cache.put(cache_key, text)
+            text_cache.put_page_tiers(cache_key, page_tiers)
+            extraction = page_tier_summary(page_tiers)
+        text_cache.set_alias(bucket_name, pdf_id, digest)
+        return {"text": text, "sha256": digest, "cached": cached, "extraction": extraction}
+
+    @staticmethod
+    def _cache_key(digest: str, page_ranges: Optional[PageRanges]) -> str:
+        if page_ranges is None:
+            return digest
+        return sha256_bytes(f"{digest}|pages={format_page_range(page_ranges)}".encode("utf-8"))
+
+    def _cached_text(self, digest: str, page_ranges: Optional[PageRanges]) -> Optional[str]:
+        if page_ranges is not None:
+            text = text_cache.get(self._cache_key(digest, page_ranges))
+            if text is not None:
+                return text
+        full_text = text_cache.get(digest)
+        if full_text is None:
+            return None
+        if page_ranges is None:
+            return full_text
+        # Ingested documents have a page index, which saves scanning the text
+        index = text_cache.get_page_index(digest)
+        if index is not None:
+            return slice_pages(full_text, index, page_ranges)
+        return select_pages(full_text, page_ranges)
+
+    def _cached_extraction(self, digest: str, page_ranges: Optional[PageRanges]) -> Optional[Dict[str, Any]]:
+        page_tiers = None
+        if page_ranges is not None:
+            page_tiers = text_cache.get_page_tiers(self._cache_key(digest, page_ranges))
+        if page_tiers is None:
+            page_tiers = text_cache.get_page_tiers(digest)
+        if page_tiers is None:
+            return None
+        return page_tier_summary([record for record in page_tiers
+                                  if page_in_ranges(record[0], page_ranges)])
+
 # Initialize global PDF processor
 pdf_processor = PDFProcessor()
 
+
+async def ingest_pdf(job: Dict[str, Any], report: Callable[..., None]) -> Dict[str, Any]:
+    """
+    Ingestion job handler: download, extract and cache a PDF with its page
+    index and (DOC_ARTIFACTS) its outline and summaries
+    """
+    last_write = 0.0
+
+    def throttled_report(**fields: Any) -> None:
+        # Page progress arrives once per page; only write it every so often
+        nonlocal last_write
+        now = time.monotonic()
+        edge = fields.get("pages_done") in (0, fields.get("pages_total"))
+        if "stage" in fields or edge or now - last_write >= JOB_PROGRESS_INTERVAL_SECONDS:
+            last_write = now
+            report(**fields)
+
+    # Always re-download so the cache alias follows the current file
+    extracted = await pdf_processor.get_pdf_text(
+        job["pdf_id"], job["bucket_name"], refresh=True, report=throttled_report
+    )
+    text, digest = extracted["text"], extracted["sha256"]
+
+    index = text_cache.get_page_index(digest)
+    if index is None:
+        index = await asyncio.to_thread(page_index, text)
+        text_cache.put_page_index(digest, index)
+
+    result = {
+        "text_length": len(text),
+        "sha256": digest,
+        "cached": extracted["cached"],
+        "pages_with_text": len(index),
+        "extraction": extracted["extraction"],
+    }
+    if DOC_ARTIFACTS:
+        artifacts = text_cache.get_artifacts(digest)
+        if (artifacts is None or artifacts.get("version") != ARTIFACTS_VERSION
+                or artifacts.get("group_size") != ARTIFACT_PAGE_GROUP_SIZE):
+            throttled_report(stage="analyzing")
+            artifacts = await asyncio.to_thread(
+                build_artifacts, text, ARTIFACT_PAGE_GROUP_SIZE, ARTIFACT_SUMMARY_CHARS
+            )
+            text_cache.put_artifacts(digest, artifacts)
+        result["artifacts"] = {
+            "outline_entries": len(artifacts["outline"]),
+            "summary_levels": len(artifacts["summaries"]),
+            "page_groups": len(artifacts["summaries"][0]),
+        }
+    return result
+
+
+ingestion_queue = IngestionQueue(
+    SQLiteJobStore(JOB_QUEUE_PATH),
+    ingest_pdf,
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_delay=JOB_RETRY_DELAY_SECONDS,
+    stale_seconds=JOB_STALE_SECONDS,
+    retention_seconds=JOB_RETENTION_SECONDS,
+)
+
 # ============================================================================
 # GENERATION WITH GEMINI
 # ============================================================================
 
+def build_context_prompt(query: str, full_text: str, bloom_level: str) -> str:
+    """Intro shared by every prompt: the source text, query and Bloom level"""
+    return f"""You are an expert educational content generator. Analyze the following text and generate the requested material.
+    
+    Text:
+    {full_text}
+    
+    User Query: {query}
+    Bloom's Taxonomy Level: {bloom_level}
+    """
+
+
 def build_prompt(query: str, full_text: str, generation_type: str, 
                  bloom_level: Optional[str] = None, settings: Optional[Dict[str, Any]] = None) -> str:
     """
@@ -133,17 +655,10 @@ def build_prompt(query: str, full_text: str, generation_type: str,
     settings = settings or {}
     
     # Common intro for context
-    context_prompt = f"""You are an expert educational content generator. Analyze the following text and generate the requested material.
-    
-    Text:
-    {full_text}
-    
-    User Query: {query}
-    Bloom's Taxonomy Level: {bloom_level}
-    """
+    context_prompt = build_context_prompt(query, full_text, bloom_level)
 
     if generation_type == "quiz":
-        num_questions = settings.get("num_questions", 5)
+        num_questions = requested_items("quiz", settings)
         page_range = settings.get("page_range", "all") # Default to "all"
         
         prompt = f"""{context_prompt}
@@ -176,7 +691,7 @@ Return the response in this exact JSON schema:
 }}"""
     
     elif generation_type == "assignment":
-        num_questions = settings.get("num_questions", 3) # Fewer tasks for an assignment
+        num_questions = requested_items("assignment", settings)
         page_range = settings.get("page_range", "all")
         
         prompt = f"""{context_prompt}
@@ -263,144 +778,399 @@ Requirements:
         "query": "{query}"
     }}
 }}"""
-    
+
     return prompt
 
 
-def normalize_choice_entries(choices: Any) -> List[Dict[str, str]]:
-    """Normalize choices into a list of {key, text} dictionaries."""
-    normalized: List[Dict[str, str]] = []
-
-    if isinstance(choices, dict):
-        # Preserve ordering if already ordered, otherwise sort by key
-        items = choices.items()
-        if not isinstance(choices, OrderedDict):
-            items = sorted(items, key=lambda item: str(item[0]))
-        for idx, (key, value) in enumerate(items):
-            label = str(key).strip() or chr(65 + idx)
-            text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
-            normalized.append({
-                "key": label.upper(),
-                "text": text.strip()
-            })
-    elif isinstance(choices, list):
-        for idx, choice in enumerate(choices):
-            if isinstance(choice, dict):
-                label = choice.get("key") or choice.get("label") or chr(65 + idx)
-                text = choice.get("text") or choice.get("value") or ""
-            else:
-                label = chr(65 + idx)
-                text = str(choice)
-            normalized.append({
-                "key": str(label).strip().upper(),
-                "text": text.strip()
-            })
+def build_repair_prompt(query: str, full_text: str, generation_type: str, bloom_level: Optional[str],
+                        settings: Optional[Dict[str, Any]], count: int, existing: List[str]) -> str:
+    """
+    Follow-up prompt for `count` replacement quiz questions or assignment
+    tasks, over the same context as the original prompt. `existing` lists
+    the items being kept, so the model does not repeat them.
+    """
+    bloom_level = bloom_level or ("remember" if generation_type == "quiz" else "apply")
+    page_range = (settings or {}).get("page_range", "all")
+    context_prompt = build_context_prompt(query, full_text, bloom_level)
+    keep = "\n".join(f"  {i}. {text[:200]}" for i, text in enumerate(existing, 1) if text) or "  (none)"
 
-    return [entry for entry in normalized if entry["text"]]
+    if generation_type == "quiz":
+        return f"""{context_prompt}
 
+Requirements:
+- Type: Quiz (replacement questions)
+- Create exactly {count} new multiple-choice questions
+- Each question should have 4 distinct choices
+- Indicate the correct answer key (e.g., "A")
+- Provide a brief explanation for the correct answer
+- Focus on content from pages: {page_range} (if applicable)
+- Ensure questions are appropriate for the {bloom_level} cognitive level
+- Do not repeat or rephrase any of these existing questions:
+{keep}
 
-def normalize_quiz_result(result: Dict[str, Any]) -> Dict[str, Any]:
-    """Ensure quiz questions include normalized choices and derived answer text."""
+Return the response in this exact JSON schema:
+{{
+    "questions": [
+        {{
+            "question": "...",
+            "choices": {{ "A": "...", "B": "...", "C": "...", "D": "..." }},
+            "answer": "A",
+            "level": "{bloom_level}",
+            "explanation": "..."
+        }}
+    ]
+}}"""
+
+    return f"""{context_prompt}
+
+Requirements:
+- Type: Assignment (replacement tasks)
+- Create exactly {count} new assignment tasks
+- Focus on content from pages: {page_range} (if applicable)
+- Ensure tasks are appropriate for the {bloom_level} cognitive level
+- Do not repeat or rephrase any of these existing tasks:
+{keep}
+
+Return the response in this exact JSON schema:
+{{
+    "assignment_tasks": [
+        {{
+            "task_number": 1,
+            "description": "...",
+            "bloom_level": "{bloom_level}",
+            "points": 10
+        }}
+    ]
+}}"""
+
+
+def normalize_quiz_question(question: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize one question's choices and derive its answer text."""
+    normalize_question(question)
+    return question
+
+
+def normalize_quiz_result(result: Dict[str, Any], requested: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Normalize every quiz question in one pass and record which ones need
+    regeneration (invalid or near-duplicate) under metadata.quality.
+    """
     questions = result.get("questions")
     if not isinstance(questions, list):
         return result
 
-    for question in questions:
-        if not isinstance(question, dict):
-            continue
-
-        raw_choices = question.get("choices", [])
-        normalized_choices = normalize_choice_entries(raw_choices)
-        question["choices"] = normalized_choices
-
-        # Derive answer text when possible
-        answer = question.get("answer")
-        answer_text = None
-        if isinstance(answer, str):
-            answer_clean = answer.strip()
-            # Attempt match on key (letter)
-            answer_text = next(
-                (c["text"] for c in normalized_choices if c["key"].upper() == answer_clean.upper()),
-                None
-            )
-            # Attempt match on text itself
-            if not answer_text:
-                answer_text = next(
-                    (c["text"] for c in normalized_choices if c["text"].strip().lower() == answer_clean.lower()),
-                    None
-                )
-        elif isinstance(answer, dict):
-            answer_text = answer.get("text") or answer.get("value")
+    report = postprocess_quiz(questions, requested)
+    metadata = result.get("metadata")
+    if not isinstance(metadata, dict):
+        metadata = result["metadata"] = {}
+    metadata["quality"] = report
+    return result
 
-        # Store derived answer text if available
-        if answer_text:
-            question["answer_text"] = answer_text.strip()
-        else:
-            question.pop("answer_text", None)
 
+def finalize_generation_result(result: Dict[str, Any], generation_type: str,
+                               settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Normalize a parsed model result and stamp its metadata"""
+    if generation_type == "quiz":
+        result = normalize_quiz_result(result, requested_items(generation_type, settings))
+    
+    # Add 'generated_from' to metadata
+    if "metadata" in result:
+        result["metadata"]["generated_from"] = "gemini-2.5-flash-json-mode"
+    else:
+        result["metadata"] = {"generated_from": "gemini-2.5-flash-json-mode"}
     return result
 
 
-def generate_with_gemini(query: str, full_text: str, generation_type: str,
-                         bloom_level: Optional[str] = None, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def has_usable_content(result: Any, generation_type: str) -> bool:
+    """Whether a (possibly recovered) model result holds anything worth returning"""
+    if not isinstance(result, dict):
+        return False
+    if generation_type == "quiz":
+        return bool(result.get("questions"))
+    if generation_type == "assignment":
+        return bool(result.get("assignment_tasks"))
+    if generation_type == "summary":
+        return bool(result.get("content"))
+    return any(key != "metadata" for key in result)
+
+
+def parse_model_output(parser: IncrementalJSONParser, query: str, generation_type: str,
+                       bloom_level: Optional[str], settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Turn the model text fed to `parser` into a result. Truncated or malformed
+    JSON keeps every complete element (reported under metadata.recovery);
+    the fallback response is only used when nothing usable survives.
+    """
+    value, report = parser.finish()
+    if report is None:
+        return finalize_generation_result(value, generation_type, settings)
+
+    logger.error(f"JSON parsing failed: {report['error']}")
+    logger.error(f"Response text (first 500 chars): {parser.text[:500]}")
+    if has_usable_content(value, generation_type):
+        result = finalize_generation_result(value, generation_type, settings)
+        result["metadata"]["recovery"] = report
+        logger.warning(f"Recovered partial {generation_type} result "
+                       f"({report['recovered_chars']}/{report['received_chars']} chars, lost: {report['lost']})")
+        return result
+
+    return generate_fallback_response(query, generation_type, bloom_level, settings, f"JSON parsing error: {report['error']}")
+
+
+def is_cacheable_result(result: Dict[str, Any]) -> bool:
+    """
+    Fallback results, results with placeholder items and partially recovered
+    results that repair did not complete are never cached
+    """
+    metadata = result.get("metadata") or {}
+    if metadata.get("generated_from") == FALLBACK_SOURCE:
+        return False
+    repair = metadata.get("repair")
+    if repair is not None:
+        return not repair["placeholders"]
+    return "recovery" not in metadata
+
+
+def gemini_failure_response(e: Exception, query: str, generation_type: str, bloom_level: Optional[str],
+                            settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Raise for Gemini errors the client should see (rate limits, outages, a
+    rejected API key); otherwise return a fallback result
+    """
+    error_type = type(e).__name__
+    logger.error(f"Gemini generation failed ({error_type}): {e}")
+    status = error_status(e)
+
+    # Retries already ran out for these; tell the client when to come back
+    if isinstance(e, GeminiRateLimitError) or status == 429:
+        retry_after = e.retry_after if isinstance(e, GeminiRateLimitError) else retry_after_seconds(e)
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else None
+        raise HTTPException(status_code=429, detail=f"Gemini rate limit exceeded: {str(e)}", headers=headers)
+    if isinstance(e, GeminiUnavailableError):
+        raise HTTPException(status_code=503, detail=f"Gemini unavailable: {str(e)}")
+
+    # A missing or revoked key fails every request; a fallback would hide it
+    if status in (401, 403):
+        raise HTTPException(status_code=500, detail=f"Gemini API configuration error: {str(e)}")
+
+    # For other generation errors, use fallback
+    return generate_fallback_response(query, generation_type, bloom_level, settings, f"{error_type}: {str(e)}")
+
+
+async def generate_with_gemini(query: str, full_text: str, generation_type: str,
+                               bloom_level: Optional[str] = None, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Generate content using Gemini with native JSON mode"""
     
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured.")
         
+    label = metric_type(generation_type)
     try:
         # 1. Build prompt
-        prompt = build_prompt(query, full_text, generation_type, bloom_level, settings)
-        
-        # 2. Initialize Gemini model
-        model = genai.GenerativeModel("gemini-2.5-flash-preview-09-2025")
-        
-        # 3. *** NEW: Configure for JSON output ***
-        generation_config = genai.GenerationConfig(
-            response_mime_type="application/json"
-        )
+        with span("prompt", label):
+            prompt = build_prompt(query, full_text, generation_type, bloom_level, settings)
+        tokens = count_tokens(prompt)
+        prompt_tokens.observe(tokens, type=label)
         
         logger.info(f"Generating content for type: {generation_type}, bloom: {bloom_level}")
         
-        # 4. Generate response
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config
-        )
-        
-        # 5. *** NEW: Simplified JSON parsing ***
-        # The response.text is now a guaranteed JSON string
-        result = json.loads(response.text)
-
-        if generation_type == "quiz":
-            result = normalize_quiz_result(result)
+        # 2. Generate response with the shared JSON-mode model (rate limited,
+        #    retried on 429/5xx; awaited, so no thread is held for the latency)
+        with span("gemini", label):
+            async with generate_limiter:
+                response = await gemini_client.generate(
+                    GEMINI_MODEL_NAME, prompt, tokens
+                )
         
-        # Add 'generated_from' to metadata
-        if "metadata" in result:
-            result["metadata"]["generated_from"] = "gemini-2.5-flash-json-mode"
-        else:
-            result["metadata"] = {"generated_from": "gemini-2.5-flash-json-mode"}
+        # 3. Parse JSON, recovering complete elements if the output was truncated
+        with span("parse", label):
+            parser = IncrementalJSONParser()
+            parser.feed(response.text)
+            response_chars.observe(len(parser.text), type=label)
+            result = parse_model_output(parser, query, generation_type, bloom_level, settings)
 
         logger.info("Gemini generation successful.")
         return result
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing failed: {e}")
-        logger.error(f"Response text (first 500 chars): {response.text[:500] if 'response' in locals() else 'N/A'}")
-        # Only use fallback for JSON parsing errors
-        return generate_fallback_response(query, generation_type, bloom_level, settings, f"JSON parsing error: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
-        error_type = type(e).__name__
-        logger.error(f"Gemini generation failed ({error_type}): {e}")
         logger.error(f"Failed prompt (first 500 chars): {prompt[:500] if 'prompt' in locals() else 'N/A'}")
+        return gemini_failure_response(e, query, generation_type, bloom_level, settings)
+
+
+# Top-level arrays whose finished elements are streamed as discrete events
+STREAM_ITEM_EVENTS = {
+    "quiz": ("questions", "question"),
+    "assignment": ("assignment_tasks", "task"),
+}
+
+
+async def stream_with_gemini(query: str, full_text: str, generation_type: str,
+                             bloom_level: Optional[str] = None,
+                             settings: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming variant of generate_with_gemini. Yields (event, data) pairs:
+    one "question"/"task" event per finished quiz question or assignment
+    task, "delta" text fragments for other types, and a final "result" with
+    the same shape generate_with_gemini returns.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=500, detail="Gemini API key not configured.")
+
+    array_key, item_event = STREAM_ITEM_EVENTS.get(generation_type, (None, None))
+    parser = IncrementalJSONParser([array_key] if array_key else [])
+
+    label = metric_type(generation_type)
+    try:
+        with span("prompt", label):
+            prompt = build_prompt(query, full_text, generation_type, bloom_level, settings)
+        tokens = count_tokens(prompt)
+        prompt_tokens.observe(tokens, type=label)
         
-        # For critical errors (auth, quota, etc.), raise HTTPException instead of fallback
-        error_msg = str(e).lower()
-        if any(keyword in error_msg for keyword in ['api key', 'authentication', 'permission', 'quota', 'rate limit']):
-            raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
+        logger.info(f"Streaming content for type: {generation_type}, bloom: {bloom_level}")
         
-        # For other generation errors, use fallback
-        return generate_fallback_response(query, generation_type, bloom_level, settings, f"{error_type}: {str(e)}")
+        # Covers the whole stream, including time the client takes to read it
+        with span("gemini", label):
+            async with generate_limiter:
+                response = await gemini_client.generate(
+                    GEMINI_MODEL_NAME, prompt, tokens, stream=True
+                )
+                async for chunk in response:
+                    try:
+                        fragment = chunk.text
+                    except ValueError:
+                        # Chunks without text parts (e.g. the final finish_reason chunk)
+                        continue
+                    if not array_key:
+                        yield "delta", fragment
+                    for _, element in parser.feed(fragment):
+                        if generation_type == "quiz" and isinstance(element, dict):
+                            element = normalize_quiz_question(element)
+                        yield item_event, {"index": parser.emitted - 1, item_event: element}
+
+        response_chars.observe(len(parser.text), type=label)
+        with span("parse", label):
+            result = parse_model_output(parser, query, generation_type, bloom_level, settings)
+        logger.info("Gemini streaming generation finished.")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        result = None
+        if parser.text:
+            # The client already holds the items streamed so far; finish from
+            # the partial text like a truncated response and let repair top it up
+            logger.warning(f"Gemini stream failed after {len(parser.text)} chars "
+                           f"({type(e).__name__}: {e}); keeping the partial response")
+            result = parse_model_output(parser, query, generation_type, bloom_level, settings)
+            if result["metadata"].get("generated_from") == FALLBACK_SOURCE:
+                result = None
+            else:
+                result["metadata"]["stream_error"] = f"{type(e).__name__}: {e}"
+        if result is None:
+            result = gemini_failure_response(e, query, generation_type, bloom_level, settings)
+
+    yield "result", result
+
+
+async def generate_items(query: str, full_text: str, generation_type: str, bloom_level: Optional[str],
+                         settings: Optional[Dict[str, Any]], count: int, existing: List[str]) -> List[Any]:
+    """Ask Gemini for `count` replacement quiz questions or assignment tasks"""
+    label = metric_type(generation_type)
+    with span("prompt", label):
+        prompt = build_repair_prompt(query, full_text, generation_type, bloom_level, settings, count, existing)
+    tokens = count_tokens(prompt)
+    prompt_tokens.observe(tokens, type=label)
+
+    with span("repair", label):
+        async with generate_limiter:
+            response = await gemini_client.generate(GEMINI_MODEL_NAME, prompt, tokens)
+
+    parser = IncrementalJSONParser()
+    parser.feed(response.text)
+    response_chars.observe(len(parser.text), type=label)
+    value, report = parser.finish()
+    if report is not None:
+        logger.warning(f"Repair response was not valid JSON: {report['error']}")
+    items = value.get(ITEM_ARRAYS[generation_type]) if isinstance(value, dict) else None
+    return items if isinstance(items, list) else []
+
+
+async def repair_result(result: Dict[str, Any], query: str, full_text: str, generation_type: str,
+                        bloom_level: Optional[str],
+                        settings: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Tuple[int, Any]]]:
+    """
+    Repair mode. A fallback result is regenerated whole; a quiz or assignment
+    gets replacements for just its invalid or missing items, from follow-up
+    prompts over the same context. At most REPAIR_MAX_ATTEMPTS follow-up
+    calls are made, and items still bad after them become placeholders.
+
+    Returns the result and the (index, item) pairs that changed; the
+    follow-ups are reported under metadata.repair.
+    """
+    if REPAIR_MAX_ATTEMPTS <= 0:
+        return result, []
+
+    label = metric_type(generation_type)
+    attempts = 0
+    regenerated_whole = False
+    while result["metadata"].get("generated_from") == FALLBACK_SOURCE and attempts < REPAIR_MAX_ATTEMPTS:
+        attempts += 1
+        logger.info(f"Regenerating failed {generation_type} (attempt {attempts}/{REPAIR_MAX_ATTEMPTS})")
+        try:
+            result = await generate_with_gemini(query, full_text, generation_type, bloom_level, settings)
+        except HTTPException as e:
+            # Quota or availability problems: keep the fallback we already have
+            logger.warning(f"Stopped regenerating {generation_type}: {e.detail}")
+            break
+        regenerated_whole = True
+
+    array_key = ITEM_ARRAYS.get(generation_type)
+    items = result.get(array_key) if array_key else None
+    if result["metadata"].get("generated_from") == FALLBACK_SOURCE or not isinstance(items, list):
+        if attempts:
+            result["metadata"]["repair"] = {"attempts": attempts, "regenerated": [], "placeholders": []}
+        return result, []
+
+    requested = requested_items(generation_type, settings)
+    report = item_quality(generation_type, items, requested)
+    slots = repair_slots(report)
+    filled = set()
+    while slots and attempts < REPAIR_MAX_ATTEMPTS:
+        attempts += 1
+        logger.info(f"Regenerating {len(slots)} {array_key} item(s) of a {generation_type} "
+                    f"(attempt {attempts}/{REPAIR_MAX_ATTEMPTS})")
+        bad = set(slots)
+        existing = [item_text(generation_type, item) for i, item in enumerate(items) if i not in bad]
+        try:
+            new_items = await generate_items(query, full_text, generation_type, bloom_level, settings,
+                                             len(slots), existing)
+        except Exception as e:
+            logger.warning(f"Repair call failed ({type(e).__name__}): {e}")
+            break
+        filled.update(merge_items(generation_type, items, slots, new_items))
+        report = item_quality(generation_type, items, requested)
+        slots = repair_slots(report)
+
+    if slots:
+        placeholder_settings = {**(settings or {}), "num_questions": max(slots) + 1}
+        placeholders = generate_fallback_response(
+            query, generation_type, bloom_level, placeholder_settings, "Item failed validation after repair"
+        )[array_key]
+        fill_placeholders(items, report, slots, placeholders)
+    result["metadata"]["quality"] = report
+
+    regenerated = sorted((set(range(len(items))) if regenerated_whole else filled) - set(slots))
+    if attempts:
+        result["metadata"]["repair"] = {"attempts": attempts, "regenerated": regenerated, "placeholders": slots}
+    if regenerated:
+        repaired_items_total.inc(len(regenerated), type=label, outcome="regenerated")
+    if slots:
+        repaired_items_total.inc(len(slots), type=label, outcome="placeholder")
+
+    changed = range(len(items)) if regenerated_whole else sorted(filled | set(slots))
+    return result, [(index, items[index]) for index in changed]
 
 
 def generate_fallback_response(query: str, generation_type: str, 
@@ -416,12 +1186,12 @@ def generate_fallback_response(query: str, generation_type: str,
     metadata = {
         "bloom_level": bloom_level,
         "page_range": page_range,
-        "generated_from": "gemini-direct (fallback)",
+        "generated_from": FALLBACK_SOURCE,
         "error": error_msg
     }
 
     if generation_type == "quiz":
-        num_questions = settings.get("num_questions", 5)
+        num_questions = requested_items("quiz", settings)
         metadata["total_questions"] = num_questions
         questions = []
         for i in range(num_questions):
@@ -456,7 +1226,7 @@ def generate_fallback_response(query: str, generation_type: str,
         }
         
     else: # Default to assignment
-        num_tasks = settings.get("num_questions", 3)
+        num_tasks = requested_items("assignment", settings)
         metadata["total_tasks"] = num_tasks
         tasks = [
             {
@@ -476,66 +1246,410 @@ def generate_fallback_response(query: str, generation_type: str,
             "metadata": metadata
         }
 
+# ============================================================================
+# GENERATION PIPELINE
+# ============================================================================
+
+def metric_type(generation_type: str) -> str:
+    """Generation type as a metric label (unknown types share one label)"""
+    return generation_type if generation_type in PROMPT_TOKEN_BUDGETS else "other"
+
+
+def observe_generation(generation_type: str, started: float, result: Optional[Dict[str, Any]]) -> None:
+    """Record latency and outcome of one generated item (result=None for errors)"""
+    if result is None:
+        outcome = "error"
+    else:
+        metadata = result.get("metadata") or {}
+        if metadata.get("cache") == "hit":
+            outcome = "cache_hit"
+        elif metadata.get("generated_from") == FALLBACK_SOURCE:
+            outcome = "fallback"
+        elif (metadata.get("repair") or {}).get("placeholders"):
+            outcome = "partial"
+        elif (metadata.get("repair") or {}).get("attempts"):
+            outcome = "repaired"
+        elif "recovery" in metadata:
+            outcome = "recovered"
+        else:
+            outcome = "ok"
+    label = metric_type(generation_type)
+    generations_total.inc(type=label, outcome=outcome)
+    generation_seconds.observe(time.perf_counter() - started, type=label, outcome=outcome)
+
+
+def request_settings(settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate request settings once, as they are read: num_questions becomes
+    an int within 1..MAX_ITEM_COUNT (unset when null), and anything that is
+    not a whole number is a 400. fresh becomes a bool, so "false" or "0"
+    does not bypass the result cache.
+    """
+    settings = dict(settings or {})
+    if "fresh" in settings:
+        settings["fresh"] = parse_flag(settings["fresh"])
+    try:
+        count = parse_item_count(settings.get("num_questions"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="settings.num_questions must be a whole number.")
+    if count is None:
+        settings.pop("num_questions", None)
+    else:
+        settings["num_questions"] = count
+    return settings
+
+
+async def resolve_source(text: str, pdf_id: Optional[str], bucket_name: Optional[str],
+                         settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Resolve the source material for a generation request.
+
+    Returns {"text", "doc_key", "from_pdf", "extraction", "digest",
+    "page_ranges"}: the PDF text when pdf_id is set (restricted to
+    settings.page_range), otherwise the request text itself. doc_key
+    identifies the exact source text for caching, extraction is the per-page
+    tier summary of PDF text, and digest (the PDF's SHA-256, None for request
+    text) finds its ingestion artifacts.
+    """
+    # If PDF ID provided, extract text from PDF
+    if pdf_id:
+        logger.info(f"Processing PDF ID: {pdf_id}")
+        bucket_name = bucket_name or "materials"
+        try:
+            page_ranges = parse_page_range((settings or {}).get("page_range"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        extracted = await pdf_processor.get_pdf_text(
+            pdf_id, bucket_name, page_ranges=page_ranges
+        )
+        full_text = extracted["text"]
+        doc_key = f"{extracted['sha256']}|{format_page_range(page_ranges)}"
+        extraction = extracted["extraction"]
+        digest = extracted["sha256"]
+    else:
+        # Use provided text directly
+        logger.info("Using provided text directly.")
+        full_text = text
+        doc_key = sha256_bytes(text.encode("utf-8"))
+        extraction = None
+        digest = page_ranges = None
+
+    if not full_text:
+        raise HTTPException(status_code=400, detail="No text content provided or extracted.")
+
+    return {"text": full_text, "doc_key": doc_key, "from_pdf": bool(pdf_id), "extraction": extraction,
+            "digest": digest, "page_ranges": page_ranges}
+
+
+async def generate_for_source(source: Dict[str, Any], query: str, generation_type: str,
+                              bloom_level: Optional[str] = None,
+                              settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Generate one item for a resolved source: result cache lookup, retrieval
+    for long PDFs, then Gemini. Fallback results are never cached.
+    """
+    settings = settings or {}
+    started = time.perf_counter()
+    cache_key = generation_fingerprint(
+        source["doc_key"], query, generation_type, bloom_level, settings, GEMINI_MODEL_NAME
+    )
+    try:
+        result = None
+        if result_cache and not settings.get("fresh"):
+            result = await asyncio.to_thread(result_cache.get, cache_key)
+            if result is not None:
+                logger.info(f"Result cache hit for {generation_type} ({cache_key[:12]})")
+                result["metadata"]["cache"] = "hit"
+
+        if result is None:
+            # Identical requests already in flight share one Gemini call
+            result = await generation_flight.do(
+                cache_key,
+                lambda: _generate_uncached(source, query, generation_type, bloom_level, settings, cache_key)
+            )
+    except Exception:
+        observe_generation(generation_type, started, None)
+        raise
+
+    observe_generation(generation_type, started, result)
+    return result
+
+
+def prepare_context(source: Dict[str, Any], query: str,
+                    generation_type: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Text to put in the prompt for a resolved source, plus the metadata to
+    report with the result: for long PDFs, the ingestion summaries (summary
+    type) or retrieval, then compaction within the generation type's token
+    budget. CPU-bound; run it in a thread.
+    """
+    full_text = source["text"]
+    metadata: Dict[str, Any] = {}
+    if source.get("extraction"):
+        metadata["extraction"] = source["extraction"]
+
+    artifacts_used = False
+    if (source["from_pdf"] and generation_type == "summary" and DOC_ARTIFACTS
+            and source.get("digest") and count_tokens(full_text) > RETRIEVAL_TOKEN_BUDGET):
+        # A summary covers the whole document, which query-ranked chunks do not
+        with span("artifacts", metric_type(generation_type)):
+            artifacts = text_cache.get_artifacts(source["digest"])
+            context = None
+            if artifacts is not None and artifacts.get("version") == ARTIFACTS_VERSION:
+                context = summary_context(artifacts, RETRIEVAL_TOKEN_BUDGET, source.get("page_ranges"))
+        if context is not None:
+            full_text, metadata["artifacts"] = context
+            artifacts_used = True
+
+    if source["from_pdf"] and not artifacts_used:
+        # Keep only the chunks relevant to the query when the text is too long
+        with span("retrieval", metric_type(generation_type)):
+            full_text, retrieval_meta = retrieve_context(
+                full_text,
+                query,
+                source["doc_key"],
+                retrieval_index_cache,
+                RETRIEVAL_TOKEN_BUDGET,
+                RETRIEVAL_CHUNK_CHARS,
+                RETRIEVAL_MAX_CHUNKS,
+            )
+        if retrieval_meta:
+            metadata["retrieval"] = retrieval_meta
+
+    budget = PROMPT_TOKEN_BUDGETS.get(generation_type, PROMPT_TOKEN_BUDGET_DEFAULT)
+    with span("compaction", metric_type(generation_type)):
+        full_text, metadata["prompt"] = compact_text(full_text, budget)
+    return full_text, metadata
+
+
+def cached_context(source: Dict[str, Any], query: str, generation_type: str) -> Tuple[str, Dict[str, Any]]:
+    """prepare_context through the context cache; run it in a thread"""
+    key = f"{source['doc_key']}|{generation_type}|{query}"
+    return context_cache.get_or_build(key, lambda: prepare_context(source, query, generation_type))
+
+
+async def _generate_uncached(source: Dict[str, Any], query: str, generation_type: str,
+                             bloom_level: Optional[str], settings: Dict[str, Any],
+                             cache_key: str) -> Dict[str, Any]:
+    full_text, context_meta = await asyncio.to_thread(cached_context, source, query, generation_type)
+
+    result = await generate_with_gemini(query, full_text, generation_type, bloom_level, settings)
+    result, _ = await repair_result(result, query, full_text, generation_type, bloom_level, settings)
+    result["metadata"].update(context_meta)
+
+    if result_cache and is_cacheable_result(result):
+        await asyncio.to_thread(result_cache.set, cache_key, result)
+    result["metadata"]["cache"] = "miss"
+    return result
+
+
+async def stream_for_source(source: Dict[str, Any], query: str, generation_type: str,
+                            bloom_level: Optional[str] = None,
+                            settings: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Streaming counterpart of generate_for_source (same cache and retrieval)"""
+    settings = settings or {}
+    started = time.perf_counter()
+    cache_key = generation_fingerprint(
+        source["doc_key"], query, generation_type, bloom_level, settings, GEMINI_MODEL_NAME
+    )
+    if result_cache and not settings.get("fresh"):
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"Result cache hit for {generation_type} ({cache_key[:12]})")
+            array_key, item_event = STREAM_ITEM_EVENTS.get(generation_type, (None, None))
+            items = cached.get(array_key) if array_key else None
+            for index, element in enumerate(items if isinstance(items, list) else []):
+                yield item_event, {"index": index, item_event: element}
+            cached["metadata"]["cache"] = "hit"
+            observe_generation(generation_type, started, cached)
+            yield "result", cached
+            return
+
+    try:
+        full_text, context_meta = await asyncio.to_thread(cached_context, source, query, generation_type)
+
+        async for event, data in stream_with_gemini(query, full_text, generation_type, bloom_level, settings):
+            if event == "result":
+                data, changed = await repair_result(data, query, full_text, generation_type,
+                                                    bloom_level, settings)
+                # Replacements for items already sent (or sent for the first time)
+                _, item_event = STREAM_ITEM_EVENTS.get(generation_type, (None, None))
+                for index, element in changed:
+                    yield item_event, {"index": index, item_event: element, "repaired": True}
+                data["metadata"].update(context_meta)
+                if result_cache and is_cacheable_result(data):
+                    await asyncio.to_thread(result_cache.set, cache_key, data)
+                data["metadata"]["cache"] = "miss"
+                observe_generation(generation_type, started, data)
+            yield event, data
+    except Exception:
+        observe_generation(generation_type, started, None)
+        raise
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
 @app.get("/")
-def root():
+async def root():
     return {"ok": True, "service": "python-generator", "version": "1.0.1"}
 
-@app.post("/process-pdf")
-def process_pdf(req: PDFProcessRequest):
-    """Process PDF from Supabase and extract text"""
+def collect_service_metrics() -> List[MetricFamily]:
+    """Cache, coalescing, Gemini and ingestion counters from the existing stats()"""
+    text = text_cache.stats()
+    families = [
+        ("prolearn_text_cache_lookups_total", "counter", "Extracted-text cache lookups by result", [
+            ({"result": "memory_hit"}, text["memory_hits"]),
+            ({"result": "disk_hit"}, text["disk_hits"]),
+            ({"result": "miss"}, text["misses"]),
+        ]),
+    ]
+    if result_cache:
+        results = result_cache.stats()
+        families.append(("prolearn_result_cache_lookups_total", "counter", "Generation result cache lookups by result", [
+            ({"result": "hit"}, results["hits"]),
+            ({"result": "miss"}, results["misses"]),
+        ]))
+    families.append(("prolearn_coalesced_calls_total", "counter", "Calls served by joining an identical in-flight call", [
+        ({"flight": flight.name}, flight.stats()["coalesced"]) for flight in (pdf_flight, generation_flight)
+    ]))
+    gemini = gemini_client.stats()
+    families.append(("prolearn_gemini_calls_total", "counter", "Gemini API calls by result", [
+        ({"result": "attempt"}, gemini["calls"]),
+        ({"result": "retry"}, gemini["retries"]),
+        ({"result": "rate_limited"}, gemini["rate_limited"]),
+        ({"result": "server_error"}, gemini["server_errors"]),
+    ]))
+    families.append(("prolearn_gemini_limiter_wait_seconds_total", "counter", "Time spent queued by the Gemini rate limiter", [
+        ({}, gemini["limiter"]["wait_seconds"]),
+    ]))
+    families.append(("prolearn_ingestion_jobs", "gauge", "Ingestion jobs in the shared queue by status", [
+        ({"status": status}, n) for status, n in ingestion_queue.store.counts().items()
+    ]))
+    if clickstream_buffer:
+        clicks = clickstream_buffer.stats()
+        families.append(("prolearn_clickstream_events_total", "counter", "Clickstream events by outcome", [
+            ({"outcome": outcome}, clicks[outcome])
+            for outcome in ("accepted", "throttled", "written", "spooled", "replayed", "rejected")
+        ]))
+        families.append(("prolearn_clickstream_pending_events", "gauge", "Clickstream events not yet written, by location", [
+            ({"location": "buffer"}, clicks["buffered"]),
+            ({"location": "spool"}, clicks["spool"]),
+        ]))
+    return families
+
+metrics_registry.add_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker"""
+    body = await asyncio.to_thread(metrics_registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats")
+async def stats():
+    """Cache and request-coalescing counters for this worker"""
+    # These may query SQLite (job counts, spool size, sqlite result cache),
+    # which must not block the event loop
+    results, ingestion, clickstream = await asyncio.gather(
+        asyncio.to_thread(result_cache.stats) if result_cache else asyncio.sleep(0),
+        asyncio.to_thread(ingestion_queue.stats),
+        asyncio.to_thread(clickstream_buffer.stats) if clickstream_buffer else asyncio.sleep(0),
+    )
+    return {
+        "text_cache": text_cache.stats(),
+        "result_cache": results,
+        "gemini": gemini_client.stats(),
+        "ingestion": ingestion,
+        "clickstream": clickstream,
+        "coalescing": {
+            "pdf": pdf_flight.stats(),
+            "generation": generation_flight.stats(),
+        },
+    }
+
+@app.post("/process-pdf", status_code=202)
+async def process_pdf(req: PDFProcessRequest):
+    """Queue a PDF from Supabase for text extraction; poll /jobs/{job_id} for progress"""
     try:
-        # Download PDF
-        pdf_bytes = pdf_processor.download_pdf_from_supabase(
-            req.pdf_id, 
-            req.bucket_name
-        )
-        
-        # Extract text with pdfplumber
-        text = pdf_processor.extract_text_from_pdf(pdf_bytes)
-        
-        return {
-            "success": True,
-            "text_length": len(text),
-            "message": "PDF processed successfully"
-        }
+        job = await ingestion_queue.enqueue(req.pdf_id, req.bucket_name)
     except Exception as e:
-        # HTTPException raised in processors will be bubbled up
-        if isinstance(e, HTTPException):
-            raise e
         logger.error(f"Unexpected error in /process-pdf: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "message": "PDF queued for processing"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and per-page progress of a /process-pdf ingestion job"""
+    job = await ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    
+    pages_total = job["pages_total"]
+    return {
+        "job_id": job["id"],
+        "pdf_id": job["pdf_id"],
+        "bucket_name": job["bucket_name"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": {
+            "pages_done": job["pages_done"],
+            "pages_total": pages_total,
+            "percent": round(100 * job["pages_done"] / pages_total, 1) if pages_total else None,
+        },
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+@app.post("/track/batch", status_code=202)
+async def track_batch(req: ClickstreamBatchRequest, request: Request):
+    """Buffer a batch of clickstream events for bulk insertion"""
+    if clickstream_buffer is None:
+        raise HTTPException(status_code=503, detail="Clickstream ingestion is disabled.")
+    if len(req.events) > CLICKSTREAM_MAX_EVENTS_PER_REQUEST:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {CLICKSTREAM_MAX_EVENTS_PER_REQUEST} events per batch.")
+
+    ip_address = (request.headers.get("x-forwarded-for") or request.headers.get("x-real-ip")
+                  or (request.client.host if request.client else None))
+    rows, skipped = normalize_events(req.events, ip_address)
+    try:
+        accepted = clickstream_buffer.add(rows)
+    except ClickstreamBufferFull as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+    return {"ok": True, "accepted": accepted, "skipped": skipped}
 
 @app.post("/generate")
-def generate(req: GenerateRequest):
+async def generate(req: GenerateRequest):
     """Generate quiz or assignment using Gemini directly"""
     try:
-        full_text = ""
-        
-        # If PDF ID provided, extract text from PDF
-        if req.pdf_id:
-            logger.info(f"Processing PDF ID: {req.pdf_id}")
-            bucket_name = req.bucket_name or "materials"
-            pdf_bytes = pdf_processor.download_pdf_from_supabase(req.pdf_id, bucket_name)
-            full_text = pdf_processor.extract_text_from_pdf(pdf_bytes)
-        else:
-            # Use provided text directly
-            logger.info("Using provided text directly.")
-            full_text = req.text
-        
-        if not full_text:
-            raise HTTPException(status_code=400, detail="No text content provided or extracted.")
+        settings = request_settings(req.settings)
+        source = await resolve_source(req.text, req.pdf_id, req.bucket_name, settings)
 
-        # Generate with Gemini directly
-        result = generate_with_gemini(
+        # Generate with Gemini (or the result cache)
+        result = await generate_for_source(
+            source,
             req.text,  # req.text is the user's query/prompt
-            full_text, # full_text is the source material (from PDF or req.text)
             req.type,
             req.bloom_level,
-            req.settings
+            settings
         )
         
         # Add final metadata
@@ -553,6 +1667,128 @@ def generate(req: GenerateRequest):
         logger.error(f"Unexpected error in /generate: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate/stream")
+async def generate_stream(req: GenerateRequest):
+    """
+    Same request as /generate, answered as Server-Sent Events: "question" /
+    "task" events as soon as each item is complete ("delta" text for other
+    types), then "result" with the full response and a closing "done".
+    """
+    try:
+        # Resolve before streaming so bad input still gets a proper status code
+        settings = request_settings(req.settings)
+        source = await resolve_source(req.text, req.pdf_id, req.bucket_name, settings)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in /generate/stream: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        try:
+            async for event, data in stream_for_source(
+                source, req.text, req.type, req.bloom_level, settings
+            ):
+                if event == "result":
+                    data["metadata"].update({
+                        "source": "python-generator",
+                        "material_meta": req.material_meta,
+                        "pdf_id": req.pdf_id if req.pdf_id else None
+                    })
+                yield sse_event(event, data)
+            yield sse_event("done", {})
+        except HTTPException as e:
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Unexpected error in /generate/stream: {e}")
+            yield sse_event("error", {"status": 500, "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/generate/batch")
+async def generate_batch(req: BatchGenerateRequest):
+    """
+    Generate several items (e.g. quiz + assignment + summary) from one source.
+
+    The source is downloaded and extracted once, items are generated
+    concurrently, and every item reports its own result or error. Items still
+    running when the shared deadline passes are cancelled and reported as 504.
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="No generation items provided.")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch.")
+
+    started = time.monotonic()
+    deadline = min(req.deadline_seconds or BATCH_DEADLINE_SECONDS, BATCH_DEADLINE_SECONDS)
+    batch_settings = request_settings(req.settings)
+    item_settings = []
+    for item in req.items:
+        # The source is resolved once, so the batch page_range wins
+        settings = request_settings({**batch_settings, **(item.settings or {})})
+        if "page_range" in batch_settings:
+            settings["page_range"] = batch_settings["page_range"]
+        else:
+            settings.pop("page_range", None)
+        item_settings.append(settings)
+
+    try:
+        source = await asyncio.wait_for(
+            resolve_source(req.text, req.pdf_id, req.bucket_name, batch_settings),
+            timeout=deadline
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Deadline exceeded while loading the source.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in /generate/batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    tasks = []
+    for item, settings in zip(req.items, item_settings):
+        tasks.append(asyncio.create_task(generate_for_source(
+            source, item.text or req.text, item.type, item.bloom_level, settings
+        )))
+
+    remaining = deadline - (time.monotonic() - started)
+    if remaining > 0:
+        await asyncio.wait(tasks, timeout=remaining)
+
+    results = []
+    for index, (item, task) in enumerate(zip(req.items, tasks)):
+        entry: Dict[str, Any] = {"index": index, "type": item.type}
+        if not task.done():
+            task.cancel()
+            entry.update(ok=False, error={"status": 504, "detail": "Deadline exceeded."})
+        elif task.exception() is not None:
+            e = task.exception()
+            if isinstance(e, HTTPException):
+                entry.update(ok=False, error={"status": e.status_code, "detail": e.detail})
+            else:
+                logger.error(f"Batch item {index} ({item.type}) failed: {e}")
+                entry.update(ok=False, error={"status": 500, "detail": str(e)})
+        else:
+            entry.update(ok=True, result=task.result())
+        results.append(entry)
+
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "results": results,
+        "metadata": {
+            "source": "python-generator",
+            "material_meta": req.material_meta,
+            "pdf_id": req.pdf_id if req.pdf_id else None,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round((time.monotonic() - started) * 1000),
+        }
+    }
+
 # ============================================================================
 # Run the application
 # ============================================================================
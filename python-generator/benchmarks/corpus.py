@@ -0,0 +1,104 @@
+import os
+import random
+from typing import Dict, List, Sequence
+
+# ============================================================================
+# SYNTHETIC PDF CORPUS
+# ============================================================================
+#
+# Writes plain-text PDFs (Helvetica, one column) without any PDF library, so
+# the benchmarks need nothing beyond the service's own requirements. Pages
+# carry a running header and footer and a few paragraphs of deterministic
+# pseudo-random lecture text, so extraction, retrieval and compaction all
+# have realistic work to do.
+
+DEFAULT_PAGE_COUNTS = (1, 10, 50, 100, 250, 500)
+LINES_PER_PAGE = 42
+
+_TOPICS = [
+    "photosynthesis", "mitochondria", "enzymes", "osmosis", "genetics", "evolution",
+    "ecosystems", "respiration", "proteins", "membranes", "chromosomes", "hormones",
+]
+_WORDS = """
+the cell uses energy from light to produce glucose and oxygen while carbon dioxide
+is absorbed through small openings in the leaf structure during the day most
+reactions depend on temperature and concentration gradients across a membrane
+students should compare each process with examples from plants animals and fungi
+""".split()
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(page_number: int, num_pages: int, rng: random.Random) -> List[str]:
+    topic = _TOPICS[page_number % len(_TOPICS)]
+    lines = [f"BIO 101 - Introduction to Biology", f"Section {page_number}: {topic.title()}", ""]
+    while len(lines) < LINES_PER_PAGE - 2:
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(10, 14))]
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), topic)
+        lines.append(" ".join(words).capitalize() + ".")
+        if rng.random() < 0.15:
+            lines.append("")
+    lines.append(f"Page {page_number} of {num_pages}")
+    return lines
+
+
+def build_pdf(num_pages: int, seed: int = 0) -> bytes:
+    """A num_pages PDF with text on every page"""
+    rng = random.Random(seed * 100003 + num_pages)
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree exists
+    pages_id = add(b"")
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for page_number in range(1, num_pages + 1):
+        text = "\n".join(f"({_escape(line)}) '" for line in page_lines(page_number, num_pages, rng))
+        stream = f"BT /F1 10 Tf 14 TL 56 800 Td\n{text}\nET".encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, font_id, content_id)
+        ))
+
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, num_pages)
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog, xref
+    )
+    return bytes(out)
+
+
+def corpus_name(num_pages: int) -> str:
+    return f"synthetic-{num_pages:03d}p.pdf"
+
+
+def build_corpus(directory: str, page_counts: Sequence[int] = DEFAULT_PAGE_COUNTS) -> Dict[int, str]:
+    """Write (or reuse) one PDF per page count; returns {pages: path}"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for num_pages in page_counts:
+        path = os.path.join(directory, corpus_name(num_pages))
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(build_pdf(num_pages))
+        paths[num_pages] = path
+    return paths
@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+# ============================================================================
+# LOCAL STAND-INS FOR SUPABASE STORAGE AND GEMINI
+# ============================================================================
+#
+# install_fakes(app) swaps the service's two external dependencies for local
+# fakes, so it can be benchmarked without network access or API quota:
+#
+#   - storage: every bucket is served from one directory of PDFs on disk
+#   - model:   GenerativeModel.generate_content_async returns canned JSON
+#              for the requested type after a configurable latency, and
+#              fails with 503 / 429 at configurable rates
+#
+# Everything is configured from the environment (see FakeModelConfig), so the
+# same fakes work in-process and in the uvicorn server started by run_load.py.
+
+
+class FakeBucket:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def download(self, path: str) -> bytes:
+        full_path = os.path.join(self.directory, os.path.basename(path))
+        if not os.path.exists(full_path):
+            raise FileNotFoundError(f"Object not found: {path}")
+        return await asyncio.to_thread(_read_file, full_path)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class FakeStorage:
+    def __init__(self, directory: str):
+        self._bucket = FakeBucket(directory)
+
+    def from_(self, bucket_name: str) -> FakeBucket:
+        return self._bucket
+
+
+class FakeSupabaseClient:
+    def __init__(self, directory: str):
+        self.storage = FakeStorage(directory)
+
+
+class FakeModelConfig:
+    def __init__(self):
+        self.latency = float(os.getenv("BENCH_MODEL_LATENCY_MS", 800)) / 1000
+        self.jitter = float(os.getenv("BENCH_MODEL_JITTER_MS", 200)) / 1000
+        self.failure_rate = float(os.getenv("BENCH_MODEL_FAILURE_RATE", 0))
+        self.rate_limit_rate = float(os.getenv("BENCH_MODEL_RATE_LIMIT_RATE", 0))
+        self.stream_chunks = int(os.getenv("BENCH_MODEL_STREAM_CHUNKS", 12))
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+
+# "Create 10 questions", or "Create exactly 2 new questions" in repair prompts
+_NUM_QUESTIONS_RE = re.compile(r"Create (?:exactly )?(\d+) ")
+# Items are numbered across responses, so repair replacements are not
+# duplicates of the items they complete
+_item_numbers = itertools.count(1)
+
+
+def canned_response(prompt: str) -> Dict[str, Any]:
+    """Plausible JSON for the type and item count the prompt asks for"""
+    match = _NUM_QUESTIONS_RE.search(prompt)
+    count = int(match.group(1)) if match else 5
+    numbers = [next(_item_numbers) for _ in range(count)]
+    if "- Type: Quiz" in prompt:
+        return {"questions": [{
+            "question": f"Which statement about the material is correct? ({n})",
+            "choices": {"A": "Cells absorb light", "B": "Enzymes store DNA",
+                        "C": "Osmosis needs ATP", "D": "Fungi photosynthesize"},
+            "answer": "A",
+            "level": "remember",
+            "explanation": "The material states that cells absorb light to produce glucose.",
+        } for n in numbers]}
+    if "- Type: Assignment" in prompt:
+        return {
+            "title": "Assignment",
+            "instructions": "Answer every task using the lecture material.",
+            "rubric": ["Accuracy", "Use of evidence", "Clarity"],
+            "estimated_time": "45 minutes",
+            "learning_objectives": ["Explain the processes covered"],
+            "assignment_tasks": [{
+                "task_number": i + 1,
+                "description": f"Compare two processes described in section {n} of the material.",
+                "bloom_level": "apply",
+                "points": 10,
+            } for i, n in enumerate(numbers)],
+        }
+    return {
+        "title": "Summary",
+        "content": "The material covers how cells obtain and use energy. " * 20,
+        "key_points": ["Photosynthesis", "Respiration", "Membrane transport"],
+        "word_count": "180",
+    }
+
+
+class _Usage:
+    def __init__(self, prompt: str, text: str):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStream:
+    def __init__(self, chunks: List[str], delay: float):
+        self._chunks = chunks
+        self._delay = delay
+
+    def __aiter__(self) -> AsyncIterator[FakeResponse]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[FakeResponse]:
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+def make_fake_generate(config: FakeModelConfig):
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            await asyncio.sleep(config.delay() / 10)
+            raise google_exceptions.ResourceExhausted("Quota exceeded (benchmark fake)")
+        if roll < config.rate_limit_rate + config.failure_rate:
+            await asyncio.sleep(config.delay() / 2)
+            raise google_exceptions.ServiceUnavailable("Model overloaded (benchmark fake)")
+
+        text = json.dumps(canned_response(str(prompt)))
+        if stream:
+            size = max(1, len(text) // config.stream_chunks + 1)
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            # The first chunk arrives after a third of the latency, the rest evenly
+            await asyncio.sleep(config.delay() / 3)
+            return FakeStream(chunks, (config.delay() * 2 / 3) / max(len(chunks), 1))
+        await asyncio.sleep(config.delay())
+        return FakeResponse(text, _Usage(str(prompt), text))
+
+    return generate_content_async
+
+
+def install_fakes(app_module, corpus_dir: str) -> None:
+    """Point an imported app module at the local storage and model fakes"""
+    import google.generativeai as genai
+
+    client = FakeSupabaseClient(corpus_dir)
+
+    async def get_supabase():
+        return client
+
+    app_module.get_supabase = get_supabase
+    app_module.GEMINI_API_KEY = app_module.GEMINI_API_KEY or "benchmark-fake-key"
+    app_module.gemini_client.api_key = app_module.GEMINI_API_KEY
+    genai.GenerativeModel.generate_content_async = make_fake_generate(FakeModelConfig())
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+
+from corpus import build_corpus, corpus_name  # noqa: E402
+
+# ============================================================================
+# LOAD BENCHMARK
+# ============================================================================
+#
+# Starts app.py under uvicorn against the local fakes (see fakes.py), drives
+# each endpoint at the requested concurrency, and reports latency
+# percentiles, throughput, and the server's CPU time per request and peak
+# RSS. The server's CPU and memory include its extraction pool processes.
+#
+#   python benchmarks/run_load.py --scenario generate,stream --concurrency 1,16,64
+#
+# Requests use a unique query each, so they miss the result cache and are
+# not coalesced; pass --repeat to send identical requests instead.
+
+SCENARIOS = ("process-pdf", "generate", "generate-text", "stream", "batch")
+TERMINAL_JOB_STATUSES = ("succeeded", "failed")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+# ----------------------------------------------------------------------------
+# Server process accounting (Linux /proc)
+# ----------------------------------------------------------------------------
+
+def _process_tree(root: int) -> List[int]:
+    """root and all of its descendants"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def tree_usage(root: int) -> Tuple[float, int]:
+    """(CPU seconds, RSS bytes) summed over the server and its children"""
+    cpu, rss = 0.0, 0
+    for pid in _process_tree(root):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            # utime, stime, cutime, cstime (reaped children count here)
+            cpu += sum(int(v) for v in fields[11:15]) / CLOCK_TICKS
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            continue
+    return cpu, rss
+
+
+class ResourceSampler:
+    """Tracks peak tree RSS while a scenario runs"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, tree_usage(self.pid)[1])
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> float:
+        if self.pid is None:
+            return 0.0
+        self._task = asyncio.create_task(self._run())
+        return tree_usage(self.pid)[0]
+
+    async def stop(self) -> float:
+        if self.pid is None:
+            return 0.0
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        cpu, rss = tree_usage(self.pid)
+        self.peak_rss = max(self.peak_rss, rss)
+        return cpu
+
+
+# ----------------------------------------------------------------------------
+# Scenarios: each returns (ok, seconds, extra) for one request
+# ----------------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# Unique across the whole run, so no level hits results cached by another
+_query_ids = itertools.count()
+
+
+def _query(args, n: int) -> str:
+    base = "Generate questions about photosynthesis and enzymes"
+    return base if args.repeat else f"{base} (request {next(_query_ids)})"
+
+
+async def run_process_pdf(client: httpx.AsyncClient, args, n: int):
+    started = time.perf_counter()
+    r = await client.post("/process-pdf", json={"pdf_id": corpus_name(args.pages), "bucket_name": "bench"})
+    if r.status_code != 202:
+        return False, time.perf_counter() - started, {}
+    job_url = r.json()["status_url"]
+    while True:
+        job = (await client.get(job_url)).json()
+        if job["status"] in TERMINAL_JOB_STATUSES:
+            return job["status"] == "succeeded", time.perf_counter() - started, {}
+        await asyncio.sleep(args.poll_interval)
+
+
+async def run_generate(client: httpx.AsyncClient, args, n: int, from_pdf: bool = True):
+    body = {"text": _query(args, n), "type": args.type, "settings": {"num_questions": 5}}
+    if from_pdf:
+        body.update(pdf_id=corpus_name(args.pages), bucket_name="bench")
+    started = time.perf_counter()
+    r = await client.post("/generate", json=body)
+    ok = r.status_code == 200 and r.json().get("metadata", {}).get("generated_from") != "gemini-direct (fallback)"
+    return ok, time.perf_counter() - started, {}
+
+
+async def run_generate_text(client: httpx.AsyncClient, args, n: int):
+    return await run_generate(client, args, n, from_pdf=False)
+
+
+async def run_stream(client: httpx.AsyncClient, args, n: int):
+    body = {"text": _query(args, n), "type": args.type, "pdf_id": corpus_name(args.pages),
+            "bucket_name": "bench", "settings": {"num_questions": 5}}
+    started = time.perf_counter()
+    first_event = None
+    ok = False
+    async with client.stream("POST", "/generate/stream", json=body) as r:
+        event = None
+        async for line in r.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                ok = ok or event == "result"
+                if event == "error":
+                    ok = False
+    return ok, time.perf_counter() - started, {"ttfe": first_event}
+
+
+async def run_batch(client: httpx.AsyncClient, args, n: int):
+    body = {"text": _query(args, n), "pdf_id": corpus_name(args.pages), "bucket_name": "bench",
+            "items": [{"type": "quiz"}, {"type": "assignment"}, {"type": "summary"}]}
+    started = time.perf_counter()
+    r = await client.post("/generate/batch", json=body)
+    ok = r.status_code == 200 and all(item.get("status") == "ok" for item in r.json().get("items", []))
+    return ok, time.perf_counter() - started, {}
+
+
+SCENARIO_RUNNERS: Dict[str, Callable] = {
+    "process-pdf": run_process_pdf,
+    "generate": run_generate,
+    "generate-text": run_generate_text,
+    "stream": run_stream,
+    "batch": run_batch,
+}
+
+
+async def run_scenario(base_url: str, scenario: str, concurrency: int, args,
+                       server_pid: Optional[int]) -> Dict[str, Any]:
+    runner = SCENARIO_RUNNERS[scenario]
+    latencies: List[float] = []
+    first_events: List[float] = []
+    errors = 0
+    counter = iter(range(args.requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for n in counter:
+                try:
+                    ok, seconds, extra = await runner(client, args, n)
+                except httpx.HTTPError:
+                    ok, seconds, extra = False, 0.0, {}
+                if ok:
+                    latencies.append(seconds)
+                    if extra.get("ttfe") is not None:
+                        first_events.append(extra["ttfe"])
+                else:
+                    errors += 1
+
+        sampler = ResourceSampler(server_pid)
+        cpu_before = sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu_used = await sampler.stop() - cpu_before
+
+    latencies.sort()
+    first_events.sort()
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(args.requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+        "cpu_ms_per_request": round(cpu_used * 1000 / args.requests, 2) if server_pid else None,
+        "peak_rss_mb": round(sampler.peak_rss / 2 ** 20, 1) if server_pid else None,
+    }
+    if first_events:
+        result["ttfe_p50_ms"] = round(percentile(first_events, 50) * 1000, 1)
+        result["ttfe_p95_ms"] = round(percentile(first_events, 95) * 1000, 1)
+    return result
+
+
+# ----------------------------------------------------------------------------
+# Server lifecycle and reporting
+# ----------------------------------------------------------------------------
+
+def start_server(args, corpus_dir: str, work_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "BENCH_MODEL_LATENCY_MS": str(args.model_latency_ms),
+        "BENCH_MODEL_JITTER_MS": str(args.model_jitter_ms),
+        "BENCH_MODEL_FAILURE_RATE": str(args.model_failure_rate),
+        "BENCH_MODEL_RATE_LIMIT_RATE": str(args.model_rate_limit_rate),
+        # Start cold and never touch the real caches/queue of a dev setup
+        "PDF_TEXT_CACHE_DIR": os.path.join(work_dir, "text-cache"),
+        "RESULT_CACHE_PATH": os.path.join(work_dir, "results.sqlite3"),
+        "JOB_QUEUE_PATH": os.path.join(work_dir, "jobs.sqlite3"),
+        "GEMINI_RPM": os.environ.get("GEMINI_RPM", "0"),
+        "GEMINI_TPM": os.environ.get("GEMINI_TPM", "0"),
+    }
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "serve.py"),
+           "--corpus", corpus_dir, "--port", str(args.port)]
+    return subprocess.Popen(cmd, env=env)
+
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Benchmark server did not become ready")
+
+
+COLUMNS = ("scenario", "concurrency", "ok", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+           "max_ms", "cpu_ms_per_request", "peak_rss_mb", "ttfe_p50_ms")
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    rows = [[str(r.get(c, "")) if r.get(c) is not None else "-" for c in COLUMNS] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(COLUMNS)]
+    print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for row in rows:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the generator service")
+    parser.add_argument("--scenario", default="process-pdf,generate,stream,batch",
+                        help=f"Comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and level")
+    parser.add_argument("--pages", type=int, default=50, help="Page count of the PDF used")
+    parser.add_argument("--type", default="quiz", help="Generation type for generate/stream")
+    parser.add_argument("--repeat", action="store_true",
+                        help="Send identical requests (exercises result cache and coalescing)")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "prolearn-bench"))
+    parser.add_argument("--model-latency-ms", type=float, default=800)
+    parser.add_argument("--model-jitter-ms", type=float, default=200)
+    parser.add_argument("--model-failure-rate", type=float, default=0.0)
+    parser.add_argument("--model-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Job polling interval (s)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    scenarios = [s.strip() for s in args.scenario.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    corpus_dir = os.path.join(args.work_dir, "corpus")
+    build_corpus(corpus_dir, [args.pages])
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        run_dir = tempfile.mkdtemp(prefix="run-", dir=args.work_dir)
+        server = start_server(args, corpus_dir, run_dir)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    results = []
+    try:
+        if server is not None:
+            await asyncio.to_thread(wait_until_ready, base_url, server)
+        for scenario in scenarios:
+            for concurrency in levels:
+                result = await run_scenario(base_url, scenario, concurrency, args,
+                                            server.pid if server else None)
+                results.append(result)
+                print(f"{scenario} @ {concurrency}: {result['rps']} req/s, "
+                      f"p95 {result['p95_ms']} ms, {result['errors']} errors", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    return results
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
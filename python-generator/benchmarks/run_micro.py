@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+
+from corpus import DEFAULT_PAGE_COUNTS, build_corpus  # noqa: E402
+from fakes import canned_response  # noqa: E402
+
+# ============================================================================
+# MICRO-BENCHMARKS
+# ============================================================================
+#
+# Times the CPU-heavy helpers of app.py directly, over synthetic PDFs of
+# 1-500 pages:
+#
+#   - PDFProcessor.extract_text_from_pdf (serial or pooled, per app config)
+#   - build_prompt, for the extracted text of each document
+#   - normalize_quiz_result (normalization, validation and near-duplicate
+#     detection), for a quiz with one question per page
+#
+#   python benchmarks/run_micro.py --pages 1,10,100 --repeat 5
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_seconds: float) -> Dict[str, float]:
+    """Best and mean seconds per call; fast calls are looped to at least min_seconds"""
+    times: List[float] = []
+    for _ in range(repeat):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds or elapsed > 1.0:
+                break
+        times.append(elapsed / calls)
+    return {"best_ms": round(min(times) * 1000, 3), "mean_ms": round(sum(times) / len(times) * 1000, 3)}
+
+
+def run(args) -> List[Dict[str, Any]]:
+    # Keep the benchmark's caches and job queue away from any dev setup
+    work_dir = args.work_dir
+    os.environ.setdefault("PDF_TEXT_CACHE_DIR", os.path.join(work_dir, "micro-text-cache"))
+    os.environ.setdefault("JOB_QUEUE_PATH", os.path.join(work_dir, "micro-jobs.sqlite3"))
+    import app
+
+    page_counts = [int(p) for p in args.pages.split(",")]
+    corpus = build_corpus(os.path.join(work_dir, "corpus"), page_counts)
+    results: List[Dict[str, Any]] = []
+
+    try:
+        for num_pages in page_counts:
+            with open(corpus[num_pages], "rb") as f:
+                pdf_bytes = f.read()
+
+            # Extraction is slow for big documents: never loop it
+            extract = measure(lambda: app.pdf_processor.extract_text_from_pdf(pdf_bytes),
+                              args.repeat, 0.0)
+            text, page_tiers = app.pdf_processor.extract_text_from_pdf(pdf_bytes)
+            results.append({"function": "extract_text_from_pdf", "pages": num_pages,
+                            "input_chars": len(text), **extract,
+                            "pages_per_second": round(num_pages / (extract["best_ms"] / 1000), 1),
+                            "layout_pages": sum(1 for _, tier, _ in page_tiers if tier != "fast")})
+
+            for generation_type in ("quiz", "summary"):
+                timing = measure(lambda: app.build_prompt("photosynthesis", text, generation_type,
+                                                          None, {"num_questions": 10}),
+                                 args.repeat, args.min_seconds)
+                results.append({"function": f"build_prompt[{generation_type}]", "pages": num_pages,
+                                "input_chars": len(text), **timing})
+
+            quiz = canned_response(f"- Type: Quiz\nCreate {max(5, num_pages)} questions")
+            timing = measure(lambda: app.normalize_quiz_result(json.loads(json.dumps(quiz))),
+                             args.repeat, args.min_seconds)
+            results.append({"function": "normalize_quiz_result", "pages": num_pages,
+                            "input_chars": len(json.dumps(quiz)), **timing})
+            print(f"{num_pages} pages done", file=sys.stderr)
+    finally:
+        app.extraction_engine.shutdown()
+    return results
+
+
+COLUMNS = ("function", "pages", "input_chars", "best_ms", "mean_ms", "pages_per_second",
+           "layout_pages")
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    rows = [[str(r.get(c, "-")) for c in COLUMNS] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(COLUMNS)]
+    print("  ".join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for row in rows:
+        print("  ".join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for app.py helpers")
+    parser.add_argument("--pages", default=",".join(str(p) for p in DEFAULT_PAGE_COUNTS),
+                        help="Comma-separated page counts of the synthetic PDFs")
+    parser.add_argument("--repeat", type=int, default=3, help="Measurements per function and size")
+    parser.add_argument("--min-seconds", type=float, default=0.2,
+                        help="Loop fast functions for at least this long per measurement")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "prolearn-bench"))
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import argparse
+import logging
+import os
+import sys
+
+# Run app.py under uvicorn with the local storage/model fakes installed.
+# Started by run_load.py; can also be run by hand to poke at the service:
+#
+#   python benchmarks/serve.py --corpus /tmp/prolearn-bench/corpus --port 8765
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve app.py against local fakes")
+    parser.add_argument("--corpus", required=True, help="Directory of PDFs served as every bucket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    import app
+    from fakes import install_fakes
+
+    install_fakes(app, args.corpus)
+    # app.py logs every request at INFO; that would dominate the measurements
+    logging.getLogger().setLevel(os.getenv("BENCH_LOG_LEVEL", "WARNING"))
+    uvicorn.run(app.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
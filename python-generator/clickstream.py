@@ -0,0 +1,391 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CLICKSTREAM INGESTION
+# ============================================================================
+#
+# UI events arrive in batches (POST /track/batch) and are written to the
+# public.clickstream table in bulk instead of one insert per event:
+#
+#   1. accepted events are normalized into table rows and appended to an
+#      in-memory buffer. A request that would overflow the buffer is refused
+#      as a whole (the endpoint answers 429), so a slow database pushes back
+#      on clients instead of growing memory,
+#   2. a flusher task writes the buffer in bulk inserts of up to batch_size
+#      rows, as soon as a full batch is buffered or every flush_seconds,
+#   3. when the sink is unavailable, batches go to a local SQLite spool file
+#      instead and the sink is retried with backoff. Once a write succeeds
+#      again, spooled rows are replayed in batches. Every worker process on
+#      the instance shares the spool, and rows are removed from it in the
+#      same transaction that claims them, so each row is replayed once.
+#
+# Rows the database rejects (bad values, unknown user) are not spooled:
+# the batch is split until the offending rows are isolated and dropped.
+# A write interrupted by shutdown is written again, so delivery is at least
+# once. Events still buffered when a worker is killed (not stopped) are
+# lost, at most flush_seconds worth.
+
+MAX_TEXT_CHARS = 2000
+# Sink retry backoff after a failed write
+RETRY_MIN_SECONDS = 1.0
+RETRY_MAX_SECONDS = 300.0
+
+
+class ClickstreamRejectedError(Exception):
+    """The sink refused the rows themselves; writing them again will not help"""
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return text[:MAX_TEXT_CHARS]
+
+
+def _timestamp(value: Any, received_at: str) -> str:
+    """ISO 8601 time of the event; unparseable or missing times become received_at"""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return received_at
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.isoformat()
+    return received_at
+
+
+def _user_id(value: Any) -> Optional[str]:
+    try:
+        return str(uuid.UUID(str(value))) if value else None
+    except ValueError:
+        return None
+
+
+def normalize_event(event: Dict[str, Any], ip_address: Optional[str], received_at: str) -> Dict[str, Any]:
+    """
+    A clickstream table row for one event, mapped like /api/track does
+    (`context` and `type` are accepted for event_context and event_name).
+    Values the table would refuse (malformed user ids and times) are
+    replaced rather than failing the bulk insert they end up in.
+    """
+    metadata = event.get("metadata")
+    return {
+        "user_id": _user_id(event.get("user_id")),
+        "time": _timestamp(event.get("time"), received_at),
+        "event_context": _text(event.get("event_context") or event.get("context")),
+        "component": _text(event.get("component")),
+        "event_name": _text(event.get("event_name") or event.get("type")),
+        "description": _text(event.get("description")),
+        "origin": _text(event.get("origin")),
+        "ip_address": _text(ip_address),
+        "metadata": metadata if isinstance(metadata, (dict, list)) else {},
+    }
+
+
+def normalize_events(events: List[Any], ip_address: Optional[str]) -> Tuple[List[Dict[str, Any]], int]:
+    """Table rows for the event objects in a batch, and how many entries were skipped"""
+    received_at = datetime.now(timezone.utc).isoformat()
+    rows = [normalize_event(event, ip_address, received_at) for event in events if isinstance(event, dict)]
+    return rows, len(events) - len(rows)
+
+
+# ----------------------------------------------------------------------------
+# Sinks
+# ----------------------------------------------------------------------------
+
+class SupabaseSink:
+    """Bulk inserts into public.clickstream through a Supabase client"""
+
+    def __init__(self, get_client: Callable[[], Awaitable[Any]], table: str = "clickstream"):
+        self.get_client = get_client
+        self.table = table
+
+    async def write(self, rows: List[Dict[str, Any]]) -> None:
+        client = await self.get_client()
+        if client is None:
+            raise RuntimeError("Supabase client not initialized")
+        try:
+            await client.table(self.table).insert(rows, returning="minimal").execute()
+        except Exception as e:
+            # Postgres data (22xxx) and integrity (23xxx) errors are about the
+            # rows; anything else (network, 5xx, permissions) may pass
+            code = str(getattr(e, "code", "") or "")
+            if code[:2] in ("22", "23"):
+                raise ClickstreamRejectedError(f"{code}: {getattr(e, 'message', e)}") from e
+            raise
+
+
+class LocalSink:
+    """
+    Stand-in for the database: appends rows as JSON lines to a local file,
+    so ingestion can run and be inspected without Supabase.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _append(self, rows: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    async def write(self, rows: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self._append, rows)
+
+
+def create_clickstream_sink(backend: str, get_client: Callable[[], Awaitable[Any]],
+                            local_path: str) -> Optional[Any]:
+    """Build the sink for CLICKSTREAM_SINK ("supabase", "local" or "none")"""
+    backend = backend.lower()
+    if backend == "none":
+        return None
+    if backend == "local":
+        return LocalSink(local_path)
+    if backend != "supabase":
+        logger.warning(f"Unknown CLICKSTREAM_SINK '{backend}', using supabase")
+    return SupabaseSink(get_client)
+
+
+# ----------------------------------------------------------------------------
+# Spool
+# ----------------------------------------------------------------------------
+
+class SQLiteSpool:
+    """Rows waiting for the sink, in a local SQLite file shared by the workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use in each process (see ingestion_jobs.SQLiteJobStore)
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False,
+                                               isolation_level=None, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS clickstream_spool ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL)"
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def append(self, rows: List[Dict[str, Any]]) -> None:
+        payload = [(json.dumps(row, ensure_ascii=False, separators=(",", ":")),) for row in rows]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT INTO clickstream_spool (row) VALUES (?)", payload)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def take(self, limit: int) -> List[Dict[str, Any]]:
+        """Remove and return up to limit of the oldest rows"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                records = self._conn.execute(
+                    "SELECT id, row FROM clickstream_spool ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+                if records:
+                    self._conn.execute("DELETE FROM clickstream_spool WHERE id <= ?", (records[-1][0],))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [json.loads(row) for _, row in records]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM clickstream_spool").fetchone()[0]
+
+
+# ----------------------------------------------------------------------------
+# Buffer
+# ----------------------------------------------------------------------------
+
+class ClickstreamBufferFull(Exception):
+    def __init__(self, buffered: int, capacity: int, retry_after: float):
+        super().__init__(f"Clickstream buffer full ({buffered}/{capacity} events)")
+        self.retry_after = retry_after
+
+
+class ClickstreamBuffer:
+    def __init__(self, sink: Any, spool: SQLiteSpool, batch_size: int = 500,
+                 flush_seconds: float = 2.0, max_buffered: int = 20000):
+        self.sink = sink
+        self.spool = spool
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_buffered = max(self.batch_size, max_buffered)
+        self._rows: List[Dict[str, Any]] = []
+        self._task: Optional["asyncio.Task"] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._retry_at = 0.0
+        self._retry_delay = RETRY_MIN_SECONDS
+        self._spooled_here = False
+        self._stats = {"accepted": 0, "throttled": 0, "written": 0, "spooled": 0,
+                       "replayed": 0, "rejected": 0, "flushes": 0, "sink_errors": 0}
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._flusher())
+        logger.info(f"Started clickstream flusher ({type(self.sink).__name__}, "
+                    f"batches of {self.batch_size}, every {self.flush_seconds}s)")
+
+    async def stop(self) -> None:
+        """Stop the flusher and write (or spool) whatever is still buffered"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self._rows:
+            await self.flush()
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def add(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Buffer rows for the next flush. All or nothing: raises
+        ClickstreamBufferFull when they do not fit.
+        """
+        if len(self._rows) + len(rows) > self.max_buffered:
+            self._stats["throttled"] += len(rows)
+            if self._wakeup is not None:
+                self._wakeup.set()
+            raise ClickstreamBufferFull(len(self._rows), self.max_buffered, self.flush_seconds)
+        self._rows.extend(rows)
+        self._stats["accepted"] += len(rows)
+        if len(self._rows) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return len(rows)
+
+    async def flush(self) -> None:
+        """Write every buffered row, then replay the spool if the sink is up"""
+        async with self._flush_lock or asyncio.Lock():
+            self._stats["flushes"] += 1
+            while self._rows:
+                batch = self._rows[:self.batch_size]
+                del self._rows[:self.batch_size]
+                try:
+                    written = await self._write(batch)
+                except asyncio.CancelledError:
+                    # Stopped mid-write: stop() flushes the batch again
+                    self._rows[:0] = batch
+                    raise
+                if not written:
+                    await asyncio.to_thread(self.spool.append, batch)
+                    self._stats["spooled"] += len(batch)
+                    self._spooled_here = True
+            await self._replay()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "buffered": len(self._rows),
+            "capacity": self.max_buffered,
+            "spool": self.spool.count(),
+            "sink_available": time.monotonic() >= self._retry_at,
+        }
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    async def _flusher(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Clickstream flush failed: {e}")
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> bool:
+        """
+        Write rows to the sink. False when the sink is unavailable (or
+        backing off) and the rows should be spooled instead.
+        """
+        if time.monotonic() < self._retry_at:
+            return False
+        try:
+            await self._write_isolating_rejects(rows)
+        except Exception as e:
+            self._stats["sink_errors"] += 1
+            self._retry_at = time.monotonic() + self._retry_delay
+            logger.warning(f"Clickstream sink unavailable, spooling for {self._retry_delay:.0f}s: {e}")
+            self._retry_delay = min(self._retry_delay * 2, RETRY_MAX_SECONDS)
+            return False
+        self._retry_delay = RETRY_MIN_SECONDS
+        return True
+
+    async def _write_isolating_rejects(self, rows: List[Dict[str, Any]]) -> None:
+        # Split rejected batches in halves down to the rows at fault
+        pending: List[List[Dict[str, Any]]] = [rows]
+        while pending:
+            batch = pending.pop()
+            try:
+                await self.sink.write(batch)
+            except ClickstreamRejectedError as e:
+                if len(batch) == 1:
+                    self._stats["rejected"] += 1
+                    logger.warning(f"Dropped clickstream event rejected by the sink: {e}")
+                else:
+                    middle = len(batch) // 2
+                    pending += [batch[middle:], batch[:middle]]
+                continue
+            self._stats["written"] += len(batch)
+
+    async def _replay(self) -> None:
+        if time.monotonic() < self._retry_at:
+            return
+        while True:
+            rows = await asyncio.to_thread(self.spool.take, self.batch_size)
+            if not rows:
+                if self._spooled_here:
+                    logger.info("Clickstream spool drained")
+                    self._spooled_here = False
+                return
+            try:
+                written = await self._write(rows)
+            except asyncio.CancelledError:
+                # Taken off the spool already: put them back before stopping
+                await asyncio.shield(asyncio.to_thread(self.spool.append, rows))
+                raise
+            if not written:
+                # Back to the spool (at the end) until the sink recovers
+                await asyncio.to_thread(self.spool.append, rows)
+                return
+            self._stats["replayed"] += len(rows)
+
@@ -0,0 +1,74 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ============================================================================
+# REQUEST COALESCING (SINGLE-FLIGHT)
+# ============================================================================
+#
+# When many requests need the same expensive result at once (a shared PDF,
+# an identical generation), only the first one does the work. Concurrent
+# duplicates await the same task and each receive their own deep copy of the
+# result, or the same exception.
+#
+# A caller that is cancelled (e.g. client disconnect) stops waiting without
+# cancelling the shared work, unless it was the last one waiting for it.
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, _Flight] = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "cancelled": 0}
+
+    def _done(self, key: str, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        task = flight.task
+        if not task.cancelled() and task.exception() is not None:
+            self._stats["errors"] += 1
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn() for key, or join the call already in flight for key"""
+        self._stats["calls"] += 1
+        flight = self._inflight.get(key)
+        if flight is None:
+            self._stats["executions"] += 1
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._done(key, flight))
+        else:
+            self._stats["coalesced"] += 1
+            logger.info(f"[{self.name}] joined in-flight call ({flight.waiters} already waiting)")
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # Last interested caller left: abandon the shared work
+                flight.task.cancel()
+                self._stats["cancelled"] += 1
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            raise
+        finally:
+            flight.waiters -= 1
+
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "saved": self._stats["coalesced"], "in_flight": len(self._inflight)}
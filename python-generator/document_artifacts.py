@@ -0,0 +1,278 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pdf_extraction import PageRanges, PageText, format_page_range, page_in_ranges, parse_page_range, split_pages
+from prompt_compaction import count_tokens, strip_running_lines
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PER-DOCUMENT ARTIFACTS
+# ============================================================================
+#
+# Built once when a PDF is ingested and stored next to its cached text (the
+# page offset index is stored separately, see text_cache):
+#
+#   - outline: headings found in the page text. These are numbered headings
+#     ("2.3 Osmosis", "Chapter 4 ...") and short title-like lines that open
+#     a block, each with its page and level. Running headers are ignored.
+#   - summaries: an extractive map-reduce summary tree. Level 0 summarizes
+#     every group of `group_size` pages with its most salient sentences
+#     (TF-IDF weights across the groups, redundant sentences skipped). Each
+#     higher level merges SUMMARY_FANOUT summaries of the level below, until
+#     one summary of the whole document remains. There are no model calls
+#     or embeddings, so ingestion stays cheap and deterministic.
+#
+# summary_context turns them into a prompt context: the outline plus the
+# finest summary level that fits a token budget.
+
+# Bump when the stored shape or the token counts in it change
+ARTIFACTS_VERSION = 2
+SUMMARY_FANOUT = 4
+# Sentences outside these bounds are fragments or run-on layout artifacts
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 400
+# A sentence sharing this much of its vocabulary with one already picked is
+# redundant
+MAX_SENTENCE_OVERLAP = 0.6
+MAX_HEADING_CHARS = 80
+MAX_HEADING_WORDS = 10
+MAX_OUTLINE_ENTRIES = 300
+# Share of the token budget the outline may take in a summary context
+OUTLINE_BUDGET_SHARE = 0.1
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_NUMBERED_RE = re.compile(r"^(\d+(?:\.\d+){0,3})\.?\s+(\S.*)$")
+_NAMED_RE = re.compile(r"^(chapter|part|unit|module|lecture|section|appendix)\s+([0-9ivxlcA-Z]+)\b[.:]?\s*(.*)$",
+                       re.IGNORECASE)
+_NAMED_LEVELS = {"part": 1, "chapter": 1, "unit": 1, "module": 1, "lecture": 1,
+                 "appendix": 1, "section": 2}
+_CAPTION_RE = re.compile(r"^(fig(ure)?|table|chart|diagram|source)\b", re.IGNORECASE)
+_SMALL_WORDS = frozenset("a an and as at by for from in into of on or the to vs with".split())
+
+
+# ============================================================================
+# OUTLINE
+# ============================================================================
+
+def _title_case(words: List[str]) -> bool:
+    """Whether the significant words are capitalized (first word included)"""
+    if not words or not words[0][:1].isupper():
+        return False
+    significant = [w for w in words if w.lower() not in _SMALL_WORDS and w[:1].isalpha()]
+    return bool(significant) and sum(w[0].isupper() for w in significant) / len(significant) >= 0.6
+
+
+def heading_level(line: str, opens_block: bool) -> Optional[Tuple[int, str]]:
+    """(level, title) when `line` looks like a heading, otherwise None"""
+    if len(line) > MAX_HEADING_CHARS or line[-1] in ".,;:" or not any(c.isalpha() for c in line):
+        return None
+    if _CAPTION_RE.match(line):
+        return None
+
+    named = _NAMED_RE.match(line)
+    if named:
+        kind = named.group(1).lower()
+        return _NAMED_LEVELS[kind], line
+
+    numbered = _NUMBERED_RE.match(line)
+    if numbered:
+        number, rest = numbered.groups()
+        words = rest.split()
+        depth = number.count(".") + 1
+        # "3 Mix the solution" is a list item; "3 Cell Respiration" a heading
+        if len(words) <= MAX_HEADING_WORDS and (depth > 1 or _title_case(words)) and rest[:1].isupper():
+            return min(depth, 4), line
+        return None
+
+    words = line.split()
+    if not opens_block or len(words) > MAX_HEADING_WORDS:
+        return None
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters):
+        return 1, line
+    if len(words) >= 2 and _title_case(words):
+        return 2, line
+    return None
+
+
+def detect_outline(pages: List[PageText]) -> List[Dict[str, Any]]:
+    """Headings in reading order: [{"title", "page", "level"}, ...]"""
+    outline: List[Dict[str, Any]] = []
+    previous = None
+    for page_number, text in pages:
+        for block in _PARAGRAPH_RE.split(text):
+            lines = [" ".join(line.split()) for line in block.splitlines()]
+            lines = [line for line in lines if line]
+            for position, line in enumerate(lines[:2]):
+                found = heading_level(line, opens_block=position == 0 and len(lines) > 1)
+                if not found:
+                    break
+                level, title = found
+                key = title.lower()
+                # Slides repeat their title on continuation pages
+                if key != previous:
+                    outline.append({"title": title, "page": page_number, "level": level})
+                    previous = key
+                if len(outline) >= MAX_OUTLINE_ENTRIES:
+                    return outline
+    return outline
+
+
+# ============================================================================
+# MAP-REDUCE SUMMARIES
+# ============================================================================
+
+def split_sentences(text: str) -> List[str]:
+    sentences: List[str] = []
+    for block in _PARAGRAPH_RE.split(text):
+        block = " ".join(block.split())
+        for sentence in _SENTENCE_RE.split(block):
+            if MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS:
+                sentences.append(sentence)
+    return sentences
+
+
+def summarize_units(units: List[List[str]], max_chars: int) -> List[List[str]]:
+    """
+    For each unit (a list of sentences), the sentences that best represent
+    it, in their original order, within max_chars. Terms are weighted by
+    their frequency in the unit and their rarity across units, and a
+    sentence scores the mean weight of its distinct terms.
+    """
+    unit_terms = [[set(tokenize(sentence)) for sentence in unit] for unit in units]
+    document_frequency: Counter = Counter()
+    frequencies: List[Counter] = []
+    for terms in unit_terms:
+        counts: Counter = Counter()
+        for sentence_terms in terms:
+            counts.update(sentence_terms)
+        frequencies.append(counts)
+        document_frequency.update(counts.keys())
+
+    num_units = len(units)
+    summaries: List[List[str]] = []
+    for unit, terms, counts in zip(units, unit_terms, frequencies):
+        total = sum(counts.values()) or 1
+        weight = {t: (c / total) * (math.log((1 + num_units) / (1 + document_frequency[t])) + 1)
+                  for t, c in counts.items()}
+        scored = sorted(
+            ((sum(weight[t] for t in sentence_terms) / math.sqrt(len(sentence_terms)), i)
+             for i, sentence_terms in enumerate(terms) if sentence_terms),
+            reverse=True,
+        )
+        picked: List[int] = []
+        picked_terms: List[Set[str]] = []
+        used = 0
+        for _, i in scored:
+            if used + len(unit[i]) > max_chars:
+                continue
+            if any(len(terms[i] & other) / len(terms[i]) >= MAX_SENTENCE_OVERLAP for other in picked_terms):
+                continue
+            picked.append(i)
+            picked_terms.append(terms[i])
+            used += len(unit[i]) + 1
+        summaries.append([unit[i] for i in sorted(picked)])
+    return summaries
+
+
+def _node(first: int, last: int, sentences: List[str]) -> Dict[str, Any]:
+    summary = " ".join(sentences)
+    return {"pages": f"{first}-{last}" if last != first else str(first), "first": first, "last": last,
+            "summary": summary, "tokens": count_tokens(summary)}
+
+
+def build_summary_tree(pages: List[PageText], group_size: int, max_chars: int) -> List[List[Dict[str, Any]]]:
+    """Summary levels from page groups (level 0) up to a single document summary"""
+    groups = [pages[i:i + group_size] for i in range(0, len(pages), group_size)]
+    units = [[s for _, text in group for s in split_sentences(text)] for group in groups]
+    spans = [(group[0][0], group[-1][0]) for group in groups]
+    selected = summarize_units(units, max_chars)
+    levels = [[_node(first, last, sentences) for (first, last), sentences in zip(spans, selected)]]
+
+    while len(selected) > 1:
+        parents = range(0, len(selected), SUMMARY_FANOUT)
+        units = [[s for child in selected[i:i + SUMMARY_FANOUT] for s in child] for i in parents]
+        spans = [(spans[i][0], spans[min(i + SUMMARY_FANOUT, len(spans)) - 1][1]) for i in parents]
+        selected = summarize_units(units, max_chars)
+        levels.append([_node(first, last, sentences) for (first, last), sentences in zip(spans, selected)])
+    return levels
+
+
+def build_artifacts(full_text: str, group_size: int = 8, max_chars: int = 800) -> Dict[str, Any]:
+    """Outline and summary tree of page-marked extracted text"""
+    pages = split_pages(full_text) or [(1, full_text)]
+    pages, _ = strip_running_lines(pages)
+    outline = detect_outline(pages)
+    summaries = build_summary_tree(pages, group_size, max_chars)
+    logger.info(f"Built document artifacts: {len(pages)} pages, {len(outline)} headings, "
+                f"{len(summaries)} summary levels ({len(summaries[0])} page groups)")
+    return {
+        "version": ARTIFACTS_VERSION,
+        "group_size": group_size,
+        "outline": outline,
+        "summaries": summaries,
+    }
+
+
+# ============================================================================
+# PROMPT CONTEXT
+# ============================================================================
+
+def format_outline(outline: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{'  ' * (entry['level'] - 1)}- {entry['title']} (p. {entry['page']})"
+                     for entry in outline)
+
+
+def summary_context(artifacts: Dict[str, Any], token_budget: int,
+                    page_ranges: Optional[PageRanges] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    (context_text, metadata) built from the outline and the finest summary
+    level that fits token_budget, or None if none fits. With page_ranges only
+    the page-group summaries (level 0) within them are used, and None is
+    returned when a range starts or ends inside a group.
+    """
+    def overlaps(node: Dict[str, Any]) -> bool:
+        return page_ranges is None or any(start <= node["last"] and (end is None or node["first"] <= end)
+                                          for start, end in page_ranges)
+
+    def contained(node: Dict[str, Any]) -> bool:
+        return any(start <= node["first"] and (end is None or node["last"] <= end)
+                   for start, end in page_ranges)
+
+    outline = [entry for entry in artifacts.get("outline", []) if page_in_ranges(entry["page"], page_ranges)]
+    outline_text = format_outline(outline)
+    if count_tokens(outline_text) > token_budget * OUTLINE_BUDGET_SHARE:
+        outline_text = format_outline([entry for entry in outline if entry["level"] == 1])
+        if count_tokens(outline_text) > token_budget * OUTLINE_BUDGET_SHARE:
+            outline_text = ""
+
+    levels = artifacts.get("summaries", [])
+    if page_ranges is not None:
+        levels = levels[:1]
+    for level, nodes in enumerate(levels):
+        nodes = [node for node in nodes if overlaps(node)]
+        if page_ranges is not None and not all(contained(node) for node in nodes):
+            return None
+        nodes = [node for node in nodes if node["summary"]]
+        if not nodes:
+            return None
+        tokens = count_tokens(outline_text) + sum(node["tokens"] for node in nodes)
+        if tokens > token_budget:
+            continue
+        blocks = [f"Document outline:\n{outline_text}"] if outline_text else []
+        blocks += [f"--- Pages {node['pages']} (summary) ---\n\n{node['summary']}" for node in nodes]
+        metadata = {
+            "context": "summaries",
+            "level": level,
+            "groups": len(nodes),
+            "pages": format_page_range(parse_page_range(",".join(node["pages"] for node in nodes))),
+            "outline_entries": len(outline) if outline_text else 0,
+        }
+        return "\n\n".join(blocks), metadata
+    return None
@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# GEMINI CLIENT: MODEL REGISTRY, RATE LIMITING AND RETRIES
+# ============================================================================
+#
+# - Models (with their generation config) are built once and reused.
+# - A token bucket per quota dimension (requests/minute, tokens/minute) keeps
+#   the instance under its configured Gemini quota, so bursts are queued
+#   instead of bounced back by the API.
+# - 429 and 5xx responses are retried with jittered exponential backoff,
+#   honouring the server's retry delay when it sends one. A 429 also pauses
+#   the limiter for everyone, not just the request that hit it. Exhausted
+#   per-day quotas fail right away instead.
+# - The google.generativeai SDK is imported and configured on the first model
+#   lookup, not at import time: it is the slowest import of the service.
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_RETRY_IN_RE = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+# gRPC status names of errors that carry no HTTP code
+_GRPC_STATUS = {"RESOURCE_EXHAUSTED": 429, "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504, "INTERNAL": 500,
+                "UNAUTHENTICATED": 401, "PERMISSION_DENIED": 403}
+# Last resort for errors with neither: an HTTP status line or a gRPC status name
+_STATUS_MESSAGE_RE = re.compile(r"^(429|50[0234])\b|\b(resource[ _]exhausted|service unavailable)\b",
+                                re.IGNORECASE)
+# Quota ids of limits that do not reset within a retry window
+_DAILY_QUOTA_RE = re.compile(r"per\s*day", re.IGNORECASE)
+
+
+class GeminiRateLimitError(Exception):
+    """Quota/rate limit still exceeded after all retries"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiUnavailableError(Exception):
+    """Gemini kept failing with 5xx errors after all retries"""
+
+
+def error_status(e: Exception) -> Optional[int]:
+    """
+    HTTP status of a Gemini error: from the google-api-core exception type,
+    then its HTTP or gRPC code, and only then from a status at the start of
+    the message (not from numbers or words quoted anywhere in it).
+    """
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        api_exceptions = None
+    if api_exceptions is not None:
+        for error_type, status in ((api_exceptions.ResourceExhausted, 429),
+                                   (api_exceptions.ServiceUnavailable, 503),
+                                   (api_exceptions.DeadlineExceeded, 504),
+                                   (api_exceptions.InternalServerError, 500),
+                                   (api_exceptions.Unauthenticated, 401),
+                                   (api_exceptions.PermissionDenied, 403)):
+            if isinstance(e, error_type):
+                return status
+
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return int(code)
+    if getattr(code, "name", None) in _GRPC_STATUS:
+        return _GRPC_STATUS[code.name]
+
+    match = _STATUS_MESSAGE_RE.search(str(e).strip())
+    if match:
+        return int(match.group(1)) if match.group(1) else (429 if "exhausted" in match.group(2).lower() else 503)
+    return None
+
+
+def is_daily_quota(e: Exception) -> bool:
+    """Whether a 429 is a per-day quota, which retrying within minutes cannot fix"""
+    for detail in getattr(e, "details", None) or ():
+        for violation in getattr(detail, "violations", None) or ():
+            if _DAILY_QUOTA_RE.search(str(getattr(violation, "quota_id", "") or "")):
+                return True
+    return bool(_DAILY_QUOTA_RE.search(str(e)))
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """Server-requested retry delay from headers, RetryInfo details, or the message"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    for detail in getattr(e, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+
+    match = _RETRY_IN_RE.search(str(e))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    """Continuously refilled bucket; rate is units per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Requests larger than the bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class GeminiRateLimiter:
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self._buckets: Dict[str, TokenBucket] = {}
+        if requests_per_minute > 0:
+            self._buckets["requests"] = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        if tokens_per_minute > 0:
+            self._buckets["tokens"] = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._stats = {"waits": 0, "wait_seconds": 0.0, "pauses": 0}
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until one request of `tokens` tokens fits in the quota, then take it"""
+        wanted = {"requests": 1, "tokens": tokens}
+        waited = 0.0
+        # The lock makes waiters queue in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                delay = max(0.0, self._paused_until - now)
+                for name, bucket in self._buckets.items():
+                    bucket.refill(now)
+                    delay = max(delay, bucket.wait_time(wanted[name]))
+                if delay <= 0:
+                    for name, bucket in self._buckets.items():
+                        bucket.level -= min(wanted[name], bucket.capacity)
+                    break
+                waited += delay
+                await asyncio.sleep(delay)
+        if waited:
+            self._stats["waits"] += 1
+            self._stats["wait_seconds"] += waited
+
+    def adjust(self, token_delta: int) -> None:
+        """Correct a token reservation once actual usage is known"""
+        bucket = self._buckets.get("tokens")
+        if bucket is not None and token_delta:
+            bucket.level = min(bucket.capacity, bucket.level - token_delta)
+
+    def pause(self, seconds: float) -> None:
+        """Hold all new requests for `seconds` (after the API says 429)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._stats["pauses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "levels": {name: round(b.level, 1) for name, b in self._buckets.items()},
+        }
+
+
+class GeminiClient:
+    def __init__(self, limiter: GeminiRateLimiter, max_retries: int = 4,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 expected_output_tokens: int = 2048, api_key: Optional[str] = None):
+        self.limiter = limiter
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_output_tokens = expected_output_tokens
+        self._models: Dict[Tuple[str, str], "genai.GenerativeModel"] = {}
+        self._configured = False
+        self._models_lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "rate_limited": 0, "server_errors": 0}
+
+    def model(self, model_name: str, response_mime_type: str = "application/json") -> "genai.GenerativeModel":
+        """Shared GenerativeModel for a model name and output type"""
+        key = (model_name, response_mime_type)
+        with self._models_lock:
+            model = self._models.get(key)
+            if model is None:
+                import google.generativeai as genai
+
+                if not self._configured and self.api_key:
+                    genai.configure(api_key=self.api_key)
+                    self._configured = True
+                model = genai.GenerativeModel(
+                    model_name,
+                    generation_config=genai.GenerationConfig(response_mime_type=response_mime_type)
+                )
+                self._models[key] = model
+            return model
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            # Honour the server, plus a little jitter so waiters do not stampede
+            return retry_after + random.uniform(0, self.backoff_base)
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    async def generate(self, model_name: str, prompt: str, estimated_prompt_tokens: int,
+                       stream: bool = False) -> Any:
+        """
+        Call generate_content_async under the rate limiter, retrying 429/5xx.
+        Raises GeminiRateLimitError / GeminiUnavailableError once retries run
+        out; other errors propagate unchanged on the first failure.
+        """
+        model = self.model(model_name)
+        reserved = estimated_prompt_tokens + self.expected_output_tokens
+
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(reserved)
+            self._stats["calls"] += 1
+            try:
+                response = await model.generate_content_async(prompt, stream=stream)
+            except Exception as e:
+                status = error_status(e)
+                if status not in RETRYABLE_STATUS:
+                    raise
+                retry_after = retry_after_seconds(e)
+                if status == 429 and is_daily_quota(e):
+                    # Do not hold limiter slots retrying a quota that is gone for the day
+                    self._stats["rate_limited"] += 1
+                    raise GeminiRateLimitError(str(e), retry_after) from e
+                if status == 429:
+                    self._stats["rate_limited"] += 1
+                    self.limiter.pause(retry_after if retry_after is not None else self._backoff(attempt, None))
+                else:
+                    self._stats["server_errors"] += 1
+
+                if attempt >= self.max_retries:
+                    if status == 429:
+                        raise GeminiRateLimitError(str(e), retry_after) from e
+                    raise GeminiUnavailableError(str(e)) from e
+
+                delay = self._backoff(attempt, retry_after)
+                self._stats["retries"] += 1
+                logger.warning(f"Gemini returned {status}; retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if not stream:
+                usage = getattr(response, "usage_metadata", None)
+                actual = getattr(usage, "total_token_count", None)
+                if isinstance(actual, int) and actual > 0:
+                    self.limiter.adjust(actual - reserved)
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "limiter": self.limiter.stats(), "models": len(self._models)}
@@ -0,0 +1,54 @@
+import os
+
+# ============================================================================
+# PRODUCTION SERVER (gunicorn + uvicorn workers)
+# ============================================================================
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# - WEB_CONCURRENCY uvicorn worker processes share the listening socket.
+# - With PRELOAD_APP (default on), the master imports app.py and the heavy SDKs
+#   once before forking: workers share that memory copy-on-write, and a
+#   replacement worker is serving within milliseconds instead of re-importing.
+# - Each worker is recycled after about SERVER_MAX_REQUESTS requests (plus up
+#   to SERVER_MAX_REQUESTS_JITTER, so they do not all restart together). This
+#   caps the memory pdfplumber/pdfminer accumulates in long-lived processes.
+#   A recycled worker stops accepting connections, finishes in-flight
+#   requests and gives its running ingestion jobs JOB_SHUTDOWN_GRACE_SECONDS
+#   before handing them back to the queue; the master forks its replacement
+#   right away.
+#
+# State shared across workers lives in SQLite files (job queue, sqlite result
+# cache) and the disk text cache; in-memory caches, /stats and /metrics are
+# per worker. `python app.py` still runs a single process for development.
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# app.py splits per-instance resources (Gemini quota, extraction processes)
+# between the workers, so it needs the actual count
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn_worker.UvicornWorker"
+
+preload_app = os.getenv("PRELOAD_APP", "true").lower() in ("1", "true", "yes")
+
+max_requests = int(os.getenv("SERVER_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 100))
+
+# Seconds a worker may go without checking in (its event loop is blocked)
+# before the master kills it, and the time stopping workers get to finish
+timeout = int(os.getenv("SERVER_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("SERVER_KEEPALIVE_SECONDS", 5))
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    # The socket is bound and app.py imported; load the SDKs before the first fork
+    if preload_app:
+        import app
+
+        app.preload_heavy_modules()
+
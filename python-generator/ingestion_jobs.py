@@ -0,0 +1,435 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PDF INGESTION JOB QUEUE
+# ============================================================================
+#
+# /process-pdf only records a job and returns its id; a small pool of
+# background workers downloads and extracts the PDF and persists the result
+# to the text cache. Jobs live in a local SQLite file, so:
+#
+#   - they keep running when the client that submitted them disconnects,
+#   - every worker process on the instance can serve GET /jobs/{id}, and
+#   - jobs a crashed or restarted worker left "running" are picked up again
+#     once their heartbeat goes stale.
+#
+# Every claim bumps `attempts`, and a worker only writes progress or the
+# outcome while the row is still running under its own attempt: a worker
+# that was too slow and lost its job to the stale check drops its result.
+# Retried jobs wait in the queue until `not_before` (exponential backoff).
+#
+# Job lifecycle: queued -> running -> succeeded | failed. While running,
+# `stage` (downloading, extracting, saving, analyzing) and pages_done/pages_total show
+# how far along the job is.
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+# handler(job, report) -> result; report(stage=..., pages_done=..., pages_total=...)
+ProgressReporter = Callable[..., None]
+JobHandler = Callable[[Dict[str, Any], ProgressReporter], Awaitable[Dict[str, Any]]]
+
+
+class SQLiteJobStore:
+    """Job rows in a local SQLite file, shared by every worker process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened on first use in each process: a connection must not cross the
+        # fork from a preloading server's master into its workers
+        if self._pid != os.getpid():
+            self._connection = self._connect()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                pdf_id TEXT NOT NULL,
+                bucket_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                pages_done INTEGER NOT NULL DEFAULT 0,
+                pages_total INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                updated_at REAL NOT NULL,
+                finished_at REAL,
+                not_before REAL
+            )
+        """)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(ingestion_jobs)")}
+        if "not_before" not in columns:
+            # Queue files created before retries were delayed
+            conn.execute("ALTER TABLE ingestion_jobs ADD COLUMN not_before REAL")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status "
+            "ON ingestion_jobs (status, created_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_document "
+            "ON ingestion_jobs (bucket_name, pdf_id, status)"
+        )
+        return conn
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, pdf_id: str, bucket_name: str) -> Dict[str, Any]:
+        """
+        Queue a job for bucket/pdf_id. If one is already queued (not yet
+        started), that job is returned instead of adding a duplicate.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM ingestion_jobs WHERE bucket_name = ? AND pdf_id = ? "
+                    "AND status = 'queued' ORDER BY created_at LIMIT 1",
+                    (bucket_name, pdf_id)
+                ).fetchone()
+                if row is None:
+                    job_id = uuid.uuid4().hex
+                    self._conn.execute(
+                        "INSERT INTO ingestion_jobs (id, pdf_id, bucket_name, status, created_at, updated_at) "
+                        "VALUES (?, ?, ?, 'queued', ?, ?)",
+                        (job_id, pdf_id, bucket_name, now, now)
+                    )
+                    row = self._conn.execute(
+                        "SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)
+                    ).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._to_dict(row)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Atomically move the oldest queued job that is not waiting for a retry
+        to running and return it
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM ingestion_jobs WHERE status = 'queued' "
+                    "AND (not_before IS NULL OR not_before <= ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+                job = None
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE ingestion_jobs SET status = 'running', stage = NULL, not_before = NULL, "
+                        "attempts = attempts + 1, started_at = ?, updated_at = ? WHERE id = ?",
+                        (now, now, row["id"])
+                    )
+                    job = self._conn.execute(
+                        "SELECT * FROM ingestion_jobs WHERE id = ?", (row["id"],)
+                    ).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._to_dict(job)
+
+    # update, finish and requeue only touch a job that is still running under
+    # the caller's attempt and return whether they did
+
+    def update(self, job_id: str, attempt: int, **fields: Any) -> bool:
+        """Set progress fields (stage, pages_done, pages_total) and the heartbeat"""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE ingestion_jobs SET {assignments} "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                (*fields.values(), job_id, attempt)
+            )
+            return cursor.rowcount > 0
+
+    def finish(self, job_id: str, attempt: int, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None) -> bool:
+        now = time.time()
+        status = "failed" if error is not None else "succeeded"
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, stage = NULL, result = ?, error = ?, "
+                "updated_at = ?, finished_at = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (status, json.dumps(result) if result is not None else None, error, now, now,
+                 job_id, attempt)
+            )
+            return cursor.rowcount > 0
+
+    def requeue(self, job_id: str, attempt: int, error: Optional[str] = None,
+                delay: float = 0.0) -> bool:
+        """
+        Put a running job back in the queue (retry, or worker shutting down);
+        it is not claimed again for `delay` seconds
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_jobs SET status = 'queued', stage = NULL, error = ?, "
+                "updated_at = ?, not_before = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (error, now, now + delay if delay > 0 else None, job_id, attempt)
+            )
+            return cursor.rowcount > 0
+
+    def requeue_stale(self, stale_before: float) -> int:
+        """Requeue running jobs whose worker stopped sending heartbeats"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_jobs SET status = 'queued', stage = NULL "
+                "WHERE status = 'running' AND updated_at < ?",
+                (stale_before,)
+            )
+            return cursor.rowcount
+
+    def prune(self, finished_before: float) -> int:
+        """Delete finished jobs older than the retention period"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM ingestion_jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (finished_before,)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM ingestion_jobs GROUP BY status"
+            ).fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+class IngestionQueue:
+    def __init__(self, store: SQLiteJobStore, handler: JobHandler, workers: int = 2,
+                 max_attempts: int = 3, poll_interval: float = 2.0,
+                 stale_seconds: float = 120.0, retention_seconds: float = 86400.0,
+                 retry_delay: float = 10.0):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        self.retention_seconds = retention_seconds
+        # Delay before the first retry, doubled for every further one
+        self.retry_delay = retry_delay
+        self._tasks: List["asyncio.Task"] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._progress_writer: Optional[ThreadPoolExecutor] = None
+        self._draining = False
+        self._stats = {"started": 0, "succeeded": 0, "failed": 0, "retried": 0, "recovered": 0,
+                       "superseded": 0}
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._draining = False
+        self._progress_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion-progress")
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        logger.info(f"Started {self.workers} ingestion workers ({self.store.path})")
+
+    async def stop(self, grace_seconds: float = 0.0) -> None:
+        """
+        Stop the workers. No new jobs are claimed; running ones get up to
+        grace_seconds to finish, and any still running then go back to the queue.
+        """
+        self._draining = True
+        deadline = time.monotonic() + grace_seconds
+        while self._running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        writer, self._progress_writer = self._progress_writer, None
+        if writer is not None:
+            await asyncio.to_thread(writer.shutdown)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    async def enqueue(self, pdf_id: str, bucket_name: str) -> Dict[str, Any]:
+        job = await asyncio.to_thread(self.store.create, pdf_id, bucket_name)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "workers": self.workers,
+            "running_here": len(self._running),
+            "jobs": self.store.counts(),
+        }
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    async def _next_job(self) -> Dict[str, Any]:
+        while True:
+            job = None if self._draining else await asyncio.to_thread(self.store.claim)
+            if job is not None:
+                return job
+            self._wakeup.clear()
+            try:
+                # Woken by enqueue() in this process; polling covers the others
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            try:
+                job = await self._next_job()
+                # Let a sibling worker look for the next queued job right away
+                self._wakeup.set()
+                await self._run(job)
+            except Exception:
+                # e.g. "database is locked" or a full disk while claiming or
+                # finishing a job: keep the worker alive and try again
+                logger.exception(f"Ingestion worker {n} failed")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id, attempt = job["id"], job["attempts"]
+        if attempt > self.max_attempts:
+            # Requeued by the stale check too often: the job keeps killing its worker
+            logger.error(f"Ingestion job {job_id} abandoned after {self.max_attempts} attempts")
+            await self._finish(job, None, f"Abandoned after {self.max_attempts} attempts")
+            return
+        self._running[job_id] = job
+        self._stats["started"] += 1
+        logger.info(f"Ingestion job {job_id} started for {job['bucket_name']}/{job['pdf_id']} "
+                    f"(attempt {attempt})")
+
+        writer = self._progress_writer
+
+        def report(**fields: Any) -> None:
+            # Called from extraction threads as well as the event loop. One
+            # writer thread keeps the updates in order, and the caller never
+            # waits for the store lock or SQLite's busy timeout
+            writer.submit(self._write_progress, job_id, attempt, fields)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, attempt))
+        try:
+            result = await self.handler(job, report)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.store.requeue, job_id, attempt)
+            raise
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            # Client errors (e.g. the PDF does not exist) will not fix themselves
+            retryable = getattr(e, "status_code", 500) >= 500
+            if retryable and attempt < self.max_attempts:
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning(f"Ingestion job {job_id} failed, will retry in {delay:g}s: {error}")
+                if await asyncio.to_thread(self.store.requeue, job_id, attempt, str(error), delay):
+                    self._stats["retried"] += 1
+                else:
+                    self._superseded(job_id, attempt)
+            else:
+                logger.error(f"Ingestion job {job_id} failed: {error}")
+                await self._finish(job, None, str(error))
+        else:
+            logger.info(f"Ingestion job {job_id} succeeded")
+            await self._finish(job, result)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job_id, None)
+
+    async def _finish(self, job: Dict[str, Any], result: Optional[Dict[str, Any]],
+                      error: Optional[str] = None) -> None:
+        if await asyncio.to_thread(self.store.finish, job["id"], job["attempts"], result, error):
+            self._stats["failed" if error is not None else "succeeded"] += 1
+        else:
+            self._superseded(job["id"], job["attempts"])
+
+    def _superseded(self, job_id: str, attempt: int) -> None:
+        # The stale check requeued the job while this worker was still on it
+        self._stats["superseded"] += 1
+        logger.warning(f"Ingestion job {job_id} attempt {attempt} was taken over by another "
+                       f"worker; dropping its outcome")
+
+    def _write_progress(self, job_id: str, attempt: int, fields: Dict[str, Any]) -> None:
+        try:
+            self.store.update(job_id, attempt, **fields)
+        except Exception as e:
+            logger.warning(f"Progress update for ingestion job {job_id} failed: {e}")
+
+    async def _heartbeat(self, job_id: str, attempt: int) -> None:
+        # Keeps long downloads (no page progress) from looking stale
+        interval = max(1.0, self.stale_seconds / 4)
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.store.update, job_id, attempt)
+
+    async def _maintenance(self) -> None:
+        while True:
+            try:
+                now = time.time()
+                recovered = await asyncio.to_thread(self.store.requeue_stale, now - self.stale_seconds)
+                if recovered:
+                    self._stats["recovered"] += recovered
+                    logger.warning(f"Requeued {recovered} stale ingestion jobs")
+                    self._wakeup.set()
+                await asyncio.to_thread(self.store.prune, now - self.retention_seconds)
+            except Exception as e:
+                logger.warning(f"Ingestion queue maintenance failed: {e}")
+            await asyncio.sleep(max(self.poll_interval, self.stale_seconds / 4))
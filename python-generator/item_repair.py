@@ -0,0 +1,153 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from quiz_postprocess import find_near_duplicates, postprocess_quiz
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PARTIAL REGENERATION (REPAIR MODE)
+# ============================================================================
+#
+# A quiz or assignment comes back from the model as a list of items
+# (questions or tasks). Some may be invalid, near-duplicates or missing
+# altogether: the output was truncated, or the model returned fewer than
+# requested. Instead of redoing the whole generation, app.py asks the model
+# for replacements of just those items. It uses a short follow-up prompt
+# over the same compacted context, and the replies are merged in here:
+#
+#   1. item_quality validates the list and lists the slots to fill
+#      (repair_slots): the indices of bad items, then one slot past the end
+#      for every missing item,
+#   2. merge_items puts new items into those slots, in order, and
+#   3. after the retry budget is spent, fill_placeholders puts placeholder
+#      items into the slots that are still bad, and the report says which.
+#
+# Item types and their list in the result
+ITEM_ARRAYS = {"quiz": "questions", "assignment": "assignment_tasks"}
+DEFAULT_ITEM_COUNTS = {"quiz": 5, "assignment": 3}
+MAX_ITEM_COUNT = 50
+
+
+def parse_item_count(value: Any) -> Optional[int]:
+    """
+    settings.num_questions as an int clamped to 1..MAX_ITEM_COUNT, or None
+    when it is not set (null or ""). Raises ValueError for anything that is
+    not a whole number.
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid item count: {value!r}")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str):
+        value = int(value.strip())
+    if not isinstance(value, int):
+        raise ValueError(f"Invalid item count: {value!r}")
+    return max(1, min(value, MAX_ITEM_COUNT))
+
+
+def requested_items(generation_type: str, settings: Optional[Dict[str, Any]]) -> int:
+    """Items to generate; settings must have gone through parse_item_count"""
+    return (settings or {}).get("num_questions") or DEFAULT_ITEM_COUNTS.get(generation_type, 3)
+
+
+def validate_tasks(tasks: List[Any], requested: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Quality report for assignment tasks, shaped like the quiz report
+    (quiz_postprocess.postprocess_quiz): a task needs a description that
+    does not nearly repeat an earlier one.
+    """
+    problems: List[List[str]] = []
+    texts: List[str] = []
+    for task in tasks:
+        if not isinstance(task, dict):
+            problems.append(["not_an_object"])
+            texts.append("")
+            continue
+        description = str(task.get("description") or "").strip()
+        problems.append([] if description else ["missing_description"])
+        texts.append(description)
+
+    duplicates = find_near_duplicates(texts)
+    invalid: List[Dict[str, Any]] = []
+    for index, found in enumerate(problems):
+        if index in duplicates:
+            found.append("duplicate")
+        if found:
+            entry: Dict[str, Any] = {"index": index, "problems": found}
+            if index in duplicates:
+                entry["duplicate_of"] = duplicates[index]
+            invalid.append(entry)
+
+    received = len(tasks)
+    return {
+        "requested": requested if requested is not None else received,
+        "received": received,
+        "valid": received - len(invalid),
+        "missing": max(0, (requested or 0) - received),
+        "invalid": invalid,
+        "needs_regeneration": [entry["index"] for entry in invalid],
+    }
+
+
+def item_quality(generation_type: str, items: List[Any], requested: int) -> Dict[str, Any]:
+    """Validate (and for quizzes normalize, in place) a list of items"""
+    if generation_type == "quiz":
+        return postprocess_quiz(items, requested)
+    return validate_tasks(items, requested)
+
+
+def repair_slots(report: Dict[str, Any]) -> List[int]:
+    """Indices to fill: bad items first, then the missing ones past the end"""
+    received = report["received"]
+    return report["needs_regeneration"] + list(range(received, received + report["missing"]))
+
+
+def item_text(generation_type: str, item: Any) -> str:
+    """The text a follow-up prompt quotes so the model does not repeat an item"""
+    if not isinstance(item, dict):
+        return ""
+    field = "question" if generation_type == "quiz" else "description"
+    return " ".join(str(item.get(field) or "").split())
+
+
+def merge_items(generation_type: str, items: List[Any], slots: List[int],
+                new_items: List[Any]) -> List[int]:
+    """
+    Put `new_items` into `slots` (in order) and return the slots filled.
+    Items that are not objects are skipped, and task numbers follow the slot.
+    """
+    candidates = [item for item in new_items if isinstance(item, dict)]
+    filled: List[int] = []
+    for slot, item in zip(slots, candidates):
+        if generation_type == "assignment":
+            item["task_number"] = slot + 1
+        if slot < len(items):
+            items[slot] = item
+        else:
+            items.append(item)
+        filled.append(slot)
+    return filled
+
+
+def fill_placeholders(items: List[Any], report: Dict[str, Any], slots: List[int],
+                      placeholders: List[Any]) -> None:
+    """
+    Put placeholders[slot] into each slot that is still bad, and record them
+    in the report: they are what needs_regeneration lists now, and slots
+    past the end are reported as invalid ("missing") rather than missing.
+    """
+    for slot in slots:
+        if slot < len(items):
+            items[slot] = placeholders[slot]
+        else:
+            items.append(placeholders[slot])
+            report["invalid"].append({"index": slot, "problems": ["missing"]})
+    report["received"] = len(items)
+    report["missing"] = 0
+    report["needs_regeneration"] = list(slots)
+    report["placeholders"] = list(slots)
+    if slots:
+        logger.warning(f"Using {len(slots)} placeholder item(s) after repair: {slots}")
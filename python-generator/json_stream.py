@@ -0,0 +1,239 @@
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# INCREMENTAL, TOLERANT JSON PARSING
+# ============================================================================
+#
+# The model streams its JSON answer in arbitrary text fragments, and at the
+# token limit it can simply stop mid-document. The parser below tracks
+# string/escape state and nesting across fragments so that:
+#
+#   - elements of selected top-level arrays (e.g. "questions") are handed out
+#     as soon as each one is complete, and
+#   - when the text turns out to be truncated, the document can be cut back
+#     to the last point where every array element is whole, closed, and
+#     parsed, with a report of exactly what was dropped.
+
+
+class _Frame:
+    __slots__ = ("kind", "in_array", "key", "expecting_key", "index", "elem_start", "target")
+
+    def __init__(self, kind: str, in_array: bool):
+        self.kind = kind              # "{" or "["
+        self.in_array = in_array      # this container is an element of an array
+        self.key: Optional[str] = None
+        self.expecting_key = kind == "{"
+        self.index = -1               # arrays: index of the current element
+        self.elem_start = -1          # arrays: start offset of the current element
+        self.target: Optional[str] = None  # top-level array name being streamed
+
+    def closer(self) -> str:
+        return "}" if self.kind == "{" else "]"
+
+
+class IncrementalJSONParser:
+    """
+    Feed text fragments of a JSON document. feed() returns the newly
+    completed elements of the top-level arrays named in `keys`; finish()
+    returns the parsed document, recovering what it can from truncated text.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self.keys = set(keys)
+        self._text = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._string_start = -1
+        self._literal_start = -1
+        self._open_array_elements = 0   # frames with in_array=True
+        # Last offset where the document can be cut and closed without
+        # leaving a partial array element: (offset, closing brackets)
+        self._checkpoint: Optional[Tuple[int, str]] = None
+        self._root_done = False
+        self.emitted = 0
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._text
+
+    # ------------------------------------------------------------------
+    # Scanner events
+    # ------------------------------------------------------------------
+
+    def _checkpoint_here(self, offset: int) -> None:
+        if self._open_array_elements == 0:
+            self._checkpoint = (offset, "".join(f.closer() for f in reversed(self._stack)))
+
+    def _value_start(self, pos: int) -> None:
+        if self._stack and self._stack[-1].kind == "[":
+            parent = self._stack[-1]
+            parent.index += 1
+            parent.elem_start = pos
+
+    def _value_end(self, end: int, out: List[Tuple[str, Any]]) -> None:
+        if not self._stack:
+            self._root_done = True
+            self._checkpoint = (end, "")
+            return
+        parent = self._stack[-1]
+        if parent.kind == "{":
+            parent.expecting_key = False
+        elif parent.target is not None:
+            raw = self._text[parent.elem_start:end]
+            try:
+                out.append((parent.target, json.loads(raw)))
+                self.emitted += 1
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed streamed element in '{parent.target}': {e}")
+        self._checkpoint_here(end)
+
+    def _open(self, ch: str, pos: int) -> None:
+        parent = self._stack[-1] if self._stack else None
+        self._value_start(pos)
+        frame = _Frame(ch, in_array=parent is not None and parent.kind == "[")
+        if (ch == "[" and parent is not None and len(self._stack) == 1
+                and parent.kind == "{" and parent.key in self.keys):
+            frame.target = parent.key
+        if frame.in_array:
+            self._open_array_elements += 1
+        self._stack.append(frame)
+        self._checkpoint_here(pos + 1)
+
+    def _close(self, pos: int, out: List[Tuple[str, Any]]) -> None:
+        if not self._stack:
+            return
+        frame = self._stack.pop()
+        if frame.in_array:
+            self._open_array_elements -= 1
+        self._value_end(pos + 1, out)
+
+    def feed(self, fragment: str) -> List[Tuple[str, Any]]:
+        """Consume a fragment; return (array_key, element) for newly completed elements"""
+        out: List[Tuple[str, Any]] = []
+        self._text += fragment
+        text = self._text
+
+        for pos in range(self._pos, len(text)):
+            ch = text[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        try:
+                            self._stack[-1].key = json.loads(text[self._string_start:pos + 1])
+                        except json.JSONDecodeError:
+                            self._stack[-1].key = None
+                    else:
+                        self._value_end(pos + 1, out)
+                continue
+
+            if self._literal_start >= 0:
+                if ch in ",}]" or ch.isspace():
+                    self._literal_start = -1
+                    self._value_end(pos, out)
+                else:
+                    continue
+
+            if ch.isspace():
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = top is not None and top.kind == "{" and top.expecting_key
+                if not self._string_is_key:
+                    self._value_start(pos)
+            elif ch in "{[":
+                self._open(ch, pos)
+            elif ch in "}]":
+                self._close(pos, out)
+            elif ch == ",":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expecting_key = True
+                    self._stack[-1].key = None
+            elif ch == ":":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expecting_key = False
+            else:
+                self._literal_start = pos
+                self._value_start(pos)
+
+        self._pos = len(text)
+        return out
+
+    # ------------------------------------------------------------------
+    # Completion / recovery
+    # ------------------------------------------------------------------
+
+    def _open_path(self) -> Tuple[str, str]:
+        """(path of the first partial array element or member, full path at the cut)"""
+        parts: List[str] = []
+        lost: Optional[str] = None
+        for depth, frame in enumerate(self._stack):
+            if frame.kind == "{":
+                key = frame.key
+                if key is None and self._in_string and self._string_is_key and depth == len(self._stack) - 1:
+                    # Cut inside a member name: report the partial name
+                    key = self._text[self._string_start + 1:]
+                if key is not None:
+                    parts.append(f".{key}" if parts else key)
+            else:
+                parts.append(f"[{frame.index}]")
+            if lost is None and depth + 1 < len(self._stack) and self._stack[depth + 1].in_array:
+                lost = "".join(parts)
+        full = "".join(parts)
+        return (lost or full), full
+
+    def finish(self) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """
+        Parse everything fed so far. Returns (value, None) for valid JSON, or
+        (recovered_value, report) when the text was truncated or malformed.
+        recovered_value is None if nothing could be salvaged.
+        """
+        text = self._text
+        try:
+            return json.loads(text), None
+        except json.JSONDecodeError as e:
+            error = str(e)
+
+        lost_path, open_path = self._open_path()
+        report: Dict[str, Any] = {
+            "truncated": not self._root_done,
+            "error": error,
+            "received_chars": len(text),
+            "recovered_chars": 0,
+            "lost": (lost_path or None) if not self._root_done else None,
+            "open_path": (open_path or None) if not self._root_done else None,
+        }
+
+        if self._checkpoint is None:
+            return None, report
+
+        cut, closers = self._checkpoint
+        try:
+            value = json.loads(text[:cut] + closers)
+        except json.JSONDecodeError as e:
+            logger.warning(f"JSON recovery failed: {e}")
+            return None, report
+
+        report["recovered_chars"] = cut
+        report["dropped_text"] = text[cut:cut + 200]
+        if not text[cut:].strip(" \t\r\n,"):
+            # Cut fell between elements: nothing but punctuation was lost
+            report["lost"] = None
+        if isinstance(value, dict):
+            report["recovered_items"] = {k: len(v) for k, v in value.items() if isinstance(v, list)}
+        return value, report
@@ -0,0 +1,256 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# METRICS AND TIMING SPANS
+# ============================================================================
+#
+# A small in-process metrics registry that renders the Prometheus text
+# exposition format for GET /metrics, so no client library is needed.
+# Values are per worker process: Prometheus scrapes whichever worker
+# answers, and rates/histograms aggregate correctly across workers once
+# they are scraped with the instance label.
+#
+# span("stage") times a block of code. The duration goes into the
+# stage histogram and, when the code runs on behalf of an HTTP request,
+# into that request's timing breakdown (returned in the X-Timing header).
+# The breakdown lives in a context variable, so it follows the request
+# into asyncio.to_thread() calls.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+# (name, type, documentation, samples)
+MetricFamily = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str],
+                   extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: (count per bucket, with a final +Inf slot), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][slot] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        # Collectors turn existing stats() dicts into samples at scrape time
+        self._collectors: List[Callable[[], List[MetricFamily]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[MetricFamily]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                # A broken stats source must not take /metrics down
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------------
+# Per-request timing
+# ----------------------------------------------------------------------------
+
+class RequestTiming:
+    """Stage durations of one request, in the order the stages finished"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.spans.append((stage, seconds))
+
+    def header_value(self) -> str:
+        """'stage;dur=ms' entries (Server-Timing syntax), repeated stages summed, plus total"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for stage, seconds in self.spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        totals["total"] = time.perf_counter() - self.started
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+_current_timing: "contextvars.ContextVar[Optional[RequestTiming]]" = contextvars.ContextVar(
+    "request_timing", default=None
+)
+
+
+def start_request_timing() -> Tuple[RequestTiming, contextvars.Token]:
+    timing = RequestTiming()
+    return timing, _current_timing.set(timing)
+
+
+def end_request_timing(token: contextvars.Token) -> None:
+    _current_timing.reset(token)
+
+
+class SpanRecorder:
+    """span() factory bound to the stage histogram of a registry"""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    @contextmanager
+    def span(self, stage: str, generation_type: str = "") -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.histogram.observe(elapsed, stage=stage, type=generation_type)
+            timing = _current_timing.get()
+            if timing is not None:
+                timing.add(stage, elapsed)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: times every HTTP request by route, and adds the
+    X-Timing header when enabled for all responses or asked for by the
+    client (request header 'X-Timing: 1'). Streaming responses only carry
+    the stages that finished before the first byte was sent.
+    """
+
+    def __init__(self, app, histogram: Histogram, always: bool = False):
+        self.app = app
+        self.histogram = histogram
+        self.always = always
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        wanted = self.always or any(
+            name == b"x-timing" and value.strip() not in (b"", b"0", b"false")
+            for name, value in scope.get("headers", ())
+        )
+        timing, token = start_request_timing()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if wanted:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-timing", timing.header_value().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end_request_timing(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(time.perf_counter() - timing.started,
+                                   method=scope.get("method", ""), route=path,
+                                   status=str(status["code"]))
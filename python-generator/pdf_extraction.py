@@ -0,0 +1,585 @@
+import io
+import logging
+import mmap
+import multiprocessing
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import pdfplumber
+    import pypdfium2 as pdfium
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PDF TEXT EXTRACTION ENGINE
+# ============================================================================
+#
+# Page text is extracted either serially in the calling thread or, for larger
+# documents, across a process pool. Each worker opens the document once for a
+# contiguous chunk of pages, and chunks are reassembled in page order.
+#
+# A document source is either the PDF bytes themselves (parsed from memory,
+# no temp file) or the path of a spill file for very large uploads, which is
+# memory-mapped so its pages stay reclaimable by the OS.
+#
+# Pages are streamed: iter_pages yields (page_number, text) in page order and
+# each page's parsed objects and layout are released as soon as its text is
+# out (pdfplumber would otherwise keep every page's until the document is
+# closed). PageTextWriter assembles the marked text in a buffer that spills
+# to disk, and enforces a ceiling on its size. ExtractionLimitError signals a
+# document over the page cap or text ceiling.
+#
+# Extraction is tiered per page. The fast tier reads PDFium's text layer
+# (pypdfium2, which pdfplumber already depends on), about 60x cheaper than
+# pdfplumber's character-level layout analysis and identical on plain
+# single-column pages. Pages where that text cannot be trusted go to the
+# layout tier instead:
+#
+#   - empty:    no text layer (or one PDFium cannot read)
+#   - unmapped: too many characters without a Unicode mapping
+#   - columns:  many rows hold two wide text runs separated by a wide gap
+#   - table:    many rows hold three or more runs separated by wide gaps
+#
+# The tier (and reason) of every page is yielded with its text.
+#
+# pdfplumber (and pdfminer under it) and pypdfium2 are imported on the first
+# document opened, so importing this module stays cheap for the web process.
+
+PageText = Tuple[int, str]  # (1-based page number, text)
+ExtractedPage = Tuple[int, str, str, Optional[str]]  # (page number, text, tier, layout reason)
+PageTier = Tuple[int, str, Optional[str]]  # (page number, tier, layout reason)
+PageRanges = List[Tuple[int, Optional[int]]]  # 1-based inclusive, None = open end
+PDFSource = Union[bytes, str]  # PDF bytes, or path to a spilled PDF file
+ProgressCallback = Callable[[int, int], None]  # (pages_done, pages_total)
+
+# Parallel extraction with a progress callback uses this many chunks per
+# worker (each chunk re-opens the document, so more is not free)
+PROGRESS_CHUNKS_PER_WORKER = 4
+
+TIER_FAST = "fast"
+TIER_LAYOUT = "layout"
+
+# A page needs the layout tier when at least this many, and this share, of
+# its text rows are split into several runs by a wide gap
+MIN_COMPLEX_ROWS = 3
+COMPLEX_ROW_SHARE = 0.3
+# Gap between two runs on a row, in text heights, that separates columns or
+# table cells rather than words
+COLUMN_GAP_HEIGHTS = 1.5
+# Both runs of a two-run row must be this many text heights wide to count as
+# columns
+MIN_COLUMN_HEIGHTS = 4
+# Share of characters without a Unicode mapping (U+FFFD, control codes) that
+# marks an unusable text layer
+MAX_UNMAPPED_SHARE = 0.05
+
+_PAGE_MARKER_RE = re.compile(r"\s*--- Page (\d+) ---\n\n")
+_UNMAPPED_RE = re.compile(r"[\ufffd\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# PDFium is not thread-safe; every pypdfium2 call in this process takes this
+_pdfium_lock = threading.Lock()
+
+
+class ExtractionLimitError(Exception):
+    """The document exceeds the page cap or the extracted-text ceiling"""
+
+
+# ----------------------------------------------------------------------------
+# Page range specs ("1-5,9,12-")
+# ----------------------------------------------------------------------------
+
+def parse_page_range(spec: Optional[str]) -> Optional[PageRanges]:
+    """
+    Parse a page range spec such as "1-5,9,12-" into sorted, merged 1-based
+    inclusive ranges. Returns None for "all"/empty, meaning every page.
+    Raises ValueError for malformed specs.
+    """
+    if spec is None:
+        return None
+    spec = str(spec).strip().lower()
+    if spec in ("", "all", "*"):
+        return None
+
+    ranges: PageRanges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start_str, end_str = (p.strip() for p in part.split("-", 1))
+                start = int(start_str) if start_str else 1
+                end = int(end_str) if end_str else None
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range: '{part}'")
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range: '{part}'")
+        ranges.append((start, end))
+
+    if not ranges:
+        return None
+
+    # Sort and merge overlapping/adjacent ranges
+    ranges.sort(key=lambda r: r[0])
+    merged: PageRanges = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if last_end is None:
+            break
+        if start <= last_end + 1:
+            merged[-1] = (last_start, None if end is None else max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_page_range(ranges: Optional[PageRanges]) -> str:
+    """Canonical string for parsed page ranges (inverse of parse_page_range)"""
+    if ranges is None:
+        return "all"
+    parts = []
+    for start, end in ranges:
+        if end is None:
+            parts.append(f"{start}-")
+        elif start == end:
+            parts.append(str(start))
+        else:
+            parts.append(f"{start}-{end}")
+    return ",".join(parts)
+
+
+def page_in_ranges(page_number: int, ranges: Optional[PageRanges]) -> bool:
+    if ranges is None:
+        return True
+    return any(start <= page_number and (end is None or page_number <= end)
+               for start, end in ranges)
+
+
+def resolve_page_indices(ranges: Optional[PageRanges], num_pages: int) -> List[int]:
+    """0-based page indices selected by ranges within a num_pages document"""
+    if ranges is None:
+        return list(range(num_pages))
+    indices: List[int] = []
+    for start, end in ranges:
+        stop = num_pages if end is None else min(end, num_pages)
+        indices.extend(range(start - 1, stop))
+    return indices
+
+
+# ----------------------------------------------------------------------------
+# Extraction
+# ----------------------------------------------------------------------------
+
+@contextmanager
+def open_pdf(source: PDFSource) -> Iterator["pdfplumber.PDF"]:
+    """Open a PDF from in-memory bytes or from a memory-mapped spill file"""
+    import pdfplumber
+
+    if isinstance(source, str):
+        with open(source, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with pdfplumber.open(mm) as pdf:
+                yield pdf
+    else:
+        # BytesIO shares the caller's buffer until written to, so no copy
+        with pdfplumber.open(io.BytesIO(source)) as pdf:
+            yield pdf
+
+
+def count_pages(source: PDFSource, fast_tier: bool = True) -> int:
+    """Number of pages in a PDF"""
+    if fast_tier:
+        with open_text_layer(source) as doc:
+            if doc is not None:
+                with _pdfium_lock:
+                    return len(doc)
+    with open_pdf(source) as pdf:
+        return len(pdf.pages)
+
+
+@contextmanager
+def open_text_layer(source: PDFSource) -> Iterator[Optional["pdfium.PdfDocument"]]:
+    """Open a PDF with PDFium for the fast tier; None if PDFium cannot read it"""
+    import pypdfium2 as pdfium
+
+    try:
+        with _pdfium_lock:
+            doc = pdfium.PdfDocument(source)
+    except Exception as e:
+        logger.warning(f"Fast text tier unavailable for this PDF ({e}); using layout analysis")
+        yield None
+        return
+    try:
+        yield doc
+    finally:
+        with _pdfium_lock:
+            doc.close()
+
+
+def fast_page_text(doc: "pdfium.PdfDocument", index: int) -> Tuple[str, Optional[str]]:
+    """
+    Text of a page from PDFium's text layer, and the reason it needs the
+    layout tier instead (None when the fast text can be used).
+    """
+    with _pdfium_lock:
+        page = doc[index]
+        try:
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+                rects = [textpage.get_rect(i) for i in range(textpage.count_rects())]
+            finally:
+                textpage.close()
+        finally:
+            page.close()
+    # PDFium ends lines with CRLF and marks generated hyphens with U+0002
+    text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\x02", "-")
+    return text, layout_reason(text, rects)
+
+
+def layout_reason(text: str, rects: List[Tuple[float, float, float, float]]) -> Optional[str]:
+    """Why a page's fast-tier text cannot be trusted, or None if it can"""
+    if not text.strip():
+        return "empty"
+    if len(_UNMAPPED_RE.findall(text)) > MAX_UNMAPPED_SHARE * len(text):
+        return "unmapped"
+
+    # Group the text runs (left, bottom, right, top) into rows by vertical
+    # centre, then count the runs on each row that a wide gap separates
+    rows: List[List] = []  # [centre, height, [(left, right), ...]]
+    for left, bottom, right, top in sorted(rects, key=lambda r: -(r[1] + r[3])):
+        centre, height = (bottom + top) / 2, top - bottom
+        if rows and abs(rows[-1][0] - centre) <= max(height, rows[-1][1]) / 2:
+            rows[-1][2].append((left, right))
+        else:
+            rows.append([centre, height, [(left, right)]])
+
+    split_rows = table_rows = 0
+    for _, height, spans in rows:
+        height = max(height, 1.0)
+        spans.sort()
+        segments = [list(spans[0])]
+        for left, right in spans[1:]:
+            if left - segments[-1][1] > COLUMN_GAP_HEIGHTS * height:
+                segments.append([left, right])
+            else:
+                segments[-1][1] = max(segments[-1][1], right)
+        if len(segments) >= 3:
+            split_rows += 1
+            table_rows += 1
+        elif len(segments) == 2 and all(right - left >= MIN_COLUMN_HEIGHTS * height
+                                        for left, right in segments):
+            # A narrow run beside the text is a bullet, number or page number
+            split_rows += 1
+
+    if split_rows >= MIN_COMPLEX_ROWS and split_rows >= COMPLEX_ROW_SHARE * len(rows):
+        return "table" if table_rows * 2 >= split_rows else "columns"
+    return None
+
+
+def iter_page_texts(source: PDFSource, indices: List[int],
+                    progress: Optional[ProgressCallback] = None,
+                    fast_tier: bool = True) -> Iterator[ExtractedPage]:
+    """
+    Yield (page_number, text, tier, reason) for the given 0-based page
+    indices, empty pages included. Pages go through the fast tier first;
+    pdfplumber opens the document only once a page needs the layout tier,
+    and releases each page's objects and layout once its text is out.
+    """
+    with ExitStack() as stack:
+        doc = stack.enter_context(open_text_layer(source)) if fast_tier else None
+        pdf = None
+        if doc is not None:
+            with _pdfium_lock:
+                num_pages = len(doc)
+        else:
+            pdf = stack.enter_context(open_pdf(source))
+            num_pages = len(pdf.pages)
+
+        for done, i in enumerate(indices, 1):
+            if i >= num_pages:
+                break
+            tier, reason = TIER_LAYOUT, None
+            if doc is not None:
+                try:
+                    page_text, reason = fast_page_text(doc, i)
+                    if reason is None:
+                        tier = TIER_FAST
+                except Exception as e:
+                    logger.warning(f"Fast text tier failed on page {i + 1}: {e}")
+                    reason = "fast_tier_error"
+            if tier == TIER_LAYOUT:
+                if pdf is None:
+                    pdf = stack.enter_context(open_pdf(source))
+                page_text = layout_page_text(pdf, i)
+            yield (i + 1, page_text, tier, reason)
+            if progress is not None:
+                progress(done, len(indices))
+
+
+def layout_page_text(pdf: "pdfplumber.PDF", index: int) -> str:
+    """Text of a page from pdfplumber's layout analysis, releasing the page after"""
+    if index >= len(pdf.pages):
+        return ""
+    page = pdf.pages[index]
+    try:
+        return page.extract_text() or ""
+    finally:
+        page.close()
+
+
+def extract_page_indices(source: PDFSource, indices: List[int],
+                         progress: Optional[ProgressCallback] = None,
+                         fast_tier: bool = True) -> List[ExtractedPage]:
+    """
+    Extract text from the given 0-based page indices. Runs inside pool
+    workers, so it must stay a module-level function (progress is only
+    passed on the serial path).
+    """
+    return list(iter_page_texts(source, indices, progress, fast_tier))
+
+
+def page_tier_summary(page_tiers: List[PageTier]) -> Dict[str, Any]:
+    """
+    Compact per-page tier record for response metadata: page counts, the
+    pages of each tier as a range spec, and the reason for each layout page.
+    """
+    pages: Dict[str, List[int]] = {}
+    reasons: Dict[str, str] = {}
+    for page_number, tier, reason in sorted(page_tiers):
+        pages.setdefault(tier, []).append(page_number)
+        if reason:
+            reasons[str(page_number)] = reason
+    return {
+        "pages": {tier: len(numbers) for tier, numbers in pages.items()},
+        "tiers": {tier: format_page_range(page_numbers_to_ranges(numbers))
+                  for tier, numbers in pages.items()},
+        "layout_reasons": reasons,
+    }
+
+
+def page_numbers_to_ranges(page_numbers: List[int]) -> PageRanges:
+    """Sorted page numbers as merged inclusive ranges ([1, 2, 3, 7] -> 1-3, 7)"""
+    ranges: PageRanges = []
+    for n in page_numbers:
+        if ranges and ranges[-1][1] == n - 1:
+            ranges[-1] = (ranges[-1][0], n)
+        else:
+            ranges.append((n, n))
+    return ranges
+
+
+def format_pages(pages: List[PageText]) -> str:
+    """Join page texts with the '--- Page N ---' markers the prompts rely on"""
+    parts = []
+    for page_number, page_text in pages:
+        parts.append(f"\n\n--- Page {page_number} ---\n\n")
+        parts.append(page_text)
+    return "".join(parts).strip()
+
+
+class PageTextWriter:
+    """
+    Builds the same text as format_pages one page at a time, in a buffer kept
+    in memory up to spool_chars and spilled to a temp file beyond that.
+    Raises ExtractionLimitError once the text would exceed max_chars.
+    """
+
+    def __init__(self, spool_chars: int = 8 * 1024 * 1024, max_chars: Optional[int] = None):
+        self.max_chars = max_chars
+        self.chars = 0
+        self.pages = 0
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=spool_chars, mode="w+",
+                                                     encoding="utf-8")
+        # Trailing whitespace, written only once more text follows (like strip())
+        self._pending = ""
+
+    def write_page(self, page_number: int, page_text: str) -> None:
+        self._write(f"\n\n--- Page {page_number} ---\n\n")
+        self._write(page_text)
+        self.pages += 1
+
+    def _write(self, text: str) -> None:
+        if not self.chars:
+            text = text.lstrip()
+        body = text.rstrip()
+        if not body:
+            if self.chars:
+                self._pending += text
+            return
+        out = self._pending + body
+        if self.max_chars is not None and self.chars + len(out) > self.max_chars:
+            raise ExtractionLimitError(
+                f"Extracted text exceeds the limit of {self.max_chars} characters "
+                f"(reached at page {self.pages + 1})"
+            )
+        self._buffer.write(out)
+        self.chars += len(out)
+        self._pending = text[len(body):]
+
+    def getvalue(self) -> str:
+        self._buffer.seek(0)
+        return self._buffer.read()
+
+    def close(self) -> None:
+        self._buffer.close()
+
+    def __enter__(self) -> "PageTextWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def split_pages(full_text: str) -> List[PageText]:
+    """Inverse of format_pages: recover (page_number, text) from marked text"""
+    pieces = _PAGE_MARKER_RE.split(full_text)
+    # pieces = [preamble, num, text, num, text, ...]
+    return [(int(pieces[i]), pieces[i + 1].rstrip())
+            for i in range(1, len(pieces) - 1, 2)]
+
+
+def page_index(full_text: str) -> List[Dict[str, int]]:
+    """Character offsets of each page's text within marked full text"""
+    index: List[Dict[str, int]] = []
+    matches = list(_PAGE_MARKER_RE.finditer(full_text))
+    for n, match in enumerate(matches):
+        end = matches[n + 1].start() if n + 1 < len(matches) else len(full_text)
+        index.append({"page": int(match.group(1)), "start": match.end(), "end": end})
+    return index
+
+
+def select_pages(full_text: str, ranges: Optional[PageRanges]) -> str:
+    """Keep only the pages of marked full text that fall within ranges"""
+    if ranges is None:
+        return full_text
+    return format_pages([(n, t) for n, t in split_pages(full_text)
+                         if page_in_ranges(n, ranges)])
+
+
+def slice_pages(full_text: str, index: List[Dict[str, int]], ranges: Optional[PageRanges]) -> str:
+    """select_pages using a stored page index instead of scanning the text"""
+    if ranges is None:
+        return full_text
+    return format_pages([(entry["page"], full_text[entry["start"]:entry["end"]].rstrip())
+                         for entry in index if page_in_ranges(entry["page"], ranges)])
+
+
+def split_chunks(indices: List[int], num_chunks: int) -> List[List[int]]:
+    """Split page indices into at most num_chunks contiguous, near-equal chunks"""
+    num_chunks = max(1, min(num_chunks, len(indices)))
+    size, extra = divmod(len(indices), num_chunks)
+    chunks = []
+    start = 0
+    for i in range(num_chunks):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(indices[start:end])
+        start = end
+    return chunks
+
+
+class PDFExtractionEngine:
+    def __init__(self, workers: int = 1, min_parallel_pages: int = 24,
+                 max_pages: Optional[int] = None, fast_tier: bool = True):
+        self.workers = max(1, workers)
+        self.min_parallel_pages = min_parallel_pages
+        self.max_pages = max_pages
+        self.fast_tier = fast_tier
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # "spawn" avoids forking a process that already runs uvicorn's
+                # event loop and thread pool (inherited locks can deadlock)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"Started PDF extraction pool with {self.workers} workers")
+            return self._pool
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def iter_pages(self, source: PDFSource, page_ranges: Optional[PageRanges] = None,
+                   progress: Optional[ProgressCallback] = None) -> Iterator[ExtractedPage]:
+        """
+        Yield (page_number, text, tier, reason) for every selected page, in
+        page order; pages without text come with empty text. Pages outside
+        page_ranges are never opened. Pool workers receive a copy of
+        in-memory sources, so large documents should be passed as a spill
+        file path instead. Raises ExtractionLimitError if
+        more than max_pages pages are selected.
+
+        progress(pages_done, pages_total) is called from the calling thread
+        after every page when extracting serially, and after every chunk
+        when extracting in parallel.
+        """
+        num_pages = count_pages(source, self.fast_tier)
+        indices = resolve_page_indices(page_ranges, num_pages)
+        if self.max_pages is not None and len(indices) > self.max_pages:
+            raise ExtractionLimitError(
+                f"{len(indices)} pages selected; at most {self.max_pages} can be extracted "
+                f"per request (use a page range)"
+            )
+        if progress is not None:
+            progress(0, len(indices))
+
+        if self.workers <= 1 or len(indices) < self.min_parallel_pages:
+            yield from iter_page_texts(source, indices, progress, self.fast_tier)
+            return
+
+        # Smaller chunks when someone is watching, so progress moves steadily
+        num_chunks = self.workers * (PROGRESS_CHUNKS_PER_WORKER if progress else 1)
+        chunks = split_chunks(indices, num_chunks)
+        logger.info(f"Extracting {len(indices)} of {num_pages} pages in {len(chunks)} parallel chunks")
+        futures = {}
+        next_chunk = 0
+        done = 0
+        try:
+            pool = self._get_pool()
+            futures = {pool.submit(extract_page_indices, source, chunk, None, self.fast_tier): n
+                       for n, chunk in enumerate(chunks)}
+            # Chunks finish in any order; hold early ones until their turn
+            finished: Dict[int, List[ExtractedPage]] = {}
+            for future in as_completed(futures):
+                n = futures[future]
+                finished[n] = future.result()
+                done += len(chunks[n])
+                if progress is not None:
+                    progress(done, len(indices))
+                while next_chunk in finished:
+                    yield from finished.pop(next_chunk)
+                    next_chunk += 1
+        except BrokenProcessPool as e:
+            logger.error(f"PDF extraction pool broke ({e}); retrying serially")
+            self._reset_pool()
+            remaining = [i for chunk in chunks[next_chunk:] for i in chunk]
+            offset = len(indices) - len(remaining)
+            serial_progress = None if progress is None else (
+                lambda pages_done, _: progress(offset + pages_done, len(indices))
+            )
+            yield from iter_page_texts(source, remaining, serial_progress, self.fast_tier)
+        finally:
+            # The consumer may stop early (e.g. over its text ceiling)
+            for future in futures:
+                future.cancel()
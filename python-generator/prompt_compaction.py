@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from pdf_extraction import PageText, format_pages, split_pages
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PROMPT COMPACTION AND TOKEN BUDGETS
+# ============================================================================
+#
+# Source text goes through these steps before it is put in a prompt:
+#
+#   1. running headers/footers (lines repeated at the top or bottom of many
+#      pages, page numbers included) are stripped,
+#   2. whitespace runs are collapsed,
+#   3. blocks that repeat earlier text word for word are dropped, and
+#   4. if the text is still over the token budget for the generation type,
+#      every page is trimmed by the same proportion at a sentence or line
+#      boundary. The result is deterministic, so identical requests still
+#      produce identical prompts, and each page keeps its opening text.
+#
+# Page markers are kept so page references still work; markers of pages
+# left without text are dropped.
+
+# Lines inspected at each end of a page when looking for headers/footers
+EDGE_LINES = 2
+# A line is a running header/footer if it repeats on at least this many
+# pages and on at least this share of them
+MIN_REPEAT_PAGES = 3
+MIN_REPEAT_SHARE = 0.5
+# Headers and footers are short; longer lines are always treated as body text
+MAX_RUNNING_LINE_CHARS = 100
+# Blocks shorter than this are never deduplicated ("Example:", "Solution")
+MIN_DEDUPE_CHARS = 40
+TRUNCATION_MARK = "[...]"
+
+_TOKEN_PIECE_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+_INLINE_SPACE_RE = re.compile(r"[^\S\n]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+_DIGITS_RE = re.compile(r"\d+")
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s|\n")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate the model's token count without calling the API: words cost
+    about one token per five letters, digit runs one per three digits, and
+    every other symbol one token. This is the one estimator for every token
+    budget (retrieval, document artifacts, compaction and the rate limiter).
+    """
+    total = 0
+    for piece in _TOKEN_PIECE_RE.findall(text):
+        first = piece[0]
+        if first.isalpha() and first.isascii():
+            total += 1 + (len(piece) - 1) // 5
+        elif first.isdigit():
+            total += (len(piece) + 2) // 3
+        else:
+            total += 1
+    return total
+
+
+def _normalize_line(line: str) -> str:
+    # Page numbers and dates change from page to page; the rest of a
+    # running header does not
+    return _DIGITS_RE.sub("#", " ".join(line.lower().split()))
+
+
+def _edge_lines(lines: List[str]) -> List[int]:
+    """Indices of the first and last EDGE_LINES non-empty lines"""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    # Short pages are mostly body text; only look at their very first/last line
+    edge = max(1, min(EDGE_LINES, len(filled) // 4))
+    return sorted(set(filled[:edge] + filled[-edge:]))
+
+
+def strip_running_lines(pages: List[PageText]) -> Tuple[List[PageText], int]:
+    """Remove headers/footers repeated across pages; returns (pages, lines_removed)"""
+    if len(pages) < MIN_REPEAT_PAGES:
+        return pages, 0
+
+    page_lines = [text.split("\n") for _, text in pages]
+    seen = Counter()
+    for lines in page_lines:
+        seen.update({_normalize_line(lines[i]) for i in _edge_lines(lines)})
+
+    threshold = max(MIN_REPEAT_PAGES, math.ceil(MIN_REPEAT_SHARE * len(pages)))
+    running: Set[str] = {line for line, n in seen.items()
+                         if line and len(line) <= MAX_RUNNING_LINE_CHARS and n >= threshold}
+    if not running:
+        return pages, 0
+
+    removed = 0
+    stripped: List[PageText] = []
+    for (page_number, _), lines in zip(pages, page_lines):
+        drop = {i for i in _edge_lines(lines) if _normalize_line(lines[i]) in running}
+        removed += len(drop)
+        stripped.append((page_number, "\n".join(line for i, line in enumerate(lines) if i not in drop)))
+    return stripped, removed
+
+
+def collapse_whitespace(text: str) -> str:
+    """Single spaces within lines, at most one blank line between blocks"""
+    text = _INLINE_SPACE_RE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def dedupe_blocks(pages: List[PageText]) -> Tuple[List[PageText], int]:
+    """Drop blocks (blank-line separated) that already appeared earlier in the document"""
+    seen: Set[bytes] = set()
+    removed = 0
+    deduped: List[PageText] = []
+    for page_number, text in pages:
+        kept: List[str] = []
+        for block in _BLOCK_SPLIT_RE.split(text):
+            if len(block) >= MIN_DEDUPE_CHARS:
+                digest = hashlib.blake2b(" ".join(block.lower().split()).encode("utf-8"),
+                                         digest_size=16).digest()
+                if digest in seen:
+                    removed += 1
+                    continue
+                seen.add(digest)
+            kept.append(block)
+        deduped.append((page_number, "\n\n".join(kept)))
+    return deduped, removed
+
+
+def _cut(text: str, max_chars: int) -> str:
+    """Prefix of text of at most max_chars, ending at a sentence or line boundary if possible"""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    boundaries = [m.start() for m in _BOUNDARY_RE.finditer(head)]
+    if boundaries and boundaries[-1] >= max_chars // 2:
+        head = head[:boundaries[-1]]
+    else:
+        head = head.rsplit(" ", 1)[0] if " " in head else head
+    return f"{head.rstrip()} {TRUNCATION_MARK}" if head.strip() else ""
+
+
+def _join(pages: List[PageText]) -> str:
+    if len(pages) == 1 and pages[0][0] == 0:
+        return pages[0][1]
+    return format_pages([(n, t) for n, t in pages if t])
+
+
+def truncate_pages(pages: List[PageText], token_budget: int) -> Tuple[List[PageText], bool]:
+    """Trim every page by the same proportion until the joined text fits token_budget"""
+    text = _join(pages)
+    tokens = count_tokens(text)
+    if tokens <= token_budget:
+        return pages, False
+
+    ratio = token_budget / tokens
+    for _ in range(8):
+        trimmed = [(n, _cut(t, int(len(t) * ratio))) for n, t in pages]
+        tokens = count_tokens(_join(trimmed))
+        if tokens <= token_budget:
+            return trimmed, True
+        ratio *= min(0.95, token_budget / tokens)
+    logger.warning(f"Prompt text still ~{tokens} tokens after truncation (budget {token_budget})")
+    return trimmed, True
+
+
+def compact_text(full_text: str, token_budget: int) -> Tuple[str, Dict[str, Any]]:
+    """Return (compacted_text, stats) for text that is about to go into a prompt"""
+    tokens_before = count_tokens(full_text)
+    pages = split_pages(full_text) or [(0, full_text)]
+
+    pages, running_removed = strip_running_lines(pages)
+    pages = [(n, collapse_whitespace(t)) for n, t in pages]
+    pages, duplicates_removed = dedupe_blocks(pages)
+    pages, truncated = truncate_pages(pages, token_budget)
+
+    text = _join(pages)
+    tokens_after = count_tokens(text)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "token_budget": token_budget,
+        "truncated": truncated,
+        "header_footer_lines_removed": running_removed,
+        "duplicate_blocks_removed": duplicates_removed,
+    }
+    logger.info(f"Compacted prompt text from ~{tokens_before} to ~{tokens_after} tokens "
+                f"(budget {token_budget}, truncated={truncated})")
+    return text, stats
+
+
+class ContextCache:
+    """
+    Small LRU of prepared prompt contexts, (compacted_text, metadata), so
+    follow-up prompts over the same source skip retrieval and compaction
+    """
+
+    def __init__(self, max_items: int = 32):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: str,
+                     build: Callable[[], Tuple[str, Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+        if entry is None:
+            entry = build()
+            with self._lock:
+                self._items[key] = entry
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        # Callers add their own keys to the metadata
+        return entry[0], dict(entry[1])
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# QUIZ POST-PROCESSING AND VALIDATION
+# ============================================================================
+#
+# A generated quiz goes through one batch pass:
+#
+#   1. every question's choices become a list of {key, text} entries, and
+#      the answer is resolved through key and text lookup maps built once per
+#      question (answer_text is derived from it),
+#   2. near-identical questions are found with MinHash signatures of their
+#      hashed word shingles. Signatures are computed for all questions at
+#      once with numpy, and LSH bands narrow the comparisons to likely pairs,
+#      so the cost stays linear in the number of questions (small quizzes
+#      are compared pair by pair), and
+#   3. each question is validated: question text present, the expected
+#      number of distinct choices, and an answer that names one of them.
+#
+# Invalid and duplicate questions are kept in the result. The report lists
+# their indices and problems, so a caller can ask for replacements of those
+# items only instead of regenerating the whole quiz.
+
+EXPECTED_CHOICES = 4
+# Word shingle length for near-duplicate detection
+SHINGLE_WORDS = 3
+# Questions whose shingle sets overlap at least this much are duplicates
+DUPLICATE_JACCARD = 0.8
+# MinHash signature length = LSH bands x rows per band. Pairs with a
+# similarity of about (1 / BANDS) ** (1 / BAND_ROWS) (0.55 here) or more
+# become candidates; the exact Jaccard similarity then decides.
+LSH_BANDS = 20
+LSH_BAND_ROWS = 5
+# Up to this many questions are simply compared pair by pair
+PAIRWISE_MAX_TEXTS = 32
+
+_WORD_RE = re.compile(r"\w+")
+
+_rng = np.random.default_rng(20240611)
+# Multiply-shift hash family: h(x) = (a * x + b) >> 32 with odd a, mod 2**64
+_HASH_A = _rng.integers(1, 2**63, size=LSH_BANDS * LSH_BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+_HASH_B = _rng.integers(0, 2**63, size=LSH_BANDS * LSH_BAND_ROWS, dtype=np.uint64)
+# Odd multipliers folding word hashes into shingle hashes, and rows into band keys
+_SHINGLE_MIX = np.uint64(0x9E3779B97F4A7C15)
+_BAND_MIX = np.uint64(0x100000001B3)
+
+
+def choice_text(value: Any) -> str:
+    if isinstance(value, str):
+        return value.strip()
+    return json.dumps(value, ensure_ascii=False).strip()
+
+
+def normalize_choices(choices: Any) -> List[Dict[str, str]]:
+    """Normalize choices into a list of {key, text} dictionaries, dropping empty ones"""
+    normalized: List[Dict[str, str]] = []
+
+    if isinstance(choices, dict):
+        keys = [str(key) for key in choices]
+        items = list(zip(keys, choices.values()))
+        # JSON objects from the model are almost always already in key order
+        if keys != sorted(keys):
+            items.sort(key=lambda item: item[0])
+        for idx, (key, value) in enumerate(items):
+            text = value.strip() if isinstance(value, str) else choice_text(value)
+            if text:
+                normalized.append({"key": (key.strip() or chr(65 + idx)).upper(), "text": text})
+    elif isinstance(choices, list):
+        for idx, choice in enumerate(choices):
+            if isinstance(choice, dict):
+                label = choice.get("key") or choice.get("label") or chr(65 + idx)
+                text = choice_text(choice.get("text") or choice.get("value") or "")
+            else:
+                label = chr(65 + idx)
+                text = choice_text(choice)
+            if text:
+                normalized.append({"key": str(label).strip().upper(), "text": text})
+
+    return normalized
+
+
+def normalize_question(question: Dict[str, Any]) -> List[str]:
+    """
+    Normalize one question in place (choices, answer_text) and return its
+    problems; duplicates are not checked here.
+    """
+    choices = normalize_choices(question.get("choices", []))
+    question["choices"] = choices
+
+    # Built back to front so the first choice wins a repeated key or text
+    by_key = {choice["key"]: choice["text"] for choice in reversed(choices)}
+    by_text = {choice["text"].lower(): choice["text"] for choice in reversed(choices)}
+
+    problems: List[str] = []
+    if not str(question.get("question") or "").strip():
+        problems.append("missing_question")
+    if len(choices) != EXPECTED_CHOICES:
+        problems.append("choice_count")
+    if len(by_text) < len(choices):
+        problems.append("duplicate_choices")
+
+    answer = question.get("answer")
+    answer_text = None
+    if isinstance(answer, str):
+        answer_clean = answer.strip()
+        answer_text = by_key.get(answer_clean.upper()) or by_text.get(answer_clean.lower())
+    elif isinstance(answer, dict):
+        answer_text = answer.get("text") or answer.get("value")
+        if not isinstance(answer_text, str):
+            answer_text = None
+
+    if answer_text and answer_text.strip():
+        question["answer_text"] = answer_text.strip()
+        if answer_text.strip().lower() not in by_text:
+            problems.append("answer_not_in_choices")
+    else:
+        question.pop("answer_text", None)
+        problems.append("answer_not_in_choices" if answer not in (None, "") else "missing_answer")
+
+    return problems
+
+
+def word_hash(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def shingle_hashes(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    64-bit hashes of the lowercased word shingles of all `texts`, and each
+    text's [start, end) slice of them. Texts shorter than a shingle get one
+    shingle of their words; texts without words get none.
+    """
+    cache: Dict[str, int] = {}
+    words: List[int] = []
+    owners: List[int] = []
+    for index, text in enumerate(texts):
+        tokens = _WORD_RE.findall(text.lower())
+        if not tokens:
+            continue
+        for token in tokens:
+            value = cache.get(token)
+            if value is None:
+                value = cache[token] = word_hash(token)
+            words.append(value)
+        # Zero padding keeps short texts to exactly one shingle
+        padding = max(0, SHINGLE_WORDS - len(tokens))
+        words.extend([0] * padding)
+        owners.extend([index] * (len(tokens) + padding))
+
+    bounds = np.zeros((len(texts), 2), dtype=np.int64)
+    if not words:
+        return np.zeros(0, dtype=np.uint64), bounds
+
+    values = np.array(words, dtype=np.uint64)
+    owner = np.array(owners, dtype=np.int64)
+    span = len(values) - SHINGLE_WORDS + 1
+    hashed = values[:span].copy()
+    for offset in range(1, SHINGLE_WORDS):
+        hashed = hashed * _SHINGLE_MIX ^ values[offset:offset + span]
+    # Only shingles whose words all come from one text
+    keep = owner[:span] == owner[SHINGLE_WORDS - 1:]
+    hashed, owner = hashed[keep], owner[:span][keep]
+
+    bounds[:, 0] = np.searchsorted(owner, np.arange(len(texts)), side="left")
+    bounds[:, 1] = np.searchsorted(owner, np.arange(len(texts)), side="right")
+    return hashed, bounds
+
+
+def minhash_signatures(hashes: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    One MinHash signature row per non-empty run of `hashes` beginning at
+    each of `starts` (sorted; a run ends where the next begins).
+    """
+    # (hash functions x all shingles), then the minimum over each run
+    hashed = (_HASH_A[:, None] * hashes[None, :] + _HASH_B[:, None]) >> np.uint64(32)
+    return np.minimum.reduceat(hashed, starts, axis=1).T
+
+
+def lsh_candidates(present: List[int], signatures: np.ndarray) -> Dict[int, Set[int]]:
+    """For each text, the earlier texts sharing at least one LSH band with it"""
+    candidates: Dict[int, Set[int]] = {}
+    for band in range(LSH_BANDS):
+        # Fold the band's rows into one key per text, then group equal keys
+        rows = signatures[:, band * LSH_BAND_ROWS:(band + 1) * LSH_BAND_ROWS]
+        keys = rows[:, 0].copy()
+        for column in range(1, LSH_BAND_ROWS):
+            keys = keys * _BAND_MIX ^ rows[:, column]
+        order = np.argsort(keys, kind="stable")
+        ordered = keys[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        ends = np.r_[starts[1:], len(ordered)]
+        shared = ends - starts > 1
+        for start, end in zip(starts[shared].tolist(), ends[shared].tolist()):
+            members = [present[pos] for pos in order[start:end].tolist()]
+            for i, index in enumerate(members[1:], 1):
+                candidates.setdefault(index, set()).update(members[:i])
+    return candidates
+
+
+def find_near_duplicates(texts: List[str], threshold: float = DUPLICATE_JACCARD) -> Dict[int, int]:
+    """
+    Map the index of every text that nearly repeats an earlier one to the
+    index of the first occurrence it repeats.
+    """
+    hashes, bounds = shingle_hashes(texts)
+    present = np.flatnonzero(bounds[:, 1] > bounds[:, 0]).tolist()
+    if len(present) < 2:
+        return {}
+
+    if len(present) <= PAIRWISE_MAX_TEXTS:
+        candidates = {index: set(present[:i]) for i, index in enumerate(present) if i}
+    else:
+        candidates = lsh_candidates(present, minhash_signatures(hashes, bounds[present, 0]))
+
+    shingles: Dict[int, Set[int]] = {}
+
+    def shingle_set(index: int) -> Set[int]:
+        if index not in shingles:
+            start, end = bounds[index].tolist()
+            shingles[index] = set(hashes[start:end].tolist())
+        return shingles[index]
+
+    duplicates: Dict[int, int] = {}
+    for index in sorted(candidates):
+        mine = shingle_set(index)
+        for earlier in sorted(candidates[index]):
+            if earlier in duplicates:
+                continue
+            other = shingle_set(earlier)
+            if len(mine & other) / len(mine | other) >= threshold:
+                duplicates[index] = earlier
+                break
+    return duplicates
+
+
+def postprocess_quiz(questions: List[Any], requested: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Normalize `questions` in place and return the quality report:
+
+        {"requested": 10, "received": 9, "valid": 7, "missing": 1,
+         "invalid": [{"index": 2, "problems": ["choice_count"]},
+                     {"index": 5, "problems": ["duplicate"], "duplicate_of": 1}],
+         "needs_regeneration": [2, 5]}
+
+    `missing` counts questions short of `requested` that were never returned;
+    replacing needs_regeneration items and adding `missing` new ones
+    completes the quiz.
+    """
+    problems: List[List[str]] = []
+    texts: List[str] = []
+    for question in questions:
+        if isinstance(question, dict):
+            problems.append(normalize_question(question))
+            texts.append(str(question.get("question") or ""))
+        else:
+            problems.append(["not_an_object"])
+            texts.append("")
+
+    duplicates = find_near_duplicates(texts)
+    invalid: List[Dict[str, Any]] = []
+    for index, found in enumerate(problems):
+        if index in duplicates:
+            found.append("duplicate")
+        if found:
+            entry: Dict[str, Any] = {"index": index, "problems": found}
+            if index in duplicates:
+                entry["duplicate_of"] = duplicates[index]
+            invalid.append(entry)
+
+    received = len(questions)
+    report = {
+        "requested": requested if requested is not None else received,
+        "received": received,
+        "valid": received - len(invalid),
+        "missing": max(0, (requested or 0) - received),
+        "invalid": invalid,
+        "needs_regeneration": [entry["index"] for entry in invalid],
+    }
+    if invalid or report["missing"]:
+        logger.info(f"Quiz validation: {report['valid']}/{report['requested']} usable, "
+                    f"{len(invalid)} to regenerate, {report['missing']} missing")
+    return report
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from pdf_extraction import format_page_range, parse_page_range
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# GENERATION RESULT CACHE
+# ============================================================================
+#
+# Identical generation requests (same document, query, type, Bloom level,
+# settings and model) are answered from a cache instead of calling Gemini
+# again. Entries expire after a TTL and the least recently used entries are
+# evicted once the backend is full. Results are stored as JSON, so callers
+# always get a private copy they can mutate.
+
+# Settings that do not change what the model is asked to produce
+_NON_SEMANTIC_SETTINGS = {"fresh"}
+_TRUE_STRINGS = {"1", "true", "yes", "on"}
+
+
+def parse_flag(value: Any) -> bool:
+    """A boolean setting from JSON: true, 1 and "true"/"1"/"yes"/"on" (any case)"""
+    if isinstance(value, str):
+        return value.strip().lower() in _TRUE_STRINGS
+    return value is True or (isinstance(value, (int, float)) and value == 1)
+
+
+def normalize_settings(settings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Drop request-only flags and canonicalize values that have several spellings"""
+    normalized: Dict[str, Any] = {}
+    for key, value in (settings or {}).items():
+        if key in _NON_SEMANTIC_SETTINGS or value is None:
+            continue
+        if key == "page_range":
+            try:
+                value = format_page_range(parse_page_range(value))
+            except ValueError:
+                value = str(value).strip()
+        normalized[key] = value
+    return normalized
+
+
+def generation_fingerprint(document_hash: str, query: str, generation_type: str,
+                           bloom_level: Optional[str], settings: Optional[Dict[str, Any]],
+                           model_name: str) -> str:
+    """Stable SHA-256 over everything that determines a generation result"""
+    payload = {
+        "document": document_hash,
+        "query": query.strip(),
+        "type": generation_type,
+        "bloom_level": bloom_level,
+        "settings": normalize_settings(settings),
+        "model": model_name,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+# ----------------------------------------------------------------------------
+# Backends
+# ----------------------------------------------------------------------------
+
+class MemoryResultBackend:
+    """In-process LRU of (expires_at, json) entries"""
+
+    def __init__(self, max_items: int = 1024):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteResultBackend:
+    """Local SQLite file, shared by every worker process on the instance"""
+
+    def __init__(self, path: str, max_items: int = 10000):
+        self.path = path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per process, opened on first use (see SQLiteJobStore)
+        if self._pid != os.getpid():
+            self._connection = self._connect()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_generation_results_accessed "
+            "ON generation_results (accessed_at)"
+        )
+        return conn
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM generation_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM generation_results WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE generation_results SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return value
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_results (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now)
+            )
+            self._conn.execute("DELETE FROM generation_results WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM generation_results WHERE key IN ("
+                "  SELECT key FROM generation_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_items,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM generation_results").fetchone()[0]
+
+
+# ----------------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------------
+
+class ResultCache:
+    def __init__(self, backend, ttl_seconds: float = 86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._stats = {"hits": 0, "misses": 0, "stores": 0}
+        # get/set run in worker threads (asyncio.to_thread), keep the counters exact
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.backend.get(key, time.time())
+        except Exception as e:
+            # A broken cache must never fail a generation
+            logger.warning(f"Result cache read failed: {e}")
+            value = None
+        with self._stats_lock:
+            self._stats["misses" if value is None else "hits"] += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        try:
+            value = json.dumps(result, ensure_ascii=False)
+            self.backend.set(key, value, time.time() + self.ttl_seconds)
+            with self._stats_lock:
+                self._stats["stores"] += 1
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "items": len(self.backend)}
+
+
+def create_result_cache(backend_name: str, ttl_seconds: float, max_items: int,
+                        sqlite_path: str) -> Optional[ResultCache]:
+    """Build the configured cache; 'none' disables result caching"""
+    backend_name = backend_name.lower()
+    if backend_name == "none":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteResultBackend(sqlite_path, max_items)
+    elif backend_name == "memory":
+        backend = MemoryResultBackend(max_items)
+    else:
+        raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {backend_name}")
+    logger.info(f"Result cache: {backend_name} (ttl={ttl_seconds}s, max_items={max_items})")
+    return ResultCache(backend, ttl_seconds)
@@ -0,0 +1,266 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_extraction import format_pages, split_pages
+from prompt_compaction import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CHUNKING AND RETRIEVAL
+# ============================================================================
+#
+# Long documents are split into page- and paragraph-aware chunks and indexed
+# with BM25. For each request only the best-scoring chunks that fit the token
+# budget are sent to the model, re-assembled in document order with their
+# '--- Page N ---' markers so page references still make sense.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in into is it its of on or
+that the their this to was were will with which what when where who how
+generate create make quiz quizzes question questions assignment summary
+summarize about based material text pdf page pages please
+""".split())
+# Words the frontend's request templates add to every query ("Generate a
+# medium summary from pages all", "... with 5 questions from pages 1-10")
+_QUERY_STOPWORDS = frozenset("""
+all short medium long brief detailed task tasks
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower())
+            if len(t) > 1 and t not in _STOPWORDS]
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    Distinct terms of a query worth matching. Numbers are dropped: in
+    queries they are item counts and page ranges, which would otherwise
+    match chunks that merely mention the same page or figure numbers.
+    """
+    return list(dict.fromkeys(t for t in tokenize(query)
+                              if not t.isdigit() and t not in _QUERY_STOPWORDS))
+
+
+@dataclass
+class Chunk:
+    position: int       # order within the document
+    page: int           # 1-based page number, 0 when the text has no markers
+    text: str
+    tokens: int
+
+
+def _split_long(paragraph: str, max_chars: int) -> List[str]:
+    """Split an oversized paragraph on sentence boundaries, then hard-wrap"""
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_RE.split(paragraph):
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(full_text: str, max_chars: int = 1200) -> List[Chunk]:
+    """
+    Split text into chunks that never cross a page boundary and, where
+    possible, pack whole paragraphs up to max_chars.
+    """
+    pages = split_pages(full_text) or [(0, full_text)]
+    chunks: List[Chunk] = []
+
+    for page_number, page_text in pages:
+        current: List[str] = []
+        current_len = 0
+
+        def flush():
+            nonlocal current, current_len
+            if current:
+                text = "\n\n".join(current)
+                chunks.append(Chunk(len(chunks), page_number, text, count_tokens(text)))
+            current, current_len = [], 0
+
+        for paragraph in _PARAGRAPH_RE.split(page_text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            parts = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars)
+            for part in parts:
+                if current and current_len + len(part) > max_chars:
+                    flush()
+                current.append(part)
+                current_len += len(part) + 2
+        flush()
+
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+
+        doc_lens = np.zeros(len(chunks), dtype=np.float32)
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for doc_id, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk.text))
+            doc_lens[doc_id] = sum(terms.values())
+            for term, tf in terms.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+
+        n = max(len(chunks), 1)
+        avgdl = float(doc_lens.mean()) if len(chunks) else 1.0
+        # Per-document length normalisation, precomputed once
+        self._norm = k1 * (1 - b + b * doc_lens / max(avgdl, 1.0))
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for term, (ids, tfs) in postings.items():
+            df = len(ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            self._postings[term] = (
+                np.asarray(ids, dtype=np.int32),
+                np.asarray(tfs, dtype=np.float32),
+                idf,
+            )
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for the query"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in query_terms(query):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs, idf = posting
+            # ids are unique per term, so fancy-index += is safe here
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[ids])
+        return scores
+
+
+def select_chunks(index: BM25Index, query: str, token_budget: int,
+                  max_chunks: int = 40) -> List[Chunk]:
+    """
+    Pick the highest-scoring chunks that fit in token_budget, returned in
+    document order. Leftover budget goes to the chunks nearest the matches,
+    so hits keep their surrounding context. If the query matches nothing,
+    or has no terms left once boilerplate and numbers are dropped (e.g.
+    "Generate quiz with 5 questions from pages 1-10"), chunks are sampled
+    evenly across the document.
+    """
+    chunks = index.chunks
+    if not chunks:
+        return []
+
+    scores = index.score(query)
+    hits = np.flatnonzero(scores > 0)
+    if len(hits):
+        ranked = hits[np.argsort(-scores[hits], kind="stable")]
+        # Distance of every chunk to its nearest hit (hits are sorted)
+        positions = np.arange(len(chunks))
+        right = np.clip(np.searchsorted(hits, positions), 0, len(hits) - 1)
+        left = np.clip(right - 1, 0, len(hits) - 1)
+        distance = np.minimum(np.abs(positions - hits[left]), np.abs(positions - hits[right]))
+        misses = np.flatnonzero(scores <= 0)
+        order = np.concatenate([ranked, misses[np.argsort(distance[misses], kind="stable")]])
+    else:
+        total = sum(c.tokens for c in chunks)
+        stride = max(1, math.ceil(total / max(token_budget, 1)))
+        order = np.concatenate([np.arange(offset, len(chunks), stride)
+                                for offset in range(stride)])
+
+    selected: List[int] = []
+    used = 0
+    for i in order:
+        if len(selected) >= max_chunks:
+            break
+        tokens = chunks[i].tokens
+        if used + tokens > token_budget:
+            continue
+        selected.append(int(i))
+        used += tokens
+
+    return [chunks[i] for i in sorted(selected)]
+
+
+def format_chunks(chunks: List[Chunk]) -> str:
+    """Re-assemble selected chunks with page markers, merging same-page runs"""
+    if chunks and all(c.page == 0 for c in chunks):
+        return "\n\n".join(c.text for c in chunks)
+
+    pages: List[Tuple[int, str]] = []
+    for chunk in chunks:
+        if pages and pages[-1][0] == chunk.page:
+            pages[-1] = (chunk.page, f"{pages[-1][1]}\n\n{chunk.text}")
+        else:
+            pages.append((chunk.page, chunk.text))
+    return format_pages(pages)
+
+
+class RetrievalIndexCache:
+    """Small LRU of BM25 indexes keyed by document hash"""
+
+    def __init__(self, max_items: int = 16):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: str, build: Callable[[], BM25Index]) -> BM25Index:
+        with self._lock:
+            index = self._items.get(key)
+            if index is not None:
+                self._items.move_to_end(key)
+                return index
+
+        index = build()
+        with self._lock:
+            self._items[key] = index
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return index
+
+
+def retrieve_context(full_text: str, query: str, doc_key: str, index_cache: RetrievalIndexCache,
+                     token_budget: int, chunk_chars: int = 1200,
+                     max_chunks: int = 40) -> Tuple[str, Optional[Dict[str, object]]]:
+    """
+    Return (context_text, retrieval_metadata). Text that already fits the
+    budget is returned unchanged with no metadata.
+    """
+    full_tokens = count_tokens(full_text)
+    if full_tokens <= token_budget:
+        return full_text, None
+
+    index = index_cache.get_or_build(
+        doc_key, lambda: BM25Index(chunk_text(full_text, chunk_chars))
+    )
+    selected = select_chunks(index, query, token_budget, max_chunks)
+    context = format_chunks(selected)
+    context_tokens = count_tokens(context)
+    logger.info(f"Retrieved {len(selected)}/{len(index.chunks)} chunks "
+                f"({context_tokens} of ~{full_tokens} tokens)")
+    return context, {
+        "chunks_total": len(index.chunks),
+        "chunks_used": len(selected),
+        "pages": sorted({c.page for c in selected if c.page}),
+        "estimated_tokens": context_tokens,
+    }
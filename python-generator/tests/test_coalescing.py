@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from coalescing import SingleFlight
+
+
+class Work:
+    """A shared call that runs until released"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result if result is not None else {"items": [1, 2]}
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_call_and_get_copies():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers)
+        assert work.calls == 1
+        assert all(result == {"items": [1, 2]} for result in results)
+        results[0]["items"].append(3)
+        assert results[1] == {"items": [1, 2]}
+        assert flight.stats()["saved"] == 2
+        assert flight.stats()["in_flight"] == 0
+    run(main())
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        leader = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        work.release.set()
+        assert await follower == {"items": [1, 2]}
+        assert work.calls == 1
+        assert not work.cancelled
+        assert flight.stats()["cancelled"] == 0
+    run(main())
+
+
+def test_last_caller_leaving_cancels_the_work():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        caller = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        assert work.cancelled
+        assert flight.stats()["cancelled"] == 1
+        # The next caller starts a fresh call instead of joining the cancelled one
+        retry = Work()
+        retry.release.set()
+        assert await flight.do("key", retry) == {"items": [1, 2]}
+        assert retry.calls == 1
+    run(main())
+
+
+def test_errors_reach_every_caller():
+    async def main():
+        flight, work = SingleFlight("test"), Work(error=RuntimeError("download failed"))
+        callers = [asyncio.create_task(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert work.calls == 1
+        assert flight.stats()["errors"] == 1
+        assert flight.stats()["in_flight"] == 0
+    run(main())
+
+
+def test_different_keys_do_not_coalesce():
+    async def main():
+        flight, first, second = SingleFlight("test"), Work(), Work()
+        first.release.set()
+        second.release.set()
+        await asyncio.gather(flight.do("a", first), flight.do("b", second))
+        assert (first.calls, second.calls) == (1, 1)
+        assert flight.stats()["saved"] == 0
+    run(main())
@@ -0,0 +1,163 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from ingestion_jobs import IngestionQueue, SQLiteJobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_create_reuses_the_queued_job(store):
+    first = store.create("a.pdf", "bucket")
+    assert store.create("a.pdf", "bucket")["id"] == first["id"]
+    assert store.create("b.pdf", "bucket")["id"] != first["id"]
+    store.claim()
+    # Once the first one runs, a new request queues a fresh job
+    assert store.create("a.pdf", "bucket")["id"] != first["id"]
+
+
+def test_claim_counts_attempts(store):
+    job = store.create("a.pdf", "bucket")
+    claimed = store.claim()
+    assert (claimed["id"], claimed["status"], claimed["attempts"]) == (job["id"], "running", 1)
+    assert store.claim() is None
+    assert store.requeue(job["id"], 1, "boom")
+    assert store.claim()["attempts"] == 2
+
+
+def test_requeue_delay_holds_the_job_back(store):
+    job = store.create("a.pdf", "bucket")
+    store.claim()
+    assert store.requeue(job["id"], 1, "boom", delay=60)
+    assert store.get(job["id"])["status"] == "queued"
+    assert store.claim() is None
+    store._conn.execute("UPDATE ingestion_jobs SET not_before = ?", (time.time() - 1,))
+    assert store.claim()["id"] == job["id"]
+
+
+def test_finish_is_guarded_by_attempt(store):
+    job = store.create("a.pdf", "bucket")
+    store.claim()
+    # The first worker stalls; the stale check hands the job to another
+    assert store.requeue_stale(time.time() + 1) == 1
+    assert store.finish(job["id"], 1, {"late": True}) is False
+    assert store.claim()["attempts"] == 2
+    assert store.update(job["id"], 1, stage="saving") is False
+    assert store.finish(job["id"], 1, {"late": True}) is False
+    assert store.requeue(job["id"], 1) is False
+    assert store.finish(job["id"], 2, {"ok": True}) is True
+    finished = store.get(job["id"])
+    assert (finished["status"], finished["result"]) == ("succeeded", {"ok": True})
+    # Finished jobs stay finished
+    assert store.finish(job["id"], 2, None, "again") is False
+
+
+def test_requeue_stale_only_touches_silent_jobs(store):
+    job = store.create("a.pdf", "bucket")
+    store.claim()
+    assert store.requeue_stale(time.time() - 60) == 0
+    assert store.update(job["id"], 1, stage="extracting", pages_done=3, pages_total=10)
+    assert store.get(job["id"])["stage"] == "extracting"
+    assert store.requeue_stale(time.time() + 1) == 1
+    assert store.get(job["id"])["status"] == "queued"
+
+
+def test_old_queue_files_are_migrated(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE ingestion_jobs (
+            id TEXT PRIMARY KEY, pdf_id TEXT NOT NULL, bucket_name TEXT NOT NULL,
+            status TEXT NOT NULL, stage TEXT, pages_done INTEGER NOT NULL DEFAULT 0,
+            pages_total INTEGER, attempts INTEGER NOT NULL DEFAULT 0, result TEXT,
+            error TEXT, created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("INSERT INTO ingestion_jobs (id, pdf_id, bucket_name, status, created_at, updated_at) "
+                 "VALUES ('old', 'a.pdf', 'bucket', 'queued', 0, 0)")
+    conn.commit()
+    conn.close()
+    assert SQLiteJobStore(path).claim()["id"] == "old"
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class NotFound(Exception):
+    status_code = 404
+
+
+def run_queue(store, handler, until, **options):
+    async def main():
+        queue = IngestionQueue(store, handler, workers=1, poll_interval=0.01, **options)
+        queue.start()
+        job = await queue.enqueue("a.pdf", "bucket")
+        deadline = time.monotonic() + 5
+        while not until(store.get(job["id"]), queue.stats()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return store.get(job["id"]), queue.stats()
+    return asyncio.run(main())
+
+
+def test_retries_back_off(store):
+    calls = []
+
+    async def handler(job, report):
+        calls.append(time.monotonic())
+        raise ServerError("storage unavailable")
+
+    job, stats = run_queue(store, handler, lambda job, stats: job["status"] == "failed",
+                           max_attempts=3, retry_delay=0.1)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 3, "storage unavailable")
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.1
+    assert calls[2] - calls[1] >= 0.2
+    assert (stats["retried"], stats["failed"]) == (2, 1)
+
+
+def test_client_errors_are_not_retried(store):
+    async def handler(job, report):
+        raise NotFound("missing")
+
+    job, stats = run_queue(store, handler, lambda job, stats: job["status"] == "failed", retry_delay=0)
+    assert (job["attempts"], stats["retried"]) == (1, 0)
+
+
+def test_progress_is_written(store):
+    async def handler(job, report):
+        report(stage="extracting")
+        report(pages_done=2, pages_total=4)
+        await asyncio.sleep(0.2)
+        return {"pages": 4}
+
+    seen = []
+
+    def until(job, stats):
+        seen.append((job["stage"], job["pages_done"]))
+        return job["status"] == "succeeded"
+
+    job, stats = run_queue(store, handler, until)
+    assert job["result"] == {"pages": 4}
+    assert ("extracting", 2) in seen
+    assert stats["succeeded"] == 1
+
+
+def test_superseded_worker_drops_its_result(store):
+    async def handler(job, report):
+        # Another worker takes the job over while this one is still busy
+        store.requeue_stale(time.time() + 1)
+        store.claim()
+        return {"late": True}
+
+    job, stats = run_queue(store, handler, lambda job, stats: stats["superseded"] > 0)
+    assert job["status"] == "running"
+    assert job["result"] is None
+    assert (stats["superseded"], stats["succeeded"]) == (1, 0)
@@ -0,0 +1,69 @@
+import pytest
+
+from item_repair import (
+    MAX_ITEM_COUNT, fill_placeholders, item_quality, merge_items, parse_item_count, repair_slots,
+    requested_items,
+)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None), ("", None), ("  ", None),
+    (7, 7), ("7", 7), (" 7 ", 7), (3.0, 3),
+    (0, 1), (-4, 1), ("0", 1), (500, MAX_ITEM_COUNT),
+])
+def test_parse_item_count(value, expected):
+    assert parse_item_count(value) == expected
+
+
+@pytest.mark.parametrize("value", [True, False, 2.5, "ten", "3.0", [5], {"n": 5}])
+def test_parse_item_count_rejects(value):
+    with pytest.raises(ValueError):
+        parse_item_count(value)
+
+
+def test_requested_items_defaults_per_type():
+    assert requested_items("quiz", None) == 5
+    assert requested_items("assignment", {}) == 3
+    assert requested_items("quiz", {"num_questions": 8}) == 8
+
+
+def task(description, number=1):
+    return {"task_number": number, "description": description, "points": 10}
+
+
+TASKS = [
+    task("Explain how light intensity affects the rate of photosynthesis in plants."),
+    task(""),
+    task("Explain how light intensity affects the rate of photosynthesis in plants!"),
+    "not a task",
+]
+
+
+def test_task_report_lists_bad_and_missing_slots():
+    report = item_quality("assignment", list(TASKS), 6)
+    assert report["received"] == 4 and report["valid"] == 1 and report["missing"] == 2
+    assert [(entry["index"], entry["problems"]) for entry in report["invalid"]] == [
+        (1, ["missing_description"]), (2, ["duplicate"]), (3, ["not_an_object"]),
+    ]
+    assert report["invalid"][1]["duplicate_of"] == 0
+    assert repair_slots(report) == [1, 2, 3, 4, 5]
+
+
+def test_merge_fills_slots_in_order_and_renumbers_tasks():
+    items = list(TASKS)
+    replacements = [task("Design an experiment on osmosis."), "junk", task("Compare respiration in plants and animals.")]
+    filled = merge_items("assignment", items, [1, 4], replacements)
+    assert filled == [1, 4]
+    assert items[1]["description"] == "Design an experiment on osmosis."
+    assert (items[4]["task_number"], len(items)) == (5, 5)
+
+
+def test_placeholders_close_the_remaining_slots():
+    items = list(TASKS)
+    report = item_quality("assignment", items, 5)
+    placeholders = [task(f"Placeholder {n}", n + 1) for n in range(5)]
+    fill_placeholders(items, report, [1, 4], placeholders)
+    assert [items[1], items[4]] == [placeholders[1], placeholders[4]]
+    assert report["received"] == 5 and report["missing"] == 0
+    assert report["needs_regeneration"] == report["placeholders"] == [1, 4]
+    assert {"index": 4, "problems": ["missing"]} in report["invalid"]
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONParser
+
+DOCUMENT = {
+    "questions": [
+        {"question": 'Quoted "]}" brackets', "choices": {"A": "1", "B": "2"}},
+        {"question": "Second", "choices": {"A": "3", "B": "4"}},
+        {"question": "Third", "choices": {"A": "5", "B": "6"}},
+    ],
+    "metadata": {"count": 3},
+}
+TEXT = json.dumps(DOCUMENT)
+
+
+def parse(text, keys=("questions",), fragment=None):
+    parser = IncrementalJSONParser(keys)
+    emitted = []
+    step = fragment or max(len(text), 1)
+    for start in range(0, len(text), step):
+        emitted += parser.feed(text[start:start + step])
+    value, report = parser.finish()
+    return emitted, value, report
+
+
+@pytest.mark.parametrize("fragment", [1, 7, None])
+def test_complete_document(fragment):
+    emitted, value, report = parse(TEXT, fragment=fragment)
+    assert report is None
+    assert value == DOCUMENT
+    assert emitted == [("questions", q) for q in DOCUMENT["questions"]]
+
+
+def test_truncated_inside_an_element_keeps_the_complete_ones():
+    cut = TEXT.index('{"question": "Third"') + 20
+    emitted, value, report = parse(TEXT[:cut])
+    assert value == {"questions": DOCUMENT["questions"][:2]}
+    assert len(emitted) == 2
+    assert report["truncated"] is True
+    assert report["lost"] == "questions[2]"
+    assert report["received_chars"] == cut
+    assert report["recovered_items"] == {"questions": 2}
+    assert TEXT[:cut].endswith(report["dropped_text"])
+
+
+def test_truncated_between_elements_loses_nothing():
+    cut = TEXT.index('{"question": "Second"')
+    _, value, report = parse(TEXT[:cut])
+    assert value == {"questions": DOCUMENT["questions"][:1]}
+    assert report["truncated"] is True
+    assert report["lost"] is None
+
+
+def test_truncated_number_is_dropped():
+    # "2" could have been the start of "25"
+    _, value, report = parse('{"scores": [1, 2', keys=())
+    assert value == {"scores": [1]}
+    assert report["lost"] == "scores[1]"
+
+
+@pytest.mark.parametrize("text", ["", '{"questi'])
+def test_nothing_recoverable(text):
+    _, value, report = parse(text)
+    assert not value
+    assert report["truncated"] is True
+
+
+def test_invalid_json_is_not_reported_as_truncated():
+    _, value, report = parse("Sorry, I cannot help with that.")
+    assert value is None
+    assert report["truncated"] is False
+    assert report["recovered_chars"] == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from metrics import (
+    Histogram, MetricsRegistry, SpanRecorder, end_request_timing, start_request_timing,
+)
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, stage="gemini")
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{stage="gemini",le="0.1"} 2',
+        'latency_seconds_bucket{stage="gemini",le="1"} 3',
+        'latency_seconds_bucket{stage="gemini",le="+Inf"} 4',
+        'latency_seconds_sum{stage="gemini"} 3.65',
+        'latency_seconds_count{stage="gemini"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    counter = registry.counter("errors_total", "Errors", ["detail"])
+    counter.inc(detail='bad "quote"\\\n')
+    counter.inc(2, detail='bad "quote"\\\n')
+    assert 'errors_total{detail="bad \\"quote\\"\\\\\\n"} 3' in registry.render()
+
+
+def test_a_failing_collector_does_not_break_the_scrape():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+
+    def broken():
+        raise RuntimeError("stats unavailable")
+
+    registry.add_collector(broken)
+    registry.add_collector(lambda: [("queue_jobs", "gauge", "Jobs", [({"status": "queued"}, 2)])])
+    text = registry.render()
+    assert "requests_total 1" in text
+    assert 'queue_jobs{status="queued"} 2' in text
+
+
+def test_spans_feed_the_histogram_and_the_request_timing():
+    histogram = Histogram("stage_seconds", "Stages", ["stage", "type"])
+    recorder = SpanRecorder(histogram)
+    timing, token = start_request_timing()
+    try:
+        with recorder.span("prompt", "quiz"):
+            pass
+        with pytest.raises(ValueError):
+            with recorder.span("gemini", "quiz"):
+                raise ValueError("failed stages are timed too")
+    finally:
+        end_request_timing(token)
+    with recorder.span("outside"):
+        pass
+
+    assert [stage for stage, _ in timing.spans] == ["prompt", "gemini"]
+    header = timing.header_value()
+    assert header.startswith("prompt;dur=") and "total;dur=" in header
+    counts = [line for line in histogram.render() if "_count" in line]
+    assert len(counts) == 3
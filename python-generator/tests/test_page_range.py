@@ -0,0 +1,58 @@
+import pytest
+
+from pdf_extraction import format_page_range, page_in_ranges, parse_page_range, resolve_page_indices
+
+
+@pytest.mark.parametrize("spec", [None, "", "all", "ALL", "*", " , "])
+def test_every_page(spec):
+    assert parse_page_range(spec) is None
+    assert format_page_range(parse_page_range(spec)) == "all"
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("1-5,9,12-", [(1, 5), (9, 9), (12, None)]),
+    ("7", [(7, 7)]),
+    ("7-7", [(7, 7)]),
+    ("-4", [(1, 4)]),
+    (" 2 - 3 ", [(2, 3)]),
+])
+def test_parse(spec, expected):
+    assert parse_page_range(spec) == expected
+
+
+@pytest.mark.parametrize("spec, expected", [
+    # Out of order, overlapping and adjacent ranges are merged
+    ("3,1-2", "1-3"),
+    ("10-,3", "3,10-"),
+    ("1-3,2-8", "1-8"),
+    ("1-3,5-6", "1-3,5-6"),
+    # Everything after an open-ended range is already covered
+    ("1-3,2-8,20-,25-30", "1-8,20-"),
+    ("5-,1-2,6", "1-2,5-"),
+])
+def test_overlapping_ranges_are_merged(spec, expected):
+    assert format_page_range(parse_page_range(spec)) == expected
+
+
+@pytest.mark.parametrize("spec", ["0", "0-3", "5-1", "a", "a-b", "1-x", "1.5", "-1-3"])
+def test_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_page_range(spec)
+
+
+def test_format_round_trips():
+    for spec in ("1-5,9,12-", "3", "2-4,6-"):
+        assert format_page_range(parse_page_range(spec)) == spec
+
+
+def test_resolve_page_indices_clamps_to_document():
+    assert resolve_page_indices(parse_page_range("2-3,9-"), 10) == [1, 2, 8, 9]
+    assert resolve_page_indices(parse_page_range("8-20"), 10) == [7, 8, 9]
+    assert resolve_page_indices(parse_page_range("12-"), 10) == []
+    assert resolve_page_indices(None, 3) == [0, 1, 2]
+
+
+def test_page_in_ranges():
+    ranges = parse_page_range("1-3,5,8-")
+    assert [n for n in range(1, 11) if page_in_ranges(n, ranges)] == [1, 2, 3, 5, 8, 9, 10]
+    assert page_in_ranges(1000, None)
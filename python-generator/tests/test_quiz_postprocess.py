@@ -0,0 +1,65 @@
+import pytest
+
+from quiz_postprocess import PAIRWISE_MAX_TEXTS, find_near_duplicates, normalize_choices, postprocess_quiz
+
+TOPICS = ["photosynthesis", "mitochondria", "enzymes", "osmosis", "genetics", "evolution", "ecosystems",
+          "respiration", "proteins", "membranes", "chromosomes", "hormones", "digestion", "immunity"]
+
+
+def question(text, answer="A", choices=None):
+    return {"question": text, "answer": answer,
+            "choices": choices if choices is not None else {"A": "One", "B": "Two", "C": "Three", "D": "Four"}}
+
+
+@pytest.mark.parametrize("choices, expected", [
+    ({"B": "Two", "A": "One"}, [("A", "One"), ("B", "Two")]),
+    ({"a": " One ", "b": ""}, [("A", "One")]),
+    (["One", "Two"], [("A", "One"), ("B", "Two")]),
+    ([{"label": "c", "value": "Three"}, {"text": "Four"}], [("C", "Three"), ("B", "Four")]),
+    ("not choices", []),
+])
+def test_normalize_choices(choices, expected):
+    assert [(c["key"], c["text"]) for c in normalize_choices(choices)] == expected
+
+
+def test_quality_report():
+    questions = [
+        question("What does the cell use to produce glucose during photosynthesis?"),
+        question("Which organelle produces most of the cell's ATP?", answer="three"),
+        question("What does the cell use to produce glucose during photosynthesis ?"),
+        question("Which enzyme breaks down starch?", answer="E"),
+        question("How many chromosomes do humans have?", choices=["23", "46", "46"]),
+        "not a question",
+    ]
+    report = postprocess_quiz(questions, requested=8)
+    assert questions[1]["answer_text"] == "Three"
+    assert (report["received"], report["valid"], report["missing"]) == (6, 2, 2)
+    assert {entry["index"]: entry["problems"] for entry in report["invalid"]} == {
+        2: ["duplicate"],
+        3: ["answer_not_in_choices"],
+        4: ["choice_count", "duplicate_choices"],
+        5: ["not_an_object"],
+    }
+    assert report["invalid"][0]["duplicate_of"] == 0
+    assert report["needs_regeneration"] == [2, 3, 4, 5]
+
+
+def distinct_texts(n):
+    return [f"Explain the role of {TOPICS[i % len(TOPICS)]} in chapter {i} with example number {i * 7}"
+            f" about {TOPICS[(i * 5 + 3) % len(TOPICS)]} and {TOPICS[(i * 3 + 1) % len(TOPICS)]}"
+            for i in range(n)]
+
+
+@pytest.mark.parametrize("count", [5, PAIRWISE_MAX_TEXTS + 40])
+def test_near_duplicates_point_at_the_first_occurrence(count):
+    texts = distinct_texts(count)
+    texts.append(texts[2].upper())
+    texts.append(texts[3] + " again")
+    texts.append("")
+    found = find_near_duplicates(texts)
+    assert found == {count: 2, count + 1: 3}
+
+
+def test_no_duplicates_in_short_lists():
+    assert find_near_duplicates(["same words here"]) == {}
+    assert find_near_duplicates(["", ""]) == {}
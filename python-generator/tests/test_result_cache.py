@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from result_cache import (
+    MemoryResultBackend, ResultCache, SQLiteResultBackend, generation_fingerprint, parse_flag,
+)
+
+
+@pytest.mark.parametrize("value", [True, 1, 1.0, "true", "True", " TRUE ", "1", "yes", "on"])
+def test_flag_true(value):
+    assert parse_flag(value) is True
+
+
+@pytest.mark.parametrize("value", [False, 0, 2, None, "false", "False", "0", "no", "off", "", "maybe", [], {}])
+def test_flag_false(value):
+    assert parse_flag(value) is False
+
+
+def fingerprint(settings, query="Photosynthesis"):
+    return generation_fingerprint("doc", query, "quiz", "remember", settings, "model")
+
+
+def test_fingerprint_ignores_fresh_and_none():
+    base = fingerprint({"num_questions": 5})
+    assert fingerprint({"num_questions": 5, "fresh": True}) == base
+    assert fingerprint({"num_questions": 5, "fresh": "false"}) == base
+    assert fingerprint({"num_questions": 5, "length": None}) == base
+
+
+def test_fingerprint_canonicalizes_page_range_and_query():
+    assert fingerprint({"page_range": "3,1-2"}) == fingerprint({"page_range": "1-3"})
+    assert fingerprint({"page_range": "all"}) == fingerprint({"page_range": ""})
+    assert fingerprint({}, " Photosynthesis ") == fingerprint({})
+
+
+def test_fingerprint_depends_on_settings():
+    assert fingerprint({"num_questions": 5}) != fingerprint({"num_questions": 6})
+    assert fingerprint({"page_range": "1-3"}) != fingerprint({"page_range": "1-4"})
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryResultBackend(max_items=2)
+    return SQLiteResultBackend(str(tmp_path / "results.sqlite3"), max_items=2)
+
+
+def test_round_trip_and_stats(backend):
+    cache = ResultCache(backend, ttl_seconds=60)
+    assert cache.get("a") is None
+    cache.set("a", {"questions": [1, 2], "metadata": {}})
+    assert cache.get("a") == {"questions": [1, 2], "metadata": {}}
+    assert cache.stats() == {"hits": 1, "misses": 1, "stores": 1, "items": 1}
+
+
+def test_expired_entries_are_misses(backend):
+    backend.set("a", "{}", expires_at=1.0)
+    assert backend.get("a", now=2.0) is None
+    assert len(backend) == 0
+
+
+def test_least_recently_used_is_evicted(backend):
+    backend.set("a", "1", expires_at=1e12)
+    backend.set("b", "2", expires_at=1e12)
+    # Read "a" so that "b" becomes the oldest entry
+    backend.get("a", now=time.time() + 1)
+    backend.set("c", "3", expires_at=1e12)
+    assert len(backend) == 2
+    assert backend.get("b", now=1.0) is None
+    assert backend.get("a", now=1.0) == "1"
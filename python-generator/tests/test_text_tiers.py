@@ -0,0 +1,69 @@
+from benchmarks.corpus import build_pdf
+from pdf_extraction import TIER_FAST, TIER_LAYOUT, iter_page_texts, layout_reason, page_tier_summary
+
+TEXT = "Photosynthesis converts light energy into chemical energy. " * 5
+
+
+def rows(*row_spans, height=10.0):
+    """Text run rects (left, bottom, right, top): one row per entry, top to bottom"""
+    rects = []
+    for n, spans in enumerate(row_spans):
+        bottom = 700 - n * height * 1.5
+        rects += [(left, bottom, right, bottom + height) for left, right in spans]
+    return rects
+
+
+def test_single_column_text_is_trusted():
+    assert layout_reason(TEXT, rows(*[[(50, 550)]] * 20)) is None
+
+
+def test_runs_split_by_word_gaps_stay_one_line():
+    assert layout_reason(TEXT, rows(*[[(50, 200), (205, 550)]] * 20)) is None
+
+
+def test_bullets_and_page_numbers_are_not_columns():
+    bulleted = rows(*[[(50, 56), (80, 550)]] * 20)
+    assert layout_reason(TEXT, bulleted) is None
+
+
+def test_two_columns():
+    assert layout_reason(TEXT, rows(*[[(50, 280), (320, 550)]] * 20)) == "columns"
+
+
+def test_table():
+    table = rows(*[[(50, 150), (200, 300), (350, 450)]] * 10 + [[(50, 550)]] * 10)
+    assert layout_reason(TEXT, table) == "table"
+
+
+def test_a_few_split_rows_do_not_count():
+    mostly_text = rows(*[[(50, 280), (320, 550)]] * 2 + [[(50, 550)]] * 20)
+    assert layout_reason(TEXT, mostly_text) is None
+
+
+def test_empty_and_unmapped_text():
+    assert layout_reason("  \n", []) == "empty"
+    assert layout_reason("�� text \x01", rows([(50, 550)])) == "unmapped"
+
+
+def test_plain_pdf_uses_the_fast_tier_only():
+    pdf = build_pdf(3)
+    pages = list(iter_page_texts(pdf, [0, 2, 7]))
+    assert [(number, tier, reason) for number, _, tier, reason in pages] == [
+        (1, TIER_FAST, None), (3, TIER_FAST, None),
+    ]
+    assert all("Introduction to Biology" in text for _, text, _, _ in pages)
+
+    layout = list(iter_page_texts(pdf, [0, 2], fast_tier=False))
+    assert [tier for _, _, tier, _ in layout] == [TIER_LAYOUT, TIER_LAYOUT]
+    # Both tiers see the same words
+    assert [text.split() for _, text, _, _ in layout] == [text.split() for _, text, _, _ in pages]
+
+
+def test_tier_summary():
+    summary = page_tier_summary([(3, TIER_FAST, None), (1, TIER_FAST, None), (2, TIER_LAYOUT, "table"),
+                                 (4, TIER_FAST, None)])
+    assert summary == {
+        "pages": {TIER_FAST: 3, TIER_LAYOUT: 1},
+        "tiers": {TIER_FAST: "1,3-4", TIER_LAYOUT: "2"},
+        "layout_reasons": {"2": "table"},
+    }
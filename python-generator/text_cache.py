@@ -0,0 +1,278 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# EXTRACTED TEXT CACHE
+# ============================================================================
+#
+# Extracted text is stored under the SHA-256 of the PDF bytes, so the same file
+# uploaded twice is only parsed once. A small alias table maps "bucket/pdf_id"
+# to the digest last seen at that path, which lets /generate skip the Supabase
+# download entirely when the cache is warm.
+#
+# Two tiers:
+#   - memory: LRU of the most recently used texts
+#   - disk:   one file per digest, evicted least-recently-used first once the
+#             directory grows past its byte budget
+#
+# Sidecar files stored next to a text file and evicted with it:
+#   - <digest>.pages.json: page index of ingested documents (character
+#     offsets of every page in the text)
+#   - <digest>.tiers.json: the extraction tier used for every page
+#   - <digest>.artifacts.json: outline and summary tree built at ingestion
+#     (see document_artifacts)
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Hex SHA-256 digest of a byte string"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExtractedTextCache:
+    def __init__(self, cache_dir: str, memory_items: int = 32,
+                 disk_max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.disk_max_bytes = disk_max_bytes
+
+        self._text_dir = os.path.join(cache_dir, "text")
+        self._alias_dir = os.path.join(cache_dir, "alias")
+        os.makedirs(self._text_dir, exist_ok=True)
+        os.makedirs(self._alias_dir, exist_ok=True)
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._aliases: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    # ------------------------------------------------------------------
+    # Paths
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _alias_key(bucket_name: str, pdf_id: str) -> str:
+        return sha256_bytes(f"{bucket_name}/{pdf_id}".encode("utf-8"))
+
+    def _text_path(self, digest: str) -> str:
+        return os.path.join(self._text_dir, f"{digest}.txt")
+
+    def _page_index_path(self, digest: str) -> str:
+        return os.path.join(self._text_dir, f"{digest}.pages.json")
+
+    def _page_tiers_path(self, digest: str) -> str:
+        return os.path.join(self._text_dir, f"{digest}.tiers.json")
+
+    def _artifacts_path(self, digest: str) -> str:
+        return os.path.join(self._text_dir, f"{digest}.artifacts.json")
+
+    def _alias_path(self, alias_key: str) -> str:
+        return os.path.join(self._alias_dir, alias_key)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def digest_for(self, bucket_name: str, pdf_id: str) -> Optional[str]:
+        """Return the digest last stored for bucket/pdf_id, if any"""
+        alias_key = self._alias_key(bucket_name, pdf_id)
+        with self._lock:
+            digest = self._aliases.get(alias_key)
+        if digest:
+            return digest
+
+        try:
+            with open(self._alias_path(alias_key), "r", encoding="utf-8") as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Text cache alias read failed: {e}")
+            return None
+
+        if digest:
+            with self._lock:
+                self._aliases[alias_key] = digest
+        return digest or None
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return cached text for a content digest, checking memory then disk"""
+        with self._lock:
+            text = self._memory.get(digest)
+            if text is not None:
+                self._memory.move_to_end(digest)
+                self._stats["memory_hits"] += 1
+                return text
+
+        path = self._text_path(digest)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # Refresh mtime so disk eviction approximates LRU
+            os.utime(path, None)
+        except FileNotFoundError:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        except OSError as e:
+            logger.warning(f"Text cache read failed for {digest}: {e}")
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._remember(digest, text)
+        return text
+
+    def get_page_index(self, digest: str) -> Optional[List[Dict[str, int]]]:
+        """Return the stored page index for a content digest, if any"""
+        try:
+            with open(self._page_index_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Page index read failed for {digest}: {e}")
+            return None
+
+    def get_page_tiers(self, digest: str) -> Optional[List[Tuple[int, str, Optional[str]]]]:
+        """Return the stored (page, tier, reason) records for a digest, if any"""
+        try:
+            with open(self._page_tiers_path(digest), "r", encoding="utf-8") as f:
+                return [tuple(record) for record in json.load(f)]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Page tiers read failed for {digest}: {e}")
+            return None
+
+    def get_artifacts(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Return the stored document artifacts for a digest, if any"""
+        try:
+            with open(self._artifacts_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Document artifacts read failed for {digest}: {e}")
+            return None
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def put(self, digest: str, text: str, bucket_name: Optional[str] = None,
+            pdf_id: Optional[str] = None) -> None:
+        """Store text under its digest and (optionally) alias bucket/pdf_id to it"""
+        with self._lock:
+            self._remember(digest, text)
+
+        try:
+            path = self._text_path(digest)
+            if not os.path.exists(path):
+                self._write_atomic(path, text.encode("utf-8"))
+            else:
+                os.utime(path, None)
+            self._evict_disk()
+        except OSError as e:
+            # The memory tier still holds the entry; a broken disk is not fatal
+            logger.warning(f"Text cache write failed for {digest}: {e}")
+
+        if bucket_name and pdf_id:
+            self.set_alias(bucket_name, pdf_id, digest)
+
+    def put_page_index(self, digest: str, index: List[Dict[str, int]]) -> None:
+        """Store the page index for text already stored under digest"""
+        try:
+            self._write_atomic(self._page_index_path(digest),
+                               json.dumps(index, separators=(",", ":")).encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Page index write failed for {digest}: {e}")
+
+    def put_page_tiers(self, digest: str, page_tiers: List[Tuple[int, str, Optional[str]]]) -> None:
+        """Store the extraction tier records for text already stored under digest"""
+        try:
+            self._write_atomic(self._page_tiers_path(digest),
+                               json.dumps(page_tiers, separators=(",", ":")).encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Page tiers write failed for {digest}: {e}")
+
+    def put_artifacts(self, digest: str, artifacts: Dict[str, Any]) -> None:
+        """Store the document artifacts for text already stored under digest"""
+        try:
+            self._write_atomic(self._artifacts_path(digest),
+                               json.dumps(artifacts, ensure_ascii=False,
+                                          separators=(",", ":")).encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Document artifacts write failed for {digest}: {e}")
+
+    def set_alias(self, bucket_name: str, pdf_id: str, digest: str) -> None:
+        """Point bucket/pdf_id at the digest of the bytes currently stored there"""
+        alias_key = self._alias_key(bucket_name, pdf_id)
+        with self._lock:
+            self._aliases[alias_key] = digest
+        try:
+            self._write_atomic(self._alias_path(alias_key), digest.encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Text cache alias write failed for {bucket_name}/{pdf_id}: {e}")
+
+    def _remember(self, digest: str, text: str) -> None:
+        # Caller holds self._lock
+        self._memory[digest] = text
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        entries = []
+        total = 0
+        with os.scandir(self._text_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".txt"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        if total <= self.disk_max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                logger.info(f"Evicted cached text: {os.path.basename(path)}")
+            except FileNotFoundError:
+                pass
+            for suffix in (".pages.json", ".tiers.json", ".artifacts.json"):
+                try:
+                    os.unlink(f"{path[:-len('.txt')]}{suffix}")
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "memory_items": len(self._memory),
+            }